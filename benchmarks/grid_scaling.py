@@ -0,0 +1,131 @@
+"""Interactive frame times for large grids
+
+Runs headless (offscreen Qt platform) and prints, for each grid size, the time
+to generate the grid, build the crop handles, hit-test a handle, repaint one
+viewport at fit-to-window and 100% zoom, move a crop drag by one step (the
+move alone, then with the repaint it triggers), and round-trip the grid
+through a document.
+
+    python benchmarks/grid_scaling.py [--sizes 250 500 1000] [--repeat 10]
+"""
+import os
+import sys
+import json
+import time
+import tempfile
+import argparse
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from PyQt5.QtWidgets import QApplication
+from PyQt5.QtGui import QImage, QMouseEvent, QRegion
+from PyQt5.QtCore import Qt, QEvent, QPoint, QRect
+import puzzle_pieces_maker as puzzle
+
+
+VIEWPORT = QRect(0, 0, 1280, 900)
+IMAGE_SIZE = (4000, 3000)
+
+
+def median_ms(function, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append((time.perf_counter() - start) * 1000)
+    times.sort()
+    return times[len(times) // 2]
+
+
+def render_viewport(widget, target, origin):
+    """Repaint one viewport-sized area of the widget, as a scroll area would"""
+    widget.render(target, QPoint(), QRegion(VIEWPORT.translated(origin)))
+
+
+def handle_position(widget, row, col):
+    handles = widget.get_drag_handles()
+    index = next(i for i in range(len(handles)) if handles.rows[i] == row and handles.cols[i] == col)
+    return QPoint(*(int(value) for value in handles.positions[index]))
+
+
+def mouse_event(event_type, pos):
+    return QMouseEvent(event_type, pos, Qt.LeftButton, Qt.LeftButton, Qt.NoModifier)
+
+
+def benchmark_size(widget, squares, repeat):
+    results = {}
+    results["generate"] = median_ms(lambda: widget.set_grid(squares, squares), 3)
+    widget.set_crop_mode(True)
+    results["handles"] = median_ms(widget.create_drag_handles, 3)
+
+    far_handle = handle_position(widget, squares, squares // 2)
+    results["hit_test"] = median_ms(lambda: widget.mousePressEvent(mouse_event(QEvent.MouseButtonPress, far_handle))
+                                    or widget.cancel_drag_operation(), repeat)
+
+    target = QImage(VIEWPORT.size(), QImage.Format_RGB32)
+    fit_zoom = min(VIEWPORT.width() / IMAGE_SIZE[0], VIEWPORT.height() / IMAGE_SIZE[1])
+    widget.set_zoom(fit_zoom)
+    results["frame_fit"] = median_ms(lambda: render_viewport(widget, target, QPoint()), repeat)
+    widget.set_zoom(1.0)
+    centre = QPoint(IMAGE_SIZE[0] // 2, IMAGE_SIZE[1] // 2)
+    results["frame_100"] = median_ms(lambda: render_viewport(widget, target, centre), repeat)
+
+    # One drag step: the move itself plus the repaint it triggers
+    widget.set_zoom(fit_zoom)
+    widget.create_drag_handles()
+    position = handle_position(widget, 0, 0)
+    widget.mousePressEvent(mouse_event(QEvent.MouseButtonPress, position))
+
+    def drag_move():
+        position.setX(position.x() + 1)
+        widget.mouseMoveEvent(mouse_event(QEvent.MouseMove, position))
+    results["drag_move"] = median_ms(drag_move, repeat)
+
+    def drag_step():
+        drag_move()
+        render_viewport(widget, target, QPoint())
+    results["drag_step"] = median_ms(drag_step, repeat)
+    widget.mouseReleaseEvent(mouse_event(QEvent.MouseButtonRelease, position))
+    widget.set_crop_mode(False)
+
+    # Document round trip of the grid points, written the way the viewer writes them
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "grid.puz.json")
+
+        def round_trip():
+            with open(path, "w") as json_file:
+                json.dump({"grid_points": widget.grid_points.tolist()}, json_file, indent=None)
+            with open(path) as json_file:
+                widget.set_grid_points(json.load(json_file)["grid_points"])
+        results["save_load"] = median_ms(round_trip, 3)
+        results["document_mb"] = os.path.getsize(path) / 1e6
+
+    index = widget.get_grid_index()
+    results["grid_mb"] = (widget.grid_points.nbytes + index.row_bounds.nbytes + index.col_bounds.nbytes) / 1e6
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[250, 500, 1000])
+    parser.add_argument("--repeat", type=int, default=10)
+    args = parser.parse_args()
+
+    app = QApplication(sys.argv)
+    image = QImage(IMAGE_SIZE[0], IMAGE_SIZE[1], QImage.Format_RGB32)
+    image.fill(Qt.darkCyan)
+    widget = puzzle.ImageGridWidget()
+    widget.set_image_and_grid(image, 10, 10)
+
+    columns = ["generate", "handles", "hit_test", "frame_fit", "frame_100", "drag_move", "drag_step", "save_load"]
+    print(f"{'grid':>10} " + " ".join(f"{name:>10}" for name in columns) + f" {'grid MB':>8} {'doc MB':>8}")
+    for squares in args.sizes:
+        results = benchmark_size(widget, squares, args.repeat)
+        print(f"{squares:>4}x{squares:<5} " + " ".join(f"{results[name]:>8.1f}ms" for name in columns)
+              + f" {results['grid_mb']:>8.1f} {results['document_mb']:>8.1f}")
+    app.quit()
+
+
+if __name__ == "__main__":
+    main()
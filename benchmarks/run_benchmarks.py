@@ -0,0 +1,464 @@
+"""Headless benchmark suite for Puzzle Pieces Maker
+
+Drives PuzzleGridViewer and ImageGridWidget under the offscreen Qt platform,
+so it runs on a CI box without a display. For every sample image in
+EyePuzPicts and every grid size it sweeps the zoom levels (cold and warm
+cache), replays synthetic perimeter drags through mousePressEvent /
+mouseMoveEvent / mouseReleaseEvent, and times _save_document_to_file /
+load_document_from_path round trips with the grid in the JSON and in a
+binary grid file. It also checks with tracemalloc that crop and endpoint
+drag moves allocate nothing that grows with the grid, and that resizes
+never re-render the image, and fails if either does.
+
+    python benchmarks/run_benchmarks.py                  # run and write benchmarks/last_run.json
+    python benchmarks/run_benchmarks.py --save-baseline  # run and make the results the baseline
+    python benchmarks/run_benchmarks.py --compare        # run and exit 1 if a tracked metric regressed
+    python benchmarks/run_benchmarks.py --quick          # two images, 10/100/1000 grids
+
+Metrics are keyed "<image>/<grid>/<metric>". Every metric ending in _ms is
+tracked by --compare except the p95/max tail latencies; lower is better.
+Each image/grid scenario runs --repeat times and the median is recorded,
+along with the spread (slowest minus fastest run) of every tracked metric.
+A metric only counts as regressed when it is slower by more than the
+tolerance, --min-delta-ms and NOISE_SPREADS times its baseline spread, so
+short metrics that swing by a few frames don't trip --compare.
+"""
+import os
+import sys
+import json
+import glob
+import time
+import argparse
+import platform
+import tempfile
+import tracemalloc
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCHMARK_DIR)
+sys.path.insert(0, REPO_DIR)
+
+import numpy as np
+from PyQt5.QtWidgets import QApplication
+from PyQt5.QtGui import QImage, QMouseEvent
+from PyQt5.QtCore import Qt, QEvent, QPoint, QT_VERSION_STR, PYQT_VERSION_STR
+import puzzle_pieces_maker as puzzle
+from puzzle_document import grid_file_path_for
+
+
+DEFAULT_GRIDS = [10, 100, 250, 500, 1000]
+QUICK_GRIDS = [10, 100, 1000]
+ZOOMS = [0.1, 0.25, 0.5, 1.0, 2.0, 4.0]
+DRAG_STEPS = 30
+REPEAT = 3
+WINDOW_SIZE = (1280, 900)
+BASELINE_PATH = os.path.join(BENCHMARK_DIR, "baseline.json")
+RESULTS_PATH = os.path.join(BENCHMARK_DIR, "last_run.json")
+TRACKED_SUFFIX = "_ms"
+UNTRACKED_SUFFIXES = ("_p95_ms", "_max_ms")  # Tail latencies are reported but too noisy to gate on
+NOISE_SPREADS = 2  # A slowdown within this many baseline run-to-run spreads is noise
+# Environment entries that change the timings; a baseline recorded under others isn't comparable
+VERSION_KEYS = ("python", "qt", "pyqt", "numpy", "machine", "qpa_platform")
+# Peak memory one drag move may allocate: NumPy reduction buffers of about 1 KB, Qt wrappers and scalars,
+# whatever the grid size (a single row of a 1000x1000 grid is 16 KB)
+MAX_DRAG_MOVE_ALLOCATION = 16 * 1024
+
+
+def elapsed_ms(started):
+    return (time.perf_counter() - started) * 1000
+
+
+def percentile(values, point):
+    return float(np.percentile(values, point)) if len(values) else 0.0
+
+
+def mouse_event(event_type, pos, buttons=Qt.LeftButton):
+    return QMouseEvent(event_type, pos, Qt.LeftButton, buttons, Qt.NoModifier)
+
+
+class BenchmarkRunner:
+    def __init__(self, app, drag_steps=DRAG_STEPS, zooms=ZOOMS, repeat=REPEAT):
+        self.app = app
+        self.repeat = repeat
+        self.drag_steps = drag_steps
+        self.zooms = zooms
+        self.viewer = puzzle.PuzzleGridViewer()
+        self.viewer.resize(*WINDOW_SIZE)
+        self.viewer.show()
+        self.widget = self.viewer.image_widget
+        self.settle()
+
+    def settle(self):
+        """Deliver pending resize/paint events, which is where the rendering work happens"""
+        self.app.processEvents()
+
+    def open_image(self, image, image_path, squares):
+        viewer = self.viewer
+        viewer.clear_edit_modes()
+        # As Open Image does: the edits that follow must not be journaled against the last round trip's
+        # document, or its recovery snapshot lands in the middle of a later measurement
+        viewer.autosave.discard()
+        # Loading a document restores its saved window geometry, clamped to the (offscreen) screen
+        viewer.resize(*WINDOW_SIZE)
+        viewer.current_image_path = image_path
+        viewer.current_document_path = None
+        # Start from a cold cache, or whether the fit-to-window render survived the previous
+        # scenario's zoom sweep decides the time
+        self.widget.scaled_cache.clear()
+        self.widget.tile_cache.clear()
+        self.widget.set_image_and_grid(image, squares, squares)
+        viewer.zoom_fit()
+        self.widget.finish_zoom_preview()
+        self.settle()
+
+    def zoom_sweep(self):
+        """Time each zoom step, from the interactive preview to the smooth render, with a cold and a warm cache"""
+        results = {}
+        self.widget.scaled_cache.clear(self.widget.image_source_key())
+        self.widget.tile_cache.clear(self.widget.image_source_key())
+        for label in ("cold", "warm"):
+            step_times = []
+            for zoom in self.zooms:
+                started = time.perf_counter()
+                self.viewer.apply_zoom(zoom)
+                self.settle()
+                self.widget.finish_zoom_preview()
+                self.settle()
+                step_times.append(elapsed_ms(started))
+            results[f"zoom_{label}_p50_ms"] = percentile(step_times, 50)
+            results[f"zoom_{label}_max_ms"] = max(step_times)
+        return results
+
+    def handle_position(self, row, col):
+        handles = self.widget.get_drag_handles()
+        index = np.flatnonzero((handles.rows == row) & (handles.cols == col))[0]
+        return QPoint(*(int(value) for value in handles.positions[index]))
+
+    def perimeter_drags(self, squares):
+        """Drag a corner, a top-edge and a right-edge handle inwards, step by step"""
+        viewer = self.viewer
+        widget = self.widget
+        viewer.zoom_fit()
+        widget.finish_zoom_preview()
+        viewer.crop_button.setChecked(True)
+        viewer.toggle_crop_mode()
+        self.settle()
+
+        move_times = []
+        press_times = []
+        release_times = []
+        middle = squares // 2
+        for row, col, direction in ((0, 0, QPoint(1, 1)), (0, middle, QPoint(0, 1)), (middle, squares, QPoint(-1, 0))):
+            position = self.handle_position(row, col)
+            viewer.scroll_area.ensureVisible(position.x(), position.y())
+            self.settle()
+
+            started = time.perf_counter()
+            widget.mousePressEvent(mouse_event(QEvent.MouseButtonPress, position))
+            self.settle()
+            press_times.append(elapsed_ms(started))
+            for _ in range(self.drag_steps):
+                position += direction
+                started = time.perf_counter()
+                widget.mouseMoveEvent(mouse_event(QEvent.MouseMove, position))
+                self.settle()
+                move_times.append(elapsed_ms(started))
+            started = time.perf_counter()
+            widget.mouseReleaseEvent(mouse_event(QEvent.MouseButtonRelease, position, Qt.NoButton))
+            self.settle()
+            release_times.append(elapsed_ms(started))
+
+        viewer.clear_edit_modes()
+        self.settle()
+        return {
+            "drag_press_p50_ms": percentile(press_times, 50),
+            "drag_move_p50_ms": percentile(move_times, 50),
+            "drag_move_p95_ms": percentile(move_times, 95),
+            "drag_release_p50_ms": percentile(release_times, 50),
+        }
+
+    def drag_move_allocations(self, squares, moves=50):
+        """Peak bytes traced (tracemalloc) over drag moves once a crop and an endpoint drag are under way
+
+        Moves only: no events are processed in between, so painting is not counted.
+        """
+        viewer = self.viewer
+        widget = self.widget
+        viewer.zoom_fit()
+        widget.finish_zoom_preview()
+        results = {}
+        for mode, button, toggle, row, col in (
+                ("crop", viewer.crop_button, viewer.toggle_crop_mode, 0, 0),
+                ("endpoint", viewer.drag_endpoints_button, viewer.toggle_drag_endpoints_mode,
+                 squares // 2, squares // 2)):
+            if mode == "endpoint" and squares < 2:
+                continue
+            button.setChecked(True)
+            toggle()
+            self.settle()
+            position = self.handle_position(row, col)
+            widget.mousePressEvent(mouse_event(QEvent.MouseButtonPress, position))
+            # A few moves first, so one-off setup is out of the way
+            events = [mouse_event(QEvent.MouseMove, position + QPoint(step % 2, step % 2)) for step in range(moves + 20)]
+            for event in events[:20]:
+                widget.mouseMoveEvent(event)
+
+            peak = 0
+            tracemalloc.start()
+            try:
+                for event in events[20:]:
+                    tracemalloc.reset_peak()
+                    before = tracemalloc.get_traced_memory()[0]
+                    widget.mouseMoveEvent(event)
+                    peak = max(peak, tracemalloc.get_traced_memory()[1] - before)
+            finally:
+                tracemalloc.stop()
+            widget.mouseReleaseEvent(mouse_event(QEvent.MouseButtonRelease, position, Qt.NoButton))
+            viewer.clear_edit_modes()
+            self.settle()
+            if peak > MAX_DRAG_MOVE_ALLOCATION:
+                raise RuntimeError(f"{mode} drag moves on a {squares}x{squares} grid allocated {peak} bytes "
+                                   f"(at most {MAX_DRAG_MOVE_ALLOCATION} expected)")
+            results[f"{mode}_move_alloc_kb"] = peak / 1024
+        return results
+
+    def resize_renders(self):
+        """Count base image renders caused by window and widget resizes, and by one preview zoom step
+
+        Resizes only move things around, so they must not render; a preview zoom
+        renders once, fast, and leaves the smooth scale to the idle timer.
+        """
+        viewer = self.viewer
+        widget = self.widget
+        viewer.zoom_fit()
+        widget.finish_zoom_preview()
+        self.settle()
+        generation = widget.render_generation
+        for width, height in ((WINDOW_SIZE[0] - 200, WINDOW_SIZE[1] - 150), (WINDOW_SIZE[0] + 100, WINDOW_SIZE[1]),
+                              WINDOW_SIZE):
+            viewer.resize(width, height)
+            self.settle()
+        # The widget's own size follows the zoom, whatever it is resized to
+        expected_size = widget.size()
+        widget.resize(expected_size.width() + 50, expected_size.height() + 50)
+        self.settle()
+        resize_renders = widget.render_generation - generation
+        if resize_renders or widget.size() != expected_size:
+            raise RuntimeError(f"Resizing re-rendered the image {resize_renders} times "
+                               f"(widget {widget.width()}x{widget.height()})")
+
+        # With nothing cached, a smooth scale on screen right after the step means it was rendered synchronously
+        widget.scaled_cache.clear(widget.image_source_key())
+        generation = widget.render_generation
+        widget.set_zoom(widget.zoom_factor * 0.87, preview=True)
+        self.settle()
+        preview_renders = widget.render_generation - generation
+        if preview_renders != 1 or not widget.preview_active:
+            raise RuntimeError(f"A preview zoom step rendered {preview_renders} times "
+                               f"({'preview' if widget.preview_active else 'smooth'} on screen)")
+        widget.finish_zoom_preview()
+        self.settle()
+        viewer.zoom_fit()
+        widget.finish_zoom_preview()
+        self.settle()
+        return {"resize_renders": resize_renders, "preview_zoom_renders": preview_renders}
+
+    def save_load_round_trip(self, directory, grid_format="json"):
+        viewer = self.viewer
+        path = os.path.join(directory, f"benchmark-{grid_format}.puz.json")
+        expected = self.widget.grid_points.copy()
+
+        viewer.grid_format = grid_format
+        started = time.perf_counter()
+        if not viewer._save_document_to_file(path, notify=False):
+            raise RuntimeError(f"Saving {path} failed")
+        save_ms = elapsed_ms(started)
+
+        started = time.perf_counter()
+        if not viewer.load_document_from_path(path, recover=False):
+            raise RuntimeError(f"Loading {path} failed")
+        load_ms = elapsed_ms(started)
+        viewer.wait_for_image_load()
+        self.settle()
+        load_complete_ms = elapsed_ms(started)
+
+        if not np.array_equal(self.widget.grid_points, expected):
+            raise RuntimeError(f"Grid points changed in the save/load round trip of {path}")
+        document_bytes = os.path.getsize(path)
+        if os.path.exists(grid_file_path_for(path)):
+            document_bytes += os.path.getsize(grid_file_path_for(path))
+        # The JSON round trip keeps the metric names it always had
+        prefix = "" if grid_format == "json" else f"{grid_format}_"
+        return {
+            f"{prefix}save_ms": save_ms,
+            f"{prefix}load_ms": load_ms,
+            f"{prefix}load_complete_ms": load_complete_ms,
+            f"{prefix}document_kb": document_bytes / 1024,
+        }
+
+    def run_scenario(self, image, image_path, squares, directory):
+        started = time.perf_counter()
+        self.open_image(image, image_path, squares)
+        results = {"open_grid_ms": elapsed_ms(started)}
+        self.widget.perf.reset()
+        results.update(self.zoom_sweep())
+        results.update(self.perimeter_drags(squares))
+        results.update(self.drag_move_allocations(squares))
+        results.update(self.resize_renders())
+        paint = self.widget.perf.percentiles_ms("paint")
+        if paint:
+            results["paint_p50_ms"], results["paint_p95_ms"] = paint[0], paint[1]
+        results.update(self.save_load_round_trip(directory))
+        results.update(self.save_load_round_trip(directory, "binary"))
+        return results
+
+    def run(self, image_paths, grids, log=print):
+        """(metrics, spread): the median of every metric over the repeats, and the spread of the tracked ones"""
+        metrics = {}
+        spread = {}
+        with tempfile.TemporaryDirectory() as directory:
+            for image_path in image_paths:
+                image_name = os.path.splitext(os.path.basename(image_path))[0]
+                started = time.perf_counter()
+                image = QImage(image_path)
+                decode_ms = elapsed_ms(started)
+                if image.isNull():
+                    raise RuntimeError(f"Could not read {image_path}")
+                metrics[f"{image_name}/decode_ms"] = round(decode_ms, 3)
+
+                for squares in grids:
+                    runs = [self.run_scenario(image, image_path, squares, directory) for _ in range(self.repeat)]
+                    # The median of the repeats keeps one noisy run from tripping --compare
+                    results = {name: float(np.median([run[name] for run in runs])) for name in runs[0]}
+
+                    prefix = f"{image_name}/{squares}x{squares}"
+                    for name, value in results.items():
+                        metrics[f"{prefix}/{name}"] = round(value, 3)
+                        if is_tracked(name):
+                            values = [run[name] for run in runs]
+                            spread[f"{prefix}/{name}"] = round(max(values) - min(values), 3)
+                    log(f"{prefix:<22} zoom {results['zoom_cold_p50_ms']:7.1f} ms  "
+                        f"drag {results['drag_move_p50_ms']:6.1f}/{results['drag_move_p95_ms']:6.1f} ms  "
+                        f"save {results['save_ms']:7.1f} ms  load {results['load_complete_ms']:7.1f} ms  "
+                        f"binary {results['binary_save_ms']:6.1f}/{results['binary_load_ms']:6.1f} ms")
+        return metrics, spread
+
+
+def environment():
+    return {
+        "python": platform.python_version(),
+        "qt": QT_VERSION_STR,
+        "pyqt": PYQT_VERSION_STR,
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "qpa_platform": os.environ.get("QT_QPA_PLATFORM"),
+    }
+
+
+def write_results(path, metrics, spread, settings):
+    document = {
+        "version": 2,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "environment": environment(),
+        "settings": settings,
+        "metrics": metrics,
+        "spread": spread,
+    }
+    temp_path = path + ".tmp"
+    with open(temp_path, "w") as results_file:
+        json.dump(document, results_file, indent=2, sort_keys=True)
+    os.replace(temp_path, path)
+
+
+def is_tracked(key):
+    return key.endswith(TRACKED_SUFFIX) and not key.endswith(UNTRACKED_SUFFIXES)
+
+
+def compare(baseline, metrics, tolerance, min_delta_ms, spread=None):
+    """Tracked metrics that got slower than the baseline by more than tolerance, min_delta_ms and the noise"""
+    spread = spread or {}
+    regressions = []
+    for key, base_value in sorted(baseline.items()):
+        if not is_tracked(key) or key not in metrics:
+            continue
+        value = metrics[key]
+        allowed_delta = max(min_delta_ms, NOISE_SPREADS * spread.get(key, 0.0))
+        if value > base_value * (1 + tolerance) and value - base_value > allowed_delta:
+            regressions.append((key, base_value, value))
+    return regressions
+
+
+def environment_differences(baseline_environment):
+    """(key, baseline value, current value) of the versions that differ from the baseline's"""
+    current = environment()
+    return [(key, baseline_environment.get(key), current[key]) for key in VERSION_KEYS
+            if baseline_environment.get(key) != current[key]]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Headless benchmarks for Puzzle Pieces Maker.")
+    parser.add_argument("--images", nargs="+", help="images to benchmark (default: EyePuzPicts/*.jpg)")
+    parser.add_argument("--grids", type=int, nargs="+", help=f"grid sizes (default: {DEFAULT_GRIDS})")
+    parser.add_argument("--quick", action="store_true", help="two images and grids of 10, 100 and 1000 only")
+    parser.add_argument("--repeat", type=int, default=REPEAT, help="runs per image and grid; the median is kept")
+    parser.add_argument("--drag-steps", type=int, default=DRAG_STEPS, help="mouse moves per synthetic drag")
+    parser.add_argument("--output", default=RESULTS_PATH, help="where to write the results")
+    parser.add_argument("--baseline", default=BASELINE_PATH, help="baseline file for --compare/--save-baseline")
+    parser.add_argument("--save-baseline", action="store_true", help="also write the results as the baseline")
+    parser.add_argument("--compare", action="store_true", help="exit with status 1 if a metric regressed")
+    parser.add_argument("--tolerance", type=float, default=0.5,
+                        help="allowed slowdown as a fraction of the baseline (default 0.5)")
+    parser.add_argument("--min-delta-ms", type=float, default=5.0,
+                        help="ignore slowdowns smaller than this many milliseconds (default 5)")
+    args = parser.parse_args()
+
+    image_paths = args.images or sorted(glob.glob(os.path.join(REPO_DIR, "EyePuzPicts", "*.jpg")))
+    grids = args.grids or (QUICK_GRIDS if args.quick else DEFAULT_GRIDS)
+    if args.quick and not args.images:
+        image_paths = image_paths[:2]
+    if not image_paths:
+        parser.error("no images to benchmark")
+
+    app = QApplication(sys.argv[:1])
+    runner = BenchmarkRunner(app, drag_steps=args.drag_steps, repeat=max(1, args.repeat))
+    settings = {
+        "images": [os.path.basename(path) for path in image_paths],
+        "grids": grids,
+        "zooms": runner.zooms,
+        "drag_steps": args.drag_steps,
+        "repeat": runner.repeat,
+        "window_size": list(WINDOW_SIZE),
+    }
+    metrics, spread = runner.run(image_paths, grids)
+    write_results(args.output, metrics, spread, settings)
+    print(f"Results written to {args.output}")
+
+    if args.save_baseline:
+        write_results(args.baseline, metrics, spread, settings)
+        print(f"Baseline written to {args.baseline}")
+
+    if args.compare:
+        with open(args.baseline) as baseline_file:
+            baseline_document = json.load(baseline_file)
+        baseline = baseline_document["metrics"]
+        for key, base_value, value in environment_differences(baseline_document.get("environment", {})):
+            print(f"WARNING baseline was recorded with {key} {base_value}, this run uses {value}")
+        regressions = compare(baseline, metrics, args.tolerance, args.min_delta_ms, baseline_document.get("spread"))
+        compared = sum(1 for key in baseline if is_tracked(key) and key in metrics)
+        for key, base_value, value in regressions:
+            print(f"REGRESSION {key}: {base_value:.1f} ms -> {value:.1f} ms ({value / base_value - 1:+.0%})")
+        # Metrics added since the baseline was recorded aren't compared until it is recorded again
+        unbaselined = sorted(key for key in metrics if key not in baseline)
+        if unbaselined:
+            print(f"{len(unbaselined)} metrics are not in the baseline (e.g. {unbaselined[0]}); "
+                  f"record it again with --save-baseline")
+        print(f"{len(regressions)} of {compared} tracked metrics regressed "
+              f"(tolerance {args.tolerance:.0%}, min delta {args.min_delta_ms} ms, "
+              f"{NOISE_SPREADS}x the baseline spread)")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,263 @@
+"""Pack cut puzzle pieces into atlas textures
+
+Instead of one PNG per piece, every cell of the grid goes into one or a few
+atlas images, packed with the MaxRects algorithm (best short side fit, no
+rotation), plus an index recording each piece's grid (row, col), its rectangle
+in the atlas and the source quadrilateral it was cut from.
+
+Piece sizes follow from grid_points alone, so the packing is done up front in
+the main process. The atlases live in shared memory: the same band workers
+as for PNG export cut their pieces and paint them straight into their packed
+rectangles, which never overlap, so no pixels are sent between processes.
+
+    python puzzle_export.py DOCUMENT --output DIR --atlas [--atlas-size 4096] [--padding 2]
+"""
+import os
+import json
+import math
+import numpy as np
+from multiprocessing import shared_memory
+from puzzle_log import io_log
+from puzzle_export import (cell_quad, quad_bounds, band_tasks, run_pool, cut_band, load_export_source)
+
+
+DEFAULT_ATLAS_SIZE = 4096
+DEFAULT_PADDING = 2  # Transparent pixels between pieces, so texture filtering doesn't bleed neighbours in
+
+INDEX_FIELDS = ["row", "col", "atlas", "x", "y", "width", "height", "source_x", "source_y", "quad"]
+
+
+class MaxRectsPacker:
+    """One atlas page packed with MaxRects, best short side fit, without rotation
+
+    free_rects holds the maximal free rectangles as (left, top, right, bottom)
+    rows; placing a rectangle splits every free one it overlaps, and free
+    rectangles contained in another are dropped. The scans are vectorised,
+    since the free list grows to thousands of entries for irregular pieces.
+    """
+
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+        self.free_rects = np.array([[0, 0, width, height]], dtype=np.int64)
+        self.used_width = 0
+        self.used_height = 0
+
+    def insert(self, width, height):
+        """Place a width x height rectangle; returns its (x, y), or None if it doesn't fit"""
+        free = self.free_rects
+        leftover_x = free[:, 2] - free[:, 0] - width
+        leftover_y = free[:, 3] - free[:, 1] - height
+        fits = (leftover_x >= 0) & (leftover_y >= 0)
+        if not fits.any():
+            return None
+        # Shortest leftover side first, the longer one breaks ties
+        score = np.minimum(leftover_x, leftover_y) * (2 * (self.width + self.height)) + np.maximum(leftover_x, leftover_y)
+        score[~fits] = np.iinfo(np.int64).max
+        x, y = (int(value) for value in free[np.argmin(score), :2])
+        self.place(x, y, width, height)
+        return x, y
+
+    def place(self, x, y, width, height):
+        right, bottom = x + width, y + height
+        free = self.free_rects
+        overlapping = (free[:, 0] < right) & (free[:, 2] > x) & (free[:, 1] < bottom) & (free[:, 3] > y)
+        kept = free[~overlapping]
+
+        # The parts of each overlapped free rectangle left of, right of, above and below the placed one
+        split = []
+        for free_left, free_top, free_right, free_bottom in free[overlapping].tolist():
+            if x > free_left:
+                split.append((free_left, free_top, x, free_bottom))
+            if right < free_right:
+                split.append((right, free_top, free_right, free_bottom))
+            if y > free_top:
+                split.append((free_left, free_top, free_right, y))
+            if bottom < free_bottom:
+                split.append((free_left, bottom, free_right, free_bottom))
+        if split:
+            split = np.unique(np.array(split, dtype=np.int64), axis=0)
+            # The kept rectangles are already maximal among themselves; only the new ones need checking
+            inside_kept = contained(split, kept).any(axis=0)
+            inside_split = contained(split, split)
+            np.fill_diagonal(inside_split, False)
+            split = split[~(inside_kept | inside_split.any(axis=0))]
+            kept = kept[~contained(kept, split).any(axis=0)]
+            self.free_rects = np.concatenate([kept, split])
+        else:
+            self.free_rects = kept
+        self.used_width = max(self.used_width, right)
+        self.used_height = max(self.used_height, bottom)
+
+
+def contained(inner, outer):
+    """(len(outer), len(inner)) matrix: True where outer rectangle i contains inner rectangle j"""
+    return ((outer[:, None, 0] <= inner[None, :, 0]) & (outer[:, None, 1] <= inner[None, :, 1])
+            & (outer[:, None, 2] >= inner[None, :, 2]) & (outer[:, None, 3] >= inner[None, :, 3]))
+
+
+def pack_page(sizes, indices, width, height):
+    """Pack the given sizes into one width x height page; the (x, y) of each, or None if they don't all fit"""
+    packer = MaxRectsPacker(width, height)
+    positions = []
+    for index in indices:
+        position = packer.insert(*sizes[index])
+        if position is None:
+            return None, packer
+        positions.append(position)
+    return positions, packer
+
+
+def pack_rectangles(sizes, atlas_size, padding):
+    """Pack (width, height) sizes into as few atlas_size pages as needed
+
+    Returns the (page, x, y) of every size, in input order, and the packers of the pages.
+    """
+    padded = [(width + padding, height + padding) for width, height in sizes]
+    too_big = [size for size in sizes if max(size) + padding > atlas_size]
+    if too_big:
+        raise ValueError(f"A {too_big[0][0]}x{too_big[0][1]} piece does not fit a {atlas_size} atlas")
+    if not sizes:
+        # Every cell was empty (a collapsed grid, or one entirely outside the image): no pages
+        return [], []
+
+    placements = [None] * len(sizes)
+    pages = []
+    page_indices = []
+    # Large pieces first; filling in around them with the small ones packs densest
+    order = sorted(range(len(sizes)), key=lambda index: (-padded[index][1], -padded[index][0]))
+    for index in order:
+        for page, packer in enumerate(pages):
+            position = packer.insert(*padded[index])
+            if position is not None:
+                break
+        else:
+            page = len(pages)
+            pages.append(MaxRectsPacker(atlas_size, atlas_size))
+            page_indices.append([])
+            position = pages[page].insert(*padded[index])
+        placements[index] = (page, position[0], position[1])
+        page_indices[page].append(index)
+
+    # The last page is usually partly empty: repack it into the smallest square that holds it
+    last = len(pages) - 1
+    # (starting from the area it would take at 95% fill, which MaxRects rarely beats)
+    side = math.ceil(math.sqrt(sum(padded[index][0] * padded[index][1] for index in page_indices[last]) / 0.95))
+    while side < max(pages[last].used_width, pages[last].used_height):
+        positions, packer = pack_page(padded, page_indices[last], side, side)
+        if positions is not None:
+            pages[last] = packer
+            for index, (x, y) in zip(page_indices[last], positions):
+                placements[index] = (last, x, y)
+            break
+        side = math.ceil(side * 1.03)
+    return placements, pages
+
+
+def paint_band_into_atlases(task):
+    """Worker: cut one band and paint its pieces into their places in the shared-memory atlases"""
+    from PyQt5 import sip
+    from PyQt5.QtGui import QImage, QPainter
+
+    image_path, band_points, first_row, image_size, placements, atlases = task
+    opened = {}  # Atlas page -> (shared memory, pixel array, QImage, QPainter)
+    try:
+        for row, col, _bounds, piece in cut_band(image_path, band_points, first_row, image_size):
+            page, x, y = placements[row, col]
+            if page not in opened:
+                name, width, height = atlases[page]
+                memory = shared_memory.SharedMemory(name=name)
+                pixels = np.ndarray((height, width, 4), dtype=np.uint8, buffer=memory.buf)
+                image = QImage(sip.voidptr(pixels.ctypes.data), width, height, width * 4,
+                               QImage.Format_ARGB32_Premultiplied)
+                opened[page] = (memory, pixels, image, QPainter(image))
+            opened[page][3].drawImage(x, y, piece)
+    finally:
+        for page in list(opened):
+            memory, pixels, image, painter = opened.pop(page)
+            painter.end()
+            # Views into the shared memory have to be released before it can be closed
+            del painter, image, pixels
+            memory.close()
+
+
+def export_atlas(document_path, output_dir, workers=None, atlas_size=DEFAULT_ATLAS_SIZE, padding=DEFAULT_PADDING):
+    """Cut the document's image and pack the pieces into output_dir/<image name>_atlas<N>.png plus an index"""
+    from PyQt5 import sip
+    from PyQt5.QtGui import QImage
+
+    workers = workers or os.cpu_count() or 1
+    image_path, image_size, grid_points = load_export_source(document_path)
+    image_name = os.path.splitext(os.path.basename(image_path))[0]
+    os.makedirs(output_dir, exist_ok=True)
+
+    # Every cell's bounds are known without decoding a pixel
+    cells = []
+    sizes = []
+    for row in range(grid_points.shape[0] - 1):
+        for col in range(grid_points.shape[1] - 1):
+            quad = cell_quad(grid_points, row, col)
+            left, top, right, bottom = quad_bounds(quad, *image_size)
+            if right > left and bottom > top:
+                cells.append((row, col, left, top, quad))
+                sizes.append((right - left, bottom - top))
+    placements, pages = pack_rectangles(sizes, atlas_size, padding)
+    io_log.info("Packed %d pieces into %d atlas pages", len(cells), len(pages))
+
+    memories = []
+    try:
+        atlases = []
+        for packer in pages:
+            width, height = packer.used_width, packer.used_height
+            memory = shared_memory.SharedMemory(create=True, size=width * height * 4)
+            memories.append(memory)
+            memory.buf[:width * height * 4] = bytes(width * height * 4)  # Transparent
+            atlases.append((memory.name, width, height))
+
+        cell_placements = {(row, col): placement for (row, col, *_rest), placement in zip(cells, placements)}
+        tasks = []
+        for first_row, band_points in band_tasks(grid_points, workers):
+            band_rows = range(first_row, first_row + band_points.shape[0] - 1)
+            band_placements = {cell: placement for cell, placement in cell_placements.items()
+                               if cell[0] in band_rows}
+            tasks.append((image_path, band_points, first_row, image_size, band_placements, atlases))
+        run_pool(paint_band_into_atlases, tasks, workers)
+
+        atlas_files = []
+        for page, (memory, (_name, width, height)) in enumerate(zip(memories, atlases)):
+            file_name = f"{image_name}_atlas{page}.png"
+            pixels = np.ndarray((height, width, 4), dtype=np.uint8, buffer=memory.buf)
+            image = QImage(sip.voidptr(pixels.ctypes.data), width, height, width * 4,
+                           QImage.Format_ARGB32_Premultiplied)
+            saved = image.save(os.path.join(output_dir, file_name))
+            del image, pixels
+            if not saved:
+                raise OSError(f"Could not write {os.path.join(output_dir, file_name)}")
+            atlas_files.append({"file": file_name, "width": width, "height": height})
+    finally:
+        for memory in memories:
+            memory.close()
+            memory.unlink()
+
+    # One row per piece, in the order of INDEX_FIELDS, keeps the index small
+    pieces = [[row, col, page, x, y, width, height, left, top, [round(float(value), 3) for point in quad for value in point]]
+              for (row, col, left, top, quad), (page, x, y), (width, height) in zip(cells, placements, sizes)]
+    index = {
+        "image_path": image_path.replace('\\', '/'),
+        "image_width": image_size[0],
+        "image_height": image_size[1],
+        "grid_x": grid_points.shape[1] - 1,
+        "grid_y": grid_points.shape[0] - 1,
+        "padding": padding,
+        "atlases": atlas_files,
+        "fields": INDEX_FIELDS,
+        "pieces": pieces,
+    }
+    index_path = os.path.join(output_dir, f"{image_name}_atlas.json")
+    with open(index_path, "w") as index_file:
+        json.dump(index, index_file, separators=(",", ":"))
+    packed = sum(width * height for width, height in sizes)
+    total = sum(atlas["width"] * atlas["height"] for atlas in atlas_files)
+    if total:
+        io_log.info("Atlas fill %.0f%% over %d pages", 100 * packed / total, len(atlas_files))
+    return index_path, len(pieces), len(atlas_files)
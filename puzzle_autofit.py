@@ -0,0 +1,236 @@
+"""Snap the grid to the piece seams visible in the image
+
+Seams show up as lines of strong brightness change. The fit works one axis at
+a time on gradient projections: the summed |horizontal gradient| of every
+column locates vertical seams, the summed |vertical gradient| of every row
+horizontal ones.
+
+1. Coarse: on a box-filtered copy of the image, reduced so its long side is
+   about COARSE_SIZE pixels, find the lattice of grid_x (grid_y) equal cells
+   whose lines collect the most gradient. Every candidate cell size is scored
+   against every offset at once, as one batched FFT correlation of the
+   projection with a comb of grid lines.
+2. Fine: back at full resolution, the projection is computed only for the
+   pixel columns (rows) within a reduced pixel or so of each lattice line,
+   and each line moves to its strongest seam there, with sub-pixel precision.
+
+The result keeps the grid's dimensions and straight, axis-aligned lines; the
+drag tools are for bending it further.
+
+    python puzzle_autofit.py DOCUMENT [--output FITTED.puz.json]
+"""
+import os
+import sys
+import time
+import argparse
+import numpy as np
+from puzzle_log import render_log, io_log, configure_logging
+from puzzle_document import read_document, write_document, native_image_path, document_grid_format
+
+
+# Long side of the reduced image used for the coarse lattice search
+COARSE_SIZE = 1024
+
+# The lattice is assumed to cover at least this fraction of the image along each axis
+MIN_COVERAGE = 0.5
+
+# Smallest cell, in reduced pixels, the coarse search can still place
+MIN_COARSE_STEP = 3
+
+# A refined line only moves when its seam is at least this strong relative to the median seam
+MIN_SEAM_STRENGTH = 0.25
+
+
+def grayscale_array(image):
+    """(height, width) uint8 luminance of a QImage, as a NumPy array"""
+    from PyQt5.QtGui import QImage
+
+    image = image.convertToFormat(QImage.Format_Grayscale8)
+    bits = image.constBits()
+    bits.setsize(image.bytesPerLine() * image.height())
+    rows = np.frombuffer(bits, dtype=np.uint8).reshape(image.height(), image.bytesPerLine())
+    return rows[:, :image.width()].copy()
+
+
+def reduce_image(gray, factor):
+    """Box-filtered copy of gray, factor times smaller (partial blocks at the edges are dropped)"""
+    height, width = gray.shape[0] // factor * factor, gray.shape[1] // factor * factor
+    blocks = gray[:height, :width].reshape(height // factor, factor, width // factor, factor)
+    return blocks.mean(axis=(1, 3), dtype=np.float32)
+
+
+def seam_profile(projection):
+    """Gradient projection with its slowly varying part removed, so only narrow peaks (seams) remain"""
+    width = 9
+    padded = np.pad(projection, width // 2, mode="edge")
+    background = np.convolve(padded, np.ones(width, dtype=np.float32) / width, mode="valid")
+    return np.maximum(projection - background, 0)
+
+
+def fit_lattice(profile, cells):
+    """(offset, step) of the cells + 1 equally spaced lines collecting the most of profile
+
+    Steps from MIN_COVERAGE * len / cells up to len / cells are tried, finely
+    enough that the last line moves by at most half a sample between
+    neighbouring steps; every offset of every step is scored in one FFT pass.
+    """
+    length = len(profile)
+    largest = (length - 1) / cells
+    count = max(1, int(np.ceil(largest * (1 - MIN_COVERAGE) * 2 * cells)))
+    steps = np.linspace(MIN_COVERAGE * largest, largest, count)
+
+    # Comb of cells + 1 lines for every step, each line split linearly over its two nearest samples
+    positions = np.arange(cells + 1) * steps[:, np.newaxis]
+    lower = np.floor(positions).astype(np.intp)
+    weight = positions - lower
+    size = 1 << int(np.ceil(np.log2(2 * length)))
+    flat = lower + np.arange(count)[:, np.newaxis] * size
+    combs = (np.bincount(flat.ravel(), (1 - weight).ravel(), count * size)
+             + np.bincount((flat + 1).ravel(), weight.ravel(), count * size)).reshape(count, size)
+
+    # scores[s, offset] = sum over lines of profile[offset + line position]
+    spectrum = np.fft.rfft(profile, size)
+    scores = np.fft.irfft(np.conj(np.fft.rfft(combs, axis=1)) * spectrum, size, axis=1)
+    # Offsets that push the last line off the end are not candidates
+    span = np.ceil(steps * cells).astype(np.intp)
+    scores[np.arange(size) > (length - 1 - span)[:, np.newaxis]] = -np.inf
+    step_index, offset = np.unravel_index(np.argmax(scores), scores.shape)
+    return float(offset), float(steps[step_index])
+
+
+def seam_strengths(gray, seams, axis):
+    """Full-resolution gradient projection at the given seam positions (any shape)
+
+    A seam at position p lies between pixel columns (axis=1) or rows (axis=0)
+    p - 1 and p; only the columns (rows) next to one of the seams are read.
+    """
+    needed = np.unique(seams)
+    before = np.take(gray, needed - 1, axis=axis).astype(np.int16)
+    after = np.take(gray, needed, axis=axis).astype(np.int16)
+    strength = np.abs(after - before).sum(axis=1 - axis, dtype=np.float64)
+    return strength[np.searchsorted(needed, seams)]
+
+
+def snap_lines(gray, lines, radius, axis):
+    """(positions, strengths) of the strongest seam within radius pixels of each line, to a sub-pixel"""
+    offsets = np.arange(-radius, radius + 1)
+    seams = np.clip(np.rint(lines).astype(np.intp)[:, np.newaxis] + offsets, 1, gray.shape[axis] - 1)
+    window = seam_strengths(gray, seams, axis)
+
+    best = np.argmax(window, axis=1)
+    rows = np.arange(len(lines))
+    peak = window[rows, best]
+    # Vertex of the parabola through the peak and its neighbours
+    left = window[rows, np.maximum(best - 1, 0)]
+    right = window[rows, np.minimum(best + 1, 2 * radius)]
+    curvature = left - 2 * peak + right
+    shift = np.where(curvature < 0, 0.5 * (left - right) / np.where(curvature < 0, curvature, 1), 0)
+    return seams[rows, best] + np.clip(shift, -0.5, 0.5), peak
+
+
+def fit_axis(gray, reduced, factor, cells, axis):
+    """Grid line positions (full resolution) along one axis: x for axis=1, y for axis=0"""
+    index = np.arange(cells + 1)
+    if reduced.shape[axis] - 1 < MIN_COARSE_STEP * cells:
+        # Cells too small to see in the reduced image: start from the uniform grid
+        step = gray.shape[axis] / cells
+        lines = index * step
+    else:
+        projection = np.abs(np.diff(reduced, axis=axis)).sum(axis=1 - axis)
+        # projection[i] is the seam between reduced pixels i and i + 1, at full resolution (i + 1) * factor
+        offset, step = fit_lattice(seam_profile(projection), cells)
+        lines = (offset + 1 + index * step) * factor
+
+        # The coarse lattice is good to about a reduced pixel: snap to the seams within that distance,
+        # then refit the lattice to the clear ones, which removes the coarse rounding from every line
+        snapped, peak = snap_lines(gray, lines, factor + 1, axis)
+        strong = peak >= MIN_SEAM_STRENGTH * np.median(peak)
+        if strong.sum() >= 2:
+            step, first = np.polyfit(index[strong], snapped[strong], 1, w=np.sqrt(peak[strong]))
+            lines = first + index * step
+        else:
+            step *= factor
+    render_log.debug("Lattice on axis %d: %d cells of %.2f px from %.1f", axis, cells, step, lines[0])
+
+    # Each line may then follow its own seam for a pixel or two, as in slightly uneven photographs,
+    # but not so far that neighbouring lines come closer than about half a cell
+    radius = min(max(2, factor // 2), int((step - 2) // 4))
+    if radius < 1:
+        return lines
+    snapped, peak = snap_lines(gray, lines, radius, axis)
+    strong = peak >= MIN_SEAM_STRENGTH * np.median(peak)
+    return np.where(strong, snapped, lines)
+
+
+def fit_grid(gray, grid_x, grid_y):
+    """(grid_y + 1, grid_x + 1, 2) grid points snapped to the seams of a grayscale image"""
+    height, width = gray.shape
+    factor = max(1, int(np.ceil(max(width, height) / COARSE_SIZE)))
+    reduced = reduce_image(gray, factor)
+    xs = fit_axis(gray, reduced, factor, grid_x, axis=1)
+    ys = fit_axis(gray, reduced, factor, grid_y, axis=0)
+    # Seams on the image border are the border itself
+    xs = np.clip(xs, 0, width)
+    ys = np.clip(ys, 0, height)
+    grid_points = np.empty((grid_y + 1, grid_x + 1, 2), dtype=np.float64)
+    grid_points[..., 0] = xs[np.newaxis, :]
+    grid_points[..., 1] = ys[:, np.newaxis]
+    # A hundredth of a pixel is plenty, and keeps documents short
+    return np.round(grid_points, 2)
+
+
+def fit_grid_to_image(image, grid_x, grid_y):
+    """fit_grid for a QImage"""
+    started = time.perf_counter()
+    grid_points = fit_grid(grayscale_array(image), grid_x, grid_y)
+    render_log.info("Auto-fit %dx%d grid to a %dx%d image in %.0f ms", grid_x, grid_y,
+                    image.width(), image.height(), (time.perf_counter() - started) * 1000)
+    return grid_points
+
+
+def main():
+    from puzzle_batch import parse_grid
+
+    parser = argparse.ArgumentParser(description="Snap the grid of a puzzle document to the seams in its image.")
+    parser.add_argument("document", help="puzzle document (.puz.json)")
+    parser.add_argument("--output", "-o", help="write the fitted document here instead of replacing DOCUMENT")
+    parser.add_argument("--grid", type=parse_grid, help="fit a grid of this size (COLUMNSxROWS) instead of the document's")
+    parser.add_argument("--log", metavar="SPEC", help="log verbosity, as for puzzle_pieces_maker.py")
+    args = parser.parse_args()
+    try:
+        configure_logging(args.log)
+    except ValueError as e:
+        parser.error(str(e))
+
+    from PyQt5.QtGui import QImage
+
+    try:
+        document_data = read_document(args.document)
+    except (OSError, ValueError) as e:
+        parser.exit(1, f"{args.document}: {e}\n")
+    image_path = native_image_path(document_data["image_path"])
+    if not os.path.isabs(image_path):
+        image_path = os.path.join(os.path.dirname(os.path.abspath(args.document)), image_path)
+    image = QImage(image_path)
+    if image.isNull():
+        parser.exit(1, f"Could not read {image_path}\n")
+    grid_x, grid_y = args.grid or (document_data["grid_x"], document_data["grid_y"])
+    if not grid_x or not grid_y:
+        parser.exit(1, f"{args.document} has no grid to fit\n")
+
+    started = time.perf_counter()
+    grid_points = fit_grid_to_image(image, grid_x, grid_y)
+    elapsed = time.perf_counter() - started
+    document_data.update({"grid_x": grid_x, "grid_y": grid_y, "grid_points": grid_points})
+    output_path = args.output or args.document
+    try:
+        write_document(output_path, document_data, document_grid_format(document_data))
+    except OSError as e:
+        parser.exit(1, f"Could not write {output_path}: {e}\n")
+    io_log.info("Wrote %s", output_path)
+    print(f"{output_path}: {grid_x}x{grid_y} grid fitted in {elapsed * 1000:.0f} ms")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,376 @@
+"""Background autosave of the open document's unsaved edits, for recovery after a crash
+
+The document itself is only written by an explicit save. Every grid edit is
+appended to a journal next to the document (<document name>.puzjournal) as
+soon as it is committed: only the points that changed, so a dragged endpoint
+costs a few dozen bytes. Every so often the whole grid is written to a
+recovery file (<document name>.puzrecovery, a grid file, written atomically
+on a worker thread) and the journal starts over from that snapshot.
+
+The journal header holds a CRC-32 of the saved grid it belongs to, and of the
+grid its records apply to: the saved grid, or the recovery snapshot. When a
+document is loaded and its journal belongs to exactly the saved grid, the
+unsaved edits can be recovered: the state just before the crash, up to the
+last committed edit. Records that were only partly written are ignored.
+Saving, reverting, loading another document and quitting throw the journal
+and the snapshot away, as unsaved edits always were.
+
+An image that has not been saved to a document yet is journaled under its own
+path (photo.jpg.puzjournal), against the saved grid of no grid at all.
+
+Journal layout: magic, little-endian uint32 header length, JSON header, then
+records of uint32 point count, uint32 CRC-32 of the payload, and the payload:
+count int32 flat point indices (row * cols + col) followed by count (x, y)
+float64 pairs.
+"""
+import os
+import json
+import zlib
+import struct
+import numpy as np
+from PyQt5.QtCore import QObject, QThread, QTimer, pyqtSignal
+from puzzle_log import io_log
+from puzzle_document import DOCUMENT_EXTENSION, write_grid_file, read_grid_file
+
+
+JOURNAL_EXTENSION = ".puzjournal"
+RECOVERY_EXTENSION = ".puzrecovery"
+JOURNAL_MAGIC = b"PUZJRNL2"
+RECORD_HEADER = struct.Struct("<II")
+
+# Idle time after an edit before the grid is snapshotted
+AUTOSAVE_INTERVAL_MS = 30 * 1000
+
+# Edits touching more than this fraction of the grid (crop drags, auto-fit) go straight to a snapshot
+LARGE_EDIT_FRACTION = 0.25
+
+# Snapshot early once the journal has grown this big
+MAX_JOURNAL_BYTES = 4 * 1024 * 1024
+
+
+def document_base_path(document_path):
+    return document_path[:-len(DOCUMENT_EXTENSION)] if document_path.endswith(DOCUMENT_EXTENSION) else document_path
+
+
+def journal_path_for(document_path):
+    """Edit journal of a document: <document name>.puzjournal next to it"""
+    return document_base_path(document_path) + JOURNAL_EXTENSION
+
+
+def recovery_path_for(document_path):
+    """Recovery snapshot of a document's grid: <document name>.puzrecovery next to it"""
+    return document_base_path(document_path) + RECOVERY_EXTENSION
+
+
+def grid_checksum(grid_points):
+    """CRC-32 of a grid's float64 values, to recognise the grid a journal starts from"""
+    return zlib.crc32(np.ascontiguousarray(grid_points, dtype=np.float64))
+
+
+def remove_recovery_files(document_path):
+    """Delete a document's journal and recovery snapshot, if any"""
+    for file_path in (journal_path_for(document_path), recovery_path_for(document_path)):
+        if os.path.exists(file_path):
+            os.remove(file_path)
+
+
+def read_journal(journal_path):
+    """(header, [(indices, points), ...]) of a journal; a torn or corrupt tail ends the record list"""
+    with open(journal_path, "rb") as journal_file:
+        data = journal_file.read()
+    prefix_length = len(JOURNAL_MAGIC) + 4
+    if len(data) < prefix_length or data[:len(JOURNAL_MAGIC)] != JOURNAL_MAGIC:
+        raise ValueError(f"Not a journal: {journal_path}")
+    header_length, = struct.unpack_from("<I", data, len(JOURNAL_MAGIC))
+    header = json.loads(data[prefix_length:prefix_length + header_length].decode("utf-8"))
+
+    records = []
+    offset = prefix_length + header_length
+    while offset + RECORD_HEADER.size <= len(data):
+        count, checksum = RECORD_HEADER.unpack_from(data, offset)
+        start, end = offset + RECORD_HEADER.size, offset + RECORD_HEADER.size + count * 20
+        if end > len(data) or zlib.crc32(data[start:end]) != checksum:
+            io_log.warning("Ignoring the incomplete end of %s", journal_path)
+            break
+        indices = np.frombuffer(data, dtype="<i4", count=count, offset=start)
+        points = np.frombuffer(data, dtype="<f8", count=count * 2, offset=start + count * 4).reshape(count, 2)
+        records.append((indices, points))
+        offset = end
+    return header, records
+
+
+def read_recovery(document_path, saved_grid_points):
+    """(recovered grid, number of edits) left unsaved by a session on document_path that did not end normally
+
+    The grid is None when there is nothing to recover: no journal, no edits,
+    or a journal that belongs to a different saved version of the document.
+    The recovered grid may have different dimensions than the saved one.
+    """
+    journal_path = journal_path_for(document_path)
+    if not os.path.exists(journal_path):
+        return None, 0
+    try:
+        header, records = read_journal(journal_path)
+        if header.get("saved_crc32") != grid_checksum(saved_grid_points):
+            io_log.info("Journal %s belongs to another version of the document, ignoring it", journal_path)
+            return None, 0
+        if header.get("base") == "snapshot":
+            recovered = np.array(read_grid_file(recovery_path_for(document_path)), dtype=np.float64)
+        else:
+            recovered = np.array(saved_grid_points, dtype=np.float64)
+    except (OSError, ValueError, KeyError) as e:
+        io_log.warning("Could not read the recovery data of %s: %s", document_path, e)
+        return None, 0
+    if (header.get("rows"), header.get("cols")) != recovered.shape[:2] or header.get("base_crc32") != grid_checksum(recovered):
+        io_log.warning("Recovery snapshot of %s does not match its journal, ignoring it", document_path)
+        return None, 0
+    edits = header.get("edits", 0) + len(records)
+    if not edits:
+        return None, 0
+    flat = recovered.reshape(-1, 2)
+    for indices, points in records:
+        flat[indices] = points
+    io_log.info("Recovered %d unsaved edits of %s", edits, document_path)
+    return recovered, edits
+
+
+class EditJournal:
+    """Append-only journal of the changes to a grid since its base: the saved grid or a recovery snapshot
+
+    A copy of the grid as journaled so far is kept, so each record() only
+    writes the points that differ from it.
+    """
+
+    def __init__(self, journal_path):
+        self.journal_path = journal_path
+        self.journal_file = None
+        self.journaled = None  # The grid as of the last record, to diff the next edit against
+        self.saved_crc32 = None  # Checksum of the saved grid; computed when first needed
+        self.base = "saved"
+        self.edits = 0  # Edits in the base plus records written
+        self.size = 0
+
+    def start(self, base_grid_points, base="saved", saved_crc32=None, edits=0):
+        """Begin a new journal from base_grid_points: the saved grid, or a snapshot of a grid with saved_crc32
+
+        A journal from the saved grid is only written with the first edit, so
+        saving and loading don't pay for checksumming the grid; one from a
+        snapshot is written right away, as the snapshot is useless without it.
+        """
+        self.discard()
+        self.journaled = np.array(base_grid_points, dtype=np.float64)
+        self.base = base
+        self.saved_crc32 = saved_crc32
+        self.edits = edits
+        if base != "saved":
+            self.write_header()
+
+    def saved_checksum(self):
+        """CRC-32 of the saved grid this journal belongs to"""
+        if self.saved_crc32 is None:
+            # Nothing has been recorded yet, so journaled is still the saved grid
+            self.saved_crc32 = grid_checksum(self.journaled)
+        return self.saved_crc32
+
+    def write_header(self):
+        # Written whole and then renamed into place, so there is never a journal without a complete header
+        saved_crc32 = self.saved_checksum()
+        header = json.dumps({"saved_crc32": saved_crc32, "base": self.base,
+                             "base_crc32": saved_crc32 if self.base == "saved" else grid_checksum(self.journaled),
+                             "rows": self.journaled.shape[0], "cols": self.journaled.shape[1],
+                             "edits": self.edits}).encode("utf-8")
+        temp_path = self.journal_path + ".tmp"
+        with open(temp_path, "wb") as journal_file:
+            journal_file.write(JOURNAL_MAGIC + struct.pack("<I", len(header)) + header)
+        os.replace(temp_path, self.journal_path)
+        self.journal_file = open(self.journal_path, "ab")
+        self.size = self.journal_file.tell()
+
+    def record(self, grid_points):
+        """Append the points that changed since the last record; None if the edit is too big for the journal"""
+        if self.journaled is None or grid_points.shape != self.journaled.shape:
+            return None
+        changed = np.flatnonzero((grid_points != self.journaled).any(axis=2))
+        if len(changed) == 0:
+            return 0
+        if len(changed) > LARGE_EDIT_FRACTION * grid_points.shape[0] * grid_points.shape[1]:
+            return None
+        if self.journal_file is None:
+            self.write_header()
+        points = grid_points.reshape(-1, 2)[changed]
+        payload = changed.astype("<i4").tobytes() + points.astype("<f8").tobytes()
+        self.journal_file.write(RECORD_HEADER.pack(len(changed), zlib.crc32(payload)) + payload)
+        # Flushed to the OS right away: that is enough to survive the application crashing
+        self.journal_file.flush()
+        self.size += RECORD_HEADER.size + len(payload)
+        self.edits += 1
+        self.journaled.reshape(-1, 2)[changed] = points
+        return len(changed)
+
+    def close(self):
+        if self.journal_file is not None:
+            self.journal_file.close()
+            self.journal_file = None
+
+    def discard(self):
+        """Close and delete the journal"""
+        self.close()
+        self.journaled = None
+        self.size = 0
+        if os.path.exists(self.journal_path):
+            os.remove(self.journal_path)
+
+
+class SnapshotWriter(QThread):
+    """Writes a recovery snapshot of a grid on a worker thread; error is set if that failed"""
+
+    def __init__(self, file_path, grid_points, parent=None):
+        super().__init__(parent)
+        self.file_path = file_path
+        self.grid_points = grid_points
+        self.error = None
+
+    def run(self):
+        try:
+            write_grid_file(self.file_path, self.grid_points)
+        except (OSError, ValueError) as e:
+            self.error = str(e)
+
+
+class Autosave(QObject):
+    """Journals the edits to one document's grid and snapshots it to the recovery file in the background
+
+    grid_points is a callable returning the grid being edited; it is only
+    called on the GUI thread, and the grid is copied before it goes to the
+    writer. The document itself is never written.
+    """
+    status = pyqtSignal(str)
+
+    def __init__(self, grid_points, parent=None):
+        super().__init__(parent)
+        self.grid_points = grid_points
+        self.document_path = None
+        self.journal = None
+        self.writer = None  # SnapshotWriter of the snapshot being written, if any
+        self.snapshot_saved_crc32 = None  # Saved grid checksum and edit count for the journal after it
+        self.snapshot_edits = 0
+        self.dirty = False  # Edits since the last snapshot
+        self.timer = QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.setInterval(AUTOSAVE_INTERVAL_MS)
+        self.timer.timeout.connect(self.snapshot)
+
+    def attach(self, document_path, saved_grid_points, grid_points=None, edits=0):
+        """Start journaling edits to document_path, whose grid on disk is saved_grid_points
+
+        Recovery data left from before is thrown away. grid_points is the grid
+        being edited if it already differs from the saved one (the result of
+        read_recovery, with its edit count); it goes into the new journal, or
+        straight into a snapshot.
+        """
+        self.discard()
+        self.document_path = document_path
+        self.journal = EditJournal(journal_path_for(document_path))
+        try:
+            if os.path.exists(recovery_path_for(document_path)):
+                os.remove(recovery_path_for(document_path))
+            # The recovered grid goes in as one record (or snapshot) standing for all its edits
+            self.journal.start(saved_grid_points, edits=max(edits - 1, 0))
+            if grid_points is not None:
+                self.dirty = True
+                if self.journal.record(grid_points) is None:
+                    # Nothing is on disk until the snapshot is, so wait for it rather than risk losing the edits
+                    self.journal.edits += 1
+                    self.snapshot(background=False)
+                else:
+                    self.timer.start()
+        except OSError as e:
+            io_log.warning("Autosave disabled for %s: %s", document_path, e)
+            self.journal = None
+
+    def discard(self):
+        """Stop autosaving and throw the journal and the snapshot away (saving, reverting, leaving the document)"""
+        self.timer.stop()
+        self.wait()
+        if self.journal is not None:
+            try:
+                self.journal.discard()
+                remove_recovery_files(self.document_path)
+            except OSError as e:
+                io_log.warning("Could not remove the recovery data of %s: %s", self.document_path, e)
+            self.journal = None
+        self.document_path = None
+        self.dirty = False
+
+    def wait(self):
+        """Block until a running snapshot has been written"""
+        if self.writer is not None:
+            self.writer.wait()
+            self.snapshot_done(self.writer)
+
+    def grid_edited(self, grid_points):
+        """Journal a committed edit; large edits and a full journal bring the snapshot forward"""
+        if self.journal is None:
+            return
+        self.dirty = True
+        try:
+            recorded = self.journal.record(grid_points)
+        except OSError as e:
+            io_log.warning("Could not append to %s: %s", self.journal.journal_path, e)
+            recorded = None
+        if recorded is None:
+            self.journal.edits += 1
+        if recorded is None or self.journal.size > MAX_JOURNAL_BYTES:
+            self.snapshot()
+        elif not self.timer.isActive():
+            self.timer.start()
+
+    def snapshot(self, background=True):
+        """Write the grid to the recovery file now, on the worker thread unless background=False"""
+        self.timer.stop()
+        if self.journal is None or not self.dirty or self.writer is not None:
+            # With a snapshot already running, snapshot_done starts the next one
+            return
+        self.snapshot_saved_crc32 = self.journal.saved_checksum()
+        self.snapshot_edits = self.journal.edits
+        self.dirty = False
+        self.writer = SnapshotWriter(recovery_path_for(self.document_path),
+                                     np.array(self.grid_points(), dtype=np.float64), self)
+        if background:
+            self.writer.finished.connect(self.snapshot_finished)
+            self.writer.start()
+        else:
+            self.writer.run()
+            self.snapshot_done(self.writer)
+
+    def snapshot_finished(self):
+        if self.sender() is self.writer:
+            self.snapshot_done(self.writer)
+
+    def snapshot_done(self, writer):
+        self.writer = None
+        writer.deleteLater()
+        if writer.error is not None:
+            # Still only in memory: the journal keeps what it could, and the next edit tries again
+            self.dirty = True
+            io_log.warning("Autosave of %s failed: %s", self.document_path, writer.error)
+            self.status.emit(f"Autosave failed: {writer.error}")
+            return
+
+        # Edits made while the snapshot was being written carry over into the new journal
+        current = self.grid_points()
+        try:
+            self.journal.start(writer.grid_points, "snapshot", self.snapshot_saved_crc32, self.snapshot_edits)
+            carried = self.journal.record(current) if current.shape == writer.grid_points.shape else None
+        except OSError as e:
+            io_log.warning("Could not restart journal %s: %s", self.journal.journal_path, e)
+            carried = 0
+        io_log.info("Autosaved the unsaved edits of %s to %s", self.document_path, writer.file_path)
+        self.status.emit(f"Unsaved edits of {os.path.basename(self.document_path)} backed up")
+        if carried is None:
+            # The grid was replaced meanwhile: only another snapshot can capture it
+            self.dirty = True
+            self.snapshot()
+        elif carried:
+            self.dirty = True
+            self.timer.start()
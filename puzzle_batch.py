@@ -0,0 +1,279 @@
+"""Batch processing of grid documents, without the GUI
+
+    python puzzle_batch.py create IMAGES_OR_DIRS... --grid 10x8 [--overwrite] [--output-dir DIR]
+    python puzzle_batch.py validate DOCUMENTS_OR_DIRS...
+    python puzzle_batch.py stats DOCUMENTS_OR_DIRS... [--json]
+    python puzzle_batch.py convert DOCUMENTS_OR_DIRS... --grid-format binary
+
+create writes a <image name>.puz.json with a uniform grid for every image,
+validate checks documents against the schema and their images, stats
+summarises grid and piece sizes, and convert rewrites documents with their
+grid points stored another way (see puzzle_document.GRID_FORMATS). Work is spread over a process pool
+(--workers, default one per CPU). Only image headers are read, through
+QtGui's QImageReader; QtWidgets is never imported.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from puzzle_log import io_log, configure_logging
+from puzzle_document import (DOCUMENT_EXTENSION, MAX_GRID_SQUARES, GRID_FORMATS, uniform_grid_points,
+                             document_path_for, make_document, write_document, read_document, native_image_path,
+                             document_grid_points, document_grid_format, owned_grid_points, validate_document,
+                             piece_sizes)
+
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp", ".gif", ".tif", ".tiff")
+
+
+def image_size(image_path):
+    """(width, height) read from the image header, or None if it can't be read"""
+    from PyQt5.QtGui import QImageReader  # Only needed in the workers, and only QtGui
+    size = QImageReader(image_path).size()
+    return (size.width(), size.height()) if size.isValid() else None
+
+
+def collect_files(paths, matches, recursive):
+    """Files named directly in paths plus the matching files in directories"""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for directory, subdirectories, names in os.walk(path):
+                files.extend(os.path.join(directory, name) for name in sorted(names) if matches(name))
+                if not recursive:
+                    break
+                subdirectories.sort()
+        else:
+            files.append(path)
+    return files
+
+
+def is_image(name):
+    return name.lower().endswith(IMAGE_EXTENSIONS)
+
+
+def is_document(name):
+    return name.lower().endswith(DOCUMENT_EXTENSION)
+
+
+def create_document(task):
+    """Worker: write a uniform-grid document for one image"""
+    image_path, grid_x, grid_y, output_dir, overwrite, grid_format = task
+    document_path = document_path_for(image_path, output_dir)
+    if os.path.exists(document_path) and not overwrite:
+        return {"path": document_path, "status": "skipped"}
+    size = image_size(image_path)
+    if size is None:
+        return {"path": image_path, "status": "failed", "problems": ["image could not be read"]}
+    grid_points = uniform_grid_points(size[0], size[1], grid_x, grid_y)
+    try:
+        write_document(document_path, make_document(os.path.abspath(image_path), grid_x, grid_y, grid_points),
+                       grid_format)
+    except OSError as e:
+        return {"path": document_path, "status": "failed", "problems": [str(e)]}
+    return {"path": document_path, "status": "created"}
+
+
+def check_document(document_path):
+    """Worker: load one document and list its problems; also returns what stats needs"""
+    try:
+        document_data = read_document(document_path)
+    except (OSError, ValueError) as e:
+        return {"path": document_path, "status": "invalid", "problems": [str(e)]}
+
+    image_path = native_image_path(document_data["image_path"])
+    if not os.path.isabs(image_path):
+        # Relative image paths are taken relative to the document
+        image_path = os.path.join(os.path.dirname(os.path.abspath(document_path)), image_path)
+    size = image_size(image_path) if os.path.exists(image_path) else None
+    problems = validate_document(document_data, size, document_path)
+    if size is None:
+        problems.append(f"image {image_path} is missing or unreadable")
+
+    result = {
+        "path": document_path,
+        "status": "invalid" if problems else "valid",
+        "problems": problems,
+        "grid": (document_data["grid_x"], document_data["grid_y"]),
+        "image_size": size,
+        "file_bytes": document_bytes(document_path, document_data),
+    }
+    if not problems:
+        grid_points = document_grid_points(document_data, document_path)
+        if grid_points is not None and grid_points.size:
+            widths, heights = piece_sizes(grid_points)
+            uniform = uniform_grid_points(size[0], size[1], *result["grid"])
+            result.update({
+                "piece_width": (float(widths.min()), float(np.median(widths)), float(widths.max())),
+                "piece_height": (float(heights.min()), float(np.median(heights)), float(heights.max())),
+                # How far the grid was edited away from the uniform one, in image pixels
+                "max_offset": float(np.abs(grid_points - uniform).max()),
+            })
+    return result
+
+
+def document_bytes(document_path, document_data):
+    """Size of a document on disk, including its grid file"""
+    size = os.path.getsize(document_path)
+    grid_file = document_data.get("grid_file")
+    if grid_file:
+        grid_file_path = os.path.join(os.path.dirname(os.path.abspath(document_path)), native_image_path(grid_file["file"]))
+        if os.path.exists(grid_file_path):
+            size += os.path.getsize(grid_file_path)
+    return size
+
+
+def convert_document(task):
+    """Worker: rewrite one document with its grid points in grid_format"""
+    document_path, grid_format = task
+    try:
+        document_data = read_document(document_path)
+        if document_grid_format(document_data) == grid_format:
+            return {"path": document_path, "status": "skipped"}
+        before = document_bytes(document_path, document_data)
+        # A memory-mapped grid file has to be let go of before it is replaced
+        document_data["grid_points"] = owned_grid_points(document_grid_points(document_data, document_path))
+        write_document(document_path, document_data, grid_format)
+        after = document_bytes(document_path, read_document(document_path))
+    except (OSError, ValueError) as e:
+        return {"path": document_path, "status": "failed", "problems": [str(e)]}
+    return {"path": document_path, "status": "converted", "bytes": (before, after)}
+
+
+def run_tasks(function, tasks, workers):
+    """Map function over tasks, in a process pool unless a single worker was asked for"""
+    if workers == 1 or len(tasks) <= 1:
+        return [function(task) for task in tasks]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(function, tasks, chunksize=max(1, len(tasks) // (workers * 4))))
+
+
+def parse_grid(value):
+    try:
+        grid_x, grid_y = (int(part) for part in value.lower().split("x"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"grid must look like 10x8, not '{value}'")
+    if not (1 <= grid_x <= MAX_GRID_SQUARES and 1 <= grid_y <= MAX_GRID_SQUARES):
+        raise argparse.ArgumentTypeError(f"grid dimensions must be from 1 to {MAX_GRID_SQUARES}")
+    return grid_x, grid_y
+
+
+def print_problems(results):
+    for result in results:
+        for problem in result.get("problems", ()):
+            print(f"{result['path']}: {problem}")
+
+
+def summarise(results):
+    """Summary statistics over the results of check_document"""
+    valid = [result for result in results if result["status"] == "valid"]
+    summary = {
+        "documents": len(results),
+        "valid": len(valid),
+        "invalid": len(results) - len(valid),
+        "grids": {f"{grid_x}x{grid_y}": count
+                  for (grid_x, grid_y), count in Counter(result["grid"] for result in valid).most_common()},
+        "pieces": sum(result["grid"][0] * result["grid"][1] for result in valid),
+        "megabytes": round(sum(result.get("file_bytes", 0) for result in results) / (1024 * 1024), 2),
+    }
+    sized = [result for result in valid if "piece_width" in result]
+    if sized:
+        for key in ("piece_width", "piece_height"):
+            summary[key] = {
+                "min": min(result[key][0] for result in sized),
+                "median": float(np.median([result[key][1] for result in sized])),
+                "max": max(result[key][2] for result in sized),
+            }
+        summary["edited"] = sum(result["max_offset"] > 0 for result in sized)
+        summary["max_offset"] = max(result["max_offset"] for result in sized)
+    return summary
+
+
+def main():
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                        help="worker processes (default: one per CPU)")
+    common.add_argument("--log", metavar="SPEC", help="log verbosity, as for puzzle_pieces_maker.py")
+    parser = argparse.ArgumentParser(description="Create, validate, summarise and convert puzzle grid documents.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    create = commands.add_parser("create", parents=[common], help="write a uniform-grid document for every image")
+    create.add_argument("paths", nargs="+", help="images, or directories of images")
+    create.add_argument("--grid", type=parse_grid, required=True, help="grid size as COLUMNSxROWS, e.g. 10x8")
+    create.add_argument("--output-dir", help="write documents here instead of next to their images")
+    create.add_argument("--overwrite", action="store_true", help="replace existing documents")
+    create.add_argument("--recursive", action="store_true", help="include subdirectories")
+    create.add_argument("--grid-format", choices=GRID_FORMATS, default="json",
+                        help="store the grid points in the JSON (default) or in a binary or compressed grid file")
+
+    for name, help_text in (("validate", "check documents and the images they refer to"),
+                            ("stats", "print summary statistics of documents")):
+        command = commands.add_parser(name, parents=[common], help=help_text)
+        command.add_argument("paths", nargs="+", help=f"documents, or directories of {DOCUMENT_EXTENSION} files")
+        command.add_argument("--recursive", action="store_true", help="include subdirectories")
+        command.add_argument("--json", action="store_true", help="print the summary as JSON")
+
+    convert = commands.add_parser("convert", parents=[common], help="change how documents store their grid points")
+    convert.add_argument("paths", nargs="+", help=f"documents, or directories of {DOCUMENT_EXTENSION} files")
+    convert.add_argument("--grid-format", choices=GRID_FORMATS, required=True,
+                         help="json: in the document; binary: memory-mapped grid file; compressed: delta-encoded, "
+                              "zlib-compressed grid file")
+    convert.add_argument("--recursive", action="store_true", help="include subdirectories")
+
+    args = parser.parse_args()
+    try:
+        configure_logging(args.log)
+    except ValueError as e:
+        parser.error(str(e))
+    workers = max(1, args.workers)
+    started = time.perf_counter()
+
+    if args.command == "create":
+        if args.output_dir:
+            os.makedirs(args.output_dir, exist_ok=True)
+        images = collect_files(args.paths, is_image, args.recursive)
+        grid_x, grid_y = args.grid
+        results = run_tasks(create_document,
+                            [(image_path, grid_x, grid_y, args.output_dir, args.overwrite, args.grid_format)
+                             for image_path in images],
+                            workers)
+        print_problems(results)
+        counts = Counter(result["status"] for result in results)
+        print(f"{counts['created']} created, {counts['skipped']} skipped (already exist), {counts['failed']} failed "
+              f"in {time.perf_counter() - started:.1f} s")
+        return 1 if counts["failed"] else 0
+
+    documents = collect_files(args.paths, is_document, args.recursive)
+    if args.command == "convert":
+        results = run_tasks(convert_document, [(document_path, args.grid_format) for document_path in documents],
+                            workers)
+        print_problems(results)
+        counts = Counter(result["status"] for result in results)
+        before, after = (sum(result["bytes"][index] for result in results if "bytes" in result) for index in (0, 1))
+        print(f"{counts['converted']} converted ({before / (1024 * 1024):.1f} MB -> {after / (1024 * 1024):.1f} MB), "
+              f"{counts['skipped']} skipped (already {args.grid_format}), {counts['failed']} failed "
+              f"in {time.perf_counter() - started:.1f} s")
+        return 1 if counts["failed"] else 0
+
+    results = run_tasks(check_document, documents, workers)
+    io_log.info("Checked %d documents in %.1f s", len(results), time.perf_counter() - started)
+    summary = summarise(results)
+    if args.command == "validate":
+        print_problems(results)
+    if args.json:
+        print(json.dumps(summary, indent=2))
+    else:
+        for key, value in summary.items():
+            if isinstance(value, dict):
+                value = ", ".join(f"{name} {count:g}" if isinstance(count, float) else f"{name} {count}"
+                                  for name, count in value.items())
+            print(f"{key.replace('_', ' '):<14} {value}")
+    return 1 if args.command == "validate" and summary["invalid"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
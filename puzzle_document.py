@@ -0,0 +1,306 @@
+"""Grid documents (.puz.json) without any GUI
+
+The grid geometry and the document schema shared by the viewer and the batch
+tools. Nothing here imports Qt, so it can be used from worker processes and
+scripts that never open a window.
+
+The grid points are stored in the JSON itself, or, for large grids, in a
+binary grid file next to the document (see write_grid_file) that the JSON
+names in "grid_file".
+"""
+import os
+import json
+import zlib
+import struct
+import numpy as np
+
+
+DOCUMENT_EXTENSION = ".puz.json"
+
+# Largest grid allowed on either axis
+MAX_GRID_SQUARES = 1000
+
+# Documents with more grid points than this are written without JSON indentation
+COMPACT_DOCUMENT_MIN_POINTS = 101 * 101
+
+REQUIRED_KEYS = ("grid_x", "grid_y", "image_path")
+
+# How write_document stores the grid points: in the JSON, or in a binary grid file that is
+# memory-mapped on load ("binary") or delta-encoded and zlib-compressed ("compressed")
+GRID_FORMATS = ("json", "binary", "compressed")
+
+GRID_FILE_EXTENSION = ".puzgrid"
+GRID_FILE_MAGIC = b"PUZGRID1"
+GRID_FILE_ALIGNMENT = 64
+GRID_ENCODINGS = {"binary": "raw", "compressed": "delta-zlib"}
+
+
+def empty_grid_points():
+    """Grid point array for "no grid": 0 rows x 0 columns of (x, y)"""
+    return np.empty((0, 0, 2), dtype=np.float64)
+
+
+def uniform_grid_points(width, height, grid_x, grid_y):
+    """(grid_y+1, grid_x+1, 2) array of evenly spaced grid points over a width x height image
+
+    Coordinates are whole pixels (floored), so every grid point lies on the image.
+    """
+    if width <= 0 or height <= 0 or grid_x <= 0 or grid_y <= 0:
+        return empty_grid_points()
+    # +1 in both directions because we need lines at both edges
+    xs = np.floor(np.arange(grid_x + 1) * (width / grid_x))
+    ys = np.floor(np.arange(grid_y + 1) * (height / grid_y))
+    grid_points = np.empty((grid_y + 1, grid_x + 1, 2), dtype=np.float64)
+    grid_points[:, :, 0] = xs[np.newaxis, :]
+    grid_points[:, :, 1] = ys[:, np.newaxis]
+    return grid_points
+
+
+def document_path_for(image_path, directory=None):
+    """Default document location for an image: <image name>.puz.json next to it (or in directory)"""
+    image_name = os.path.splitext(os.path.basename(image_path))[0]
+    return os.path.join(directory or os.path.dirname(os.path.abspath(image_path)), image_name + DOCUMENT_EXTENSION)
+
+
+def make_document(image_path, grid_x, grid_y, grid_points, zoom_value=1.0, geometry=None):
+    """Document dict; geometry is an optional (x, y, width, height) of the viewer window
+
+    grid_points stays an array; write_document decides how it is stored.
+    """
+    document_data = {
+        "grid_x": grid_x,
+        "grid_y": grid_y,
+        # Forward slashes keep documents portable between Windows and other systems
+        "image_path": image_path.replace('\\', '/'),
+        "zoom_value": zoom_value,
+        "grid_points": np.asarray(grid_points, dtype=np.float64),
+    }
+    if geometry is not None:
+        x, y, width, height = geometry
+        document_data.update({"window_width": width, "window_height": height, "window_x": x, "window_y": y})
+    return document_data
+
+
+def grid_file_path_for(document_path):
+    """Binary grid file of a document: <document name>.puzgrid next to it"""
+    base = document_path[:-len(DOCUMENT_EXTENSION)] if document_path.endswith(DOCUMENT_EXTENSION) else document_path
+    return base + GRID_FILE_EXTENSION
+
+
+def document_grid_format(document_data):
+    """The GRID_FORMATS entry a loaded document was stored in"""
+    grid_file = document_data.get("grid_file")
+    if not grid_file:
+        return "json"
+    encodings = {encoding: grid_format for grid_format, encoding in GRID_ENCODINGS.items()}
+    return encodings.get(grid_file.get("encoding"), "binary")
+
+
+def write_grid_file(file_path, grid_points, encoding="raw"):
+    """Write grid points as magic, uint32 header length, JSON header, then the data
+
+    "raw" data is the (rows, cols, 2) little-endian float64 array, starting at a
+    GRID_FILE_ALIGNMENT boundary so it can be memory-mapped in place.
+    "delta-zlib" stores the differences between the bit patterns of
+    neighbouring points along each row (as wrapping uint64), zlib-compressed:
+    exactly reversible, and small for regular grids. The file is replaced atomically.
+    """
+    grid_points = np.ascontiguousarray(grid_points, dtype="<f8")
+    if encoding == "raw":
+        data = grid_points
+    elif encoding == "delta-zlib":
+        bits = grid_points.view("<u8")
+        deltas = np.diff(bits, axis=1, prepend=np.zeros_like(bits[:, :1]))
+        data = zlib.compress(deltas.tobytes(), 6)
+    else:
+        raise ValueError(f"Unknown grid file encoding '{encoding}'")
+    rows, cols = grid_points.shape[:2]
+    header = json.dumps({"rows": rows, "cols": cols, "dtype": "<f8", "encoding": encoding,
+                         "data_bytes": len(data) if encoding != "raw" else grid_points.nbytes}).encode("utf-8")
+    prefix_length = len(GRID_FILE_MAGIC) + 4 + len(header)
+    padding = -prefix_length % GRID_FILE_ALIGNMENT
+
+    temp_path = file_path + ".tmp"
+    with open(temp_path, "wb") as grid_file:
+        grid_file.write(GRID_FILE_MAGIC)
+        grid_file.write(struct.pack("<I", len(header) + padding))
+        grid_file.write(header + b" " * padding)
+        grid_file.write(data if isinstance(data, bytes) else data.data)
+    os.replace(temp_path, file_path)
+
+
+def read_grid_file(file_path):
+    """The grid points of a grid file; "raw" files come back as a copy-on-write memory map
+
+    The map reads pages lazily and edits stay private to the process, so
+    loading costs nothing up front whatever the grid size. A damaged or
+    truncated file raises ValueError.
+    """
+    with open(file_path, "rb") as grid_file:
+        prefix = grid_file.read(len(GRID_FILE_MAGIC) + 4)
+        if len(prefix) < len(GRID_FILE_MAGIC) + 4 or prefix[:len(GRID_FILE_MAGIC)] != GRID_FILE_MAGIC:
+            raise ValueError(f"Not a grid file: {file_path}")
+        header_length, = struct.unpack_from("<I", prefix, len(GRID_FILE_MAGIC))
+        try:
+            header = json.loads(grid_file.read(header_length).decode("utf-8"))
+            shape = (int(header["rows"]), int(header["cols"]), 2)
+            encoding = header["encoding"]
+            if min(shape) < 0:
+                raise ValueError(f"negative grid shape {shape}")
+        except (ValueError, KeyError, TypeError) as e:
+            raise ValueError(f"Damaged grid file header in {file_path}: {e}")
+        offset = len(prefix) + header_length
+        data_bytes = shape[0] * shape[1] * 2 * 8
+        if encoding == "delta-zlib":
+            try:
+                data = zlib.decompress(grid_file.read(header["data_bytes"]))
+            except (zlib.error, KeyError, TypeError) as e:
+                raise ValueError(f"Damaged grid data in {file_path}: {e}")
+            if len(data) != data_bytes:
+                raise ValueError(f"Grid data in {file_path} holds {len(data)} bytes, expected {data_bytes}")
+            deltas = np.frombuffer(data, dtype="<u8")
+            return np.cumsum(deltas.reshape(shape), axis=1, dtype="<u8").view("<f8").astype(np.float64)
+    if encoding != "raw":
+        raise ValueError(f"Unknown grid file encoding '{encoding}' in {file_path}")
+    if os.path.getsize(file_path) < offset + data_bytes:
+        raise ValueError(f"Grid file {file_path} is truncated")
+    if data_bytes == 0:
+        return np.empty(shape, dtype=np.float64)
+    return np.memmap(file_path, dtype="<f8", mode="c", offset=offset, shape=shape)
+
+
+def owned_grid_points(grid_points):
+    """grid_points, copied into memory if it is a view of a memory-mapped grid file
+
+    Windows can't replace a file that is still mapped, so grids loaded from a
+    grid file go through this before their document is written back.
+    """
+    base = grid_points
+    while isinstance(base, np.ndarray):
+        if isinstance(base, np.memmap):
+            return np.array(grid_points)
+        base = base.base
+    return grid_points
+
+
+def write_document(file_path, document_data, grid_format="json"):
+    """Write a document as JSON, with its grid points in it or in a grid file next to it
+
+    Large grids in the JSON are written compactly. Like the grid file, the
+    document is written to a temporary file that then replaces it, so a crash
+    never leaves a half-written document behind. Writing the points into the
+    JSON removes the document's old grid file, once the new document is in place.
+    """
+    if grid_format not in GRID_FORMATS:
+        raise ValueError(f"Unknown grid format '{grid_format}', expected one of: {', '.join(GRID_FORMATS)}")
+    document_data = dict(document_data)
+    document_data.pop("grid_file", None)
+    grid_points = document_data.pop("grid_points", None)
+    if grid_points is None or len(grid_points) == 0:
+        grid_points = empty_grid_points()
+    point_count = 0
+    if grid_format == "json":
+        grid_points = grid_points.tolist() if isinstance(grid_points, np.ndarray) else grid_points
+        point_count = len(grid_points) * (len(grid_points[0]) if grid_points else 0)
+        document_data["grid_points"] = grid_points
+    else:
+        grid_file_path = grid_file_path_for(file_path)
+        write_grid_file(grid_file_path, grid_points, GRID_ENCODINGS[grid_format])
+        document_data["grid_file"] = {"file": os.path.basename(grid_file_path), "encoding": GRID_ENCODINGS[grid_format]}
+    # Indenting every coordinate of a large grid would multiply the file size
+    compact = point_count > COMPACT_DOCUMENT_MIN_POINTS
+    temp_path = file_path + ".tmp"
+    with open(temp_path, "w") as json_file:
+        json.dump(document_data, json_file, indent=None if compact else 2)
+    os.replace(temp_path, file_path)
+    if grid_format == "json":
+        # A grid file left from an earlier binary or compressed save is no longer referred to
+        try:
+            os.remove(grid_file_path_for(file_path))
+        except FileNotFoundError:
+            pass
+
+
+def read_document(file_path):
+    """Load a document, checking that the required keys are there (ValueError if not)"""
+    with open(file_path, "r") as json_file:
+        document_data = json.load(json_file)
+    if not isinstance(document_data, dict) or any(document_data.get(key) is None for key in REQUIRED_KEYS):
+        raise ValueError("Invalid document structure.")
+    return document_data
+
+
+def native_image_path(image_path):
+    """Document image paths use forward slashes; convert back on Windows"""
+    if '/' in image_path and os.sep == '\\':
+        return image_path.replace('/', '\\')
+    return image_path
+
+
+def document_grid_points(document_data, document_path=None):
+    """The document's grid points as an array, or None if it doesn't store any
+
+    A grid file is looked up relative to document_path (relative to the
+    working directory without one).
+    """
+    grid_file = document_data.get("grid_file")
+    if grid_file:
+        grid_file_path = native_image_path(grid_file["file"])
+        if not os.path.isabs(grid_file_path) and document_path:
+            grid_file_path = os.path.join(os.path.dirname(os.path.abspath(document_path)), grid_file_path)
+        grid_points = read_grid_file(grid_file_path)
+        return grid_points if grid_points.size else None
+    saved_grid_points = document_data.get("grid_points")
+    if saved_grid_points is None or len(saved_grid_points) == 0:
+        return None
+    grid_points = np.array(saved_grid_points, dtype=np.float64)
+    if grid_points.ndim != 3 or grid_points.shape[2] != 2:
+        raise ValueError("Grid points must be a rows x columns array of (x, y) pairs.")
+    return grid_points
+
+
+def validate_document(document_data, image_size=None, document_path=None):
+    """List of problems with a loaded document (empty if it is fine)
+
+    image_size is the (width, height) of the referenced image, if known; grid
+    points are then also checked against the image bounds. document_path
+    locates a grid file.
+    """
+    problems = []
+    grid_x, grid_y = document_data.get("grid_x"), document_data.get("grid_y")
+    for key, value in (("grid_x", grid_x), ("grid_y", grid_y)):
+        if not isinstance(value, int) or isinstance(value, bool) or not 0 <= value <= MAX_GRID_SQUARES:
+            problems.append(f"{key} must be an integer from 0 to {MAX_GRID_SQUARES}, not {value!r}")
+    zoom_value = document_data.get("zoom_value", 1.0)
+    if not isinstance(zoom_value, (int, float)) or zoom_value <= 0:
+        problems.append(f"zoom_value must be a positive number, not {zoom_value!r}")
+    if problems:
+        return problems
+
+    try:
+        grid_points = document_grid_points(document_data, document_path)
+    except (ValueError, TypeError, OSError) as e:
+        return [f"grid_points: {e}"]
+    if grid_points is None:
+        return problems
+
+    expected_shape = (grid_y + 1, grid_x + 1, 2)
+    if grid_points.shape != expected_shape:
+        problems.append(f"grid_points has shape {grid_points.shape}, expected {expected_shape} for a "
+                        f"{grid_x}x{grid_y} grid")
+    elif not np.isfinite(grid_points).all():
+        problems.append("grid_points contains NaN or infinite values")
+    elif image_size is not None:
+        width, height = image_size
+        xs, ys = grid_points[:, :, 0], grid_points[:, :, 1]
+        if xs.min() < 0 or ys.min() < 0 or xs.max() > width or ys.max() > height:
+            problems.append(f"grid_points extend beyond the {width}x{height} image "
+                            f"(x {xs.min():.1f}..{xs.max():.1f}, y {ys.min():.1f}..{ys.max():.1f})")
+    return problems
+
+
+def piece_sizes(grid_points):
+    """Widths and heights of every grid square, measured along its top and left edges"""
+    widths = np.diff(grid_points[:-1, :, 0], axis=1)
+    heights = np.diff(grid_points[:, :-1, 1], axis=0)
+    return widths, heights
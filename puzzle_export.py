@@ -0,0 +1,201 @@
+"""Cut a document's image into puzzle pieces
+
+Every grid cell becomes one image: the bounding box of the quadrilateral
+between its four grid points, with everything outside the quadrilateral
+transparent (edges antialiased). The grid is split into bands of rows that are
+cut in a process pool; each worker decodes only the part of the image its
+band covers, writes its pieces straight to disk and returns just their
+positions, so no process ever holds more than one band of pixels.
+
+    python puzzle_export.py DOCUMENT [DOCUMENT ...] --output DIR [--workers N]
+
+Pieces go to DIR/<image name>/r<row>_c<col>.png, next to a pieces.json index
+of their positions in the source image; with --atlas they are packed into a
+few atlas images instead (see puzzle_atlas.py). Like puzzle_batch.py this
+never imports QtWidgets.
+"""
+import os
+import sys
+import json
+import math
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from puzzle_log import io_log, configure_logging
+from puzzle_document import read_document, native_image_path, document_grid_points
+
+
+# Each worker gets about this many bands, so a slow band doesn't leave the other cores idle
+BANDS_PER_WORKER = 4
+
+
+def cell_quad(grid_points, row, col):
+    """Corners of cell (row, col) in drawing order: top left, top right, bottom right, bottom left"""
+    return (grid_points[row, col], grid_points[row, col + 1],
+            grid_points[row + 1, col + 1], grid_points[row + 1, col])
+
+
+def quad_bounds(quad, width, height):
+    """Whole-pixel bounding box (left, top, right, bottom) of a quad, clipped to the image"""
+    xs = [point[0] for point in quad]
+    ys = [point[1] for point in quad]
+    return (max(0, math.floor(min(xs))), max(0, math.floor(min(ys))),
+            min(width, math.ceil(max(xs))), min(height, math.ceil(max(ys))))
+
+
+def cut_band(image_path, band_points, first_row, image_size):
+    """Yield (row, col, (left, top, right, bottom), piece QImage) for every non-empty cell of a band
+
+    band_points holds the grid point rows first_row .. first_row + band rows
+    (inclusive, so the band's bottom edge is there too).
+    """
+    from PyQt5.QtGui import QImage, QImageReader, QPainter, QPolygonF, QBrush, QTransform
+    from PyQt5.QtCore import Qt, QRect, QPointF
+
+    width, height = image_size
+    band_left, band_top, band_right, band_bottom = quad_bounds(
+        [band_points.reshape(-1, 2).min(axis=0), band_points.reshape(-1, 2).max(axis=0)], width, height)
+    if band_right <= band_left or band_bottom <= band_top:
+        return
+
+    # Decode just the region this band covers
+    reader = QImageReader(image_path)
+    reader.setClipRect(QRect(band_left, band_top, band_right - band_left, band_bottom - band_top))
+    tile = reader.read()
+    if tile.isNull():
+        raise OSError(f"Could not read {image_path}: {reader.errorString()}")
+    brush = QBrush(tile.convertToFormat(QImage.Format_ARGB32_Premultiplied))
+
+    for band_row in range(band_points.shape[0] - 1):
+        for col in range(band_points.shape[1] - 1):
+            quad = cell_quad(band_points, band_row, col)
+            left, top, right, bottom = quad_bounds(quad, width, height)
+            if right <= left or bottom <= top:
+                continue
+            piece = QImage(right - left, bottom - top, QImage.Format_ARGB32_Premultiplied)
+            piece.fill(Qt.transparent)
+            # Filling the quad with the tile as brush texture gives antialiased edges, unlike a clip path
+            brush.setTransform(QTransform.fromTranslate(band_left - left, band_top - top))
+            painter = QPainter(piece)
+            painter.setRenderHint(QPainter.Antialiasing)
+            painter.setPen(Qt.NoPen)
+            painter.setBrush(brush)
+            painter.drawPolygon(QPolygonF([QPointF(x - left, y - top) for x, y in quad]))
+            painter.end()
+            yield first_row + band_row, col, (left, top, right, bottom), piece
+
+
+def piece_file_name(row, col, digits):
+    return f"r{row:0{digits}d}_c{col:0{digits}d}.png"
+
+
+def export_band_pngs(task):
+    """Worker: cut one band and write its pieces as PNGs; returns their index entries"""
+    image_path, band_points, first_row, image_size, output_dir, digits = task
+    entries = []
+    for row, col, (left, top, right, bottom), piece in cut_band(image_path, band_points, first_row, image_size):
+        file_name = piece_file_name(row, col, digits)
+        if not piece.save(os.path.join(output_dir, file_name)):
+            raise OSError(f"Could not write {os.path.join(output_dir, file_name)}")
+        entries.append({"row": row, "col": col, "x": left, "y": top,
+                        "width": right - left, "height": bottom - top, "file": file_name})
+    return entries
+
+
+def load_export_source(document_path):
+    """(image_path, (width, height), grid_points) of a document, for cutting"""
+    from PyQt5.QtGui import QImageReader
+
+    document_data = read_document(document_path)
+    image_path = native_image_path(document_data["image_path"])
+    if not os.path.isabs(image_path):
+        image_path = os.path.join(os.path.dirname(os.path.abspath(document_path)), image_path)
+    size = QImageReader(image_path).size()
+    if not size.isValid():
+        raise OSError(f"Could not read the image {image_path}")
+    grid_points = document_grid_points(document_data, document_path)
+    if grid_points is None or grid_points.shape[0] < 2 or grid_points.shape[1] < 2:
+        raise ValueError(f"{document_path} has no grid to cut along")
+    return image_path, (size.width(), size.height()), grid_points
+
+
+def band_tasks(grid_points, workers):
+    """Split the grid rows into bands: (first_row, band grid points including the bottom edge)"""
+    rows = grid_points.shape[0] - 1
+    band_rows = max(1, rows // (workers * BANDS_PER_WORKER))
+    return [(first_row, grid_points[first_row:min(rows, first_row + band_rows) + 1])
+            for first_row in range(0, rows, band_rows)]
+
+
+def run_pool(function, tasks, workers):
+    """Map function over tasks in a process pool (in-process for a single worker), in order"""
+    if workers == 1 or len(tasks) <= 1:
+        return [function(task) for task in tasks]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(function, tasks))
+
+
+def export_pieces(document_path, output_dir, workers=None):
+    """Cut the document's image into one PNG per grid cell under output_dir/<image name>/"""
+    workers = workers or os.cpu_count() or 1
+    image_path, image_size, grid_points = load_export_source(document_path)
+    piece_dir = os.path.join(output_dir, os.path.splitext(os.path.basename(image_path))[0])
+    os.makedirs(piece_dir, exist_ok=True)
+
+    digits = len(str(max(grid_points.shape[:2])))
+    tasks = [(image_path, band_points, first_row, image_size, piece_dir, digits)
+             for first_row, band_points in band_tasks(grid_points, workers)]
+    pieces = [entry for entries in run_pool(export_band_pngs, tasks, workers) for entry in entries]
+
+    index = {
+        "image_path": image_path.replace('\\', '/'),
+        "image_width": image_size[0],
+        "image_height": image_size[1],
+        "grid_x": grid_points.shape[1] - 1,
+        "grid_y": grid_points.shape[0] - 1,
+        "pieces": pieces,
+    }
+    with open(os.path.join(piece_dir, "pieces.json"), "w") as index_file:
+        json.dump(index, index_file)
+    io_log.info("Cut %d pieces from %s into %s", len(pieces), image_path, piece_dir)
+    return piece_dir, len(pieces)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cut puzzle documents into one image per grid cell.")
+    parser.add_argument("documents", nargs="+", help="puzzle documents (.puz.json) to cut")
+    parser.add_argument("--output", "-o", required=True, help="directory for the pieces")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                        help="worker processes (default: one per CPU)")
+    parser.add_argument("--atlas", action="store_true",
+                        help="pack the pieces into atlas images with a JSON index instead of one PNG each")
+    parser.add_argument("--atlas-size", type=int, default=4096, help="largest atlas width and height (default 4096)")
+    parser.add_argument("--padding", type=int, default=2, help="transparent pixels between atlas pieces (default 2)")
+    parser.add_argument("--log", metavar="SPEC", help="log verbosity, as for puzzle_pieces_maker.py")
+    args = parser.parse_args()
+    try:
+        configure_logging(args.log)
+    except ValueError as e:
+        parser.error(str(e))
+
+    failures = 0
+    for document_path in args.documents:
+        started = time.perf_counter()
+        try:
+            if args.atlas:
+                from puzzle_atlas import export_atlas
+                index_path, count, pages = export_atlas(document_path, args.output, max(1, args.workers),
+                                                        args.atlas_size, args.padding)
+                print(f"{document_path}: {count} pieces in {pages} atlas(es), index {index_path} "
+                      f"({time.perf_counter() - started:.1f} s)")
+            else:
+                piece_dir, count = export_pieces(document_path, args.output, max(1, args.workers))
+                print(f"{document_path}: {count} pieces in {piece_dir} ({time.perf_counter() - started:.1f} s)")
+        except (OSError, ValueError) as e:
+            print(f"{document_path}: {e}")
+            failures += 1
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
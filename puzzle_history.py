@@ -0,0 +1,117 @@
+"""Undo/redo history of grid edits, as sparse diffs
+
+Every finished edit (a drag, an auto-fit) is stored as the flat indices of
+the grid points it changed plus their positions before and after, so moving
+one endpoint of a 1000x1000 grid costs a few dozen bytes instead of a copy of
+the grid. Undo and redo write just those points back, in place, so stepping
+through the history costs in proportion to the edit, not to the grid.
+
+A run of small nudges of the same points (each moving them no further than
+COALESCE_DISTANCE image pixels) is kept as one step. A nudge never joins a
+larger edit, so the nudge after a drag can be undone on its own. The oldest steps are
+dropped once the history holds more than max_bytes of diffs.
+
+Edits that replace the grid (new dimensions, a loaded document) are not
+diffs; the history is cleared instead.
+"""
+import numpy as np
+from puzzle_log import drag_log
+
+
+# Edits that move the same points as the previous one by at most this many image pixels extend it,
+# if that one was such a nudge too
+COALESCE_DISTANCE = 2.0
+
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+
+
+class GridEdit:
+    """One undo step: flat point indices (row * cols + col) and the (x, y) of those points before and after"""
+    __slots__ = ("indices", "before", "after", "nudge")
+
+    def __init__(self, indices, before, after, nudge=False):
+        self.indices = indices
+        self.before = before
+        self.after = after
+        self.nudge = nudge  # Started by a nudge, so later nudges of the same points extend it
+
+    @property
+    def nbytes(self):
+        return self.indices.nbytes + self.before.nbytes + self.after.nbytes
+
+
+class GridHistory:
+    """Undo and redo stacks of GridEdits for one grid"""
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.undo_stack = []
+        self.redo_stack = []
+        self.nbytes = 0
+
+    def clear(self):
+        self.undo_stack = []
+        self.redo_stack = []
+        self.nbytes = 0
+
+    def can_undo(self):
+        return bool(self.undo_stack)
+
+    def can_redo(self):
+        return bool(self.redo_stack)
+
+    def record(self, indices, before, after):
+        """Add an edit that moved the points at flat indices from before to after ((n, 2) arrays)"""
+        indices = np.asarray(indices, dtype=np.int32).reshape(-1)
+        before = np.array(before, dtype=np.float64).reshape(-1, 2)
+        after = np.array(after, dtype=np.float64).reshape(-1, 2)
+        moved = (before != after).any(axis=1)
+        if not moved.any():
+            return
+        if not moved.all():
+            indices, before, after = indices[moved], before[moved], after[moved]
+
+        for edit in self.redo_stack:
+            self.nbytes -= edit.nbytes
+        self.redo_stack = []
+
+        nudge = np.abs(after - before).max() <= COALESCE_DISTANCE
+        last = self.undo_stack[-1] if self.undo_stack else None
+        if nudge and last is not None and last.nudge and np.array_equal(last.indices, indices):
+            # Another nudge of the points the last nudge moved: extend that step
+            last.after = after
+            return
+
+        edit = GridEdit(indices, before, after, nudge)
+        self.undo_stack.append(edit)
+        self.nbytes += edit.nbytes
+        # The step just recorded is kept even if it is over the limit on its own
+        while self.nbytes > self.max_bytes and len(self.undo_stack) > 1:
+            self.nbytes -= self.undo_stack.pop(0).nbytes
+        drag_log.debug("History: %d points changed, %d steps, %d bytes", len(indices),
+                       len(self.undo_stack), self.nbytes)
+
+    def record_change(self, old_grid_points, new_grid_points):
+        """Add the edit turning old_grid_points into new_grid_points (same shape; only the differences are kept)"""
+        old_flat = old_grid_points.reshape(-1, 2)
+        new_flat = new_grid_points.reshape(-1, 2)
+        indices = np.flatnonzero((old_flat != new_flat).any(axis=1))
+        self.record(indices, old_flat[indices], new_flat[indices])
+
+    def undo(self, grid_points):
+        """Put the points of the last edit back in grid_points, in place; the flat indices written, or None"""
+        if not self.undo_stack:
+            return None
+        edit = self.undo_stack.pop()
+        self.redo_stack.append(edit)
+        grid_points.reshape(-1, 2)[edit.indices] = edit.before
+        return edit.indices
+
+    def redo(self, grid_points):
+        """Reapply the last undone edit to grid_points, in place; the flat indices written, or None"""
+        if not self.redo_stack:
+            return None
+        edit = self.redo_stack.pop()
+        self.undo_stack.append(edit)
+        grid_points.reshape(-1, 2)[edit.indices] = edit.after
+        return edit.indices
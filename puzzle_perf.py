@@ -0,0 +1,96 @@
+"""Lightweight timing of the viewer's hot paths
+
+Each stage (paint, grid, display, mouse_move, ...) keeps a rolling window of
+durations for percentiles, and every sample also goes into a bounded trace
+that can be exported as JSON. The export uses the Chrome trace event format,
+so it opens in chrome://tracing or Perfetto, and adds a per-stage summary.
+
+Timing a stage costs one perf_counter() call and a deque append:
+
+    started = time.perf_counter()
+    ...
+    perf.record("paint", started)
+"""
+import os
+import json
+import time
+from collections import deque
+
+
+class PerfStats:
+    """Rolling per-stage timings plus a bounded event trace"""
+
+    def __init__(self, window=600, trace_length=20000):
+        self.enabled = True
+        self.window = window
+        self.samples = {}  # Stage name -> deque of recent durations in seconds
+        self.trace = deque(maxlen=trace_length)  # (stage, start, duration) in perf_counter seconds
+        self.epoch = time.perf_counter()
+
+    def record(self, stage, started):
+        """Add one sample for stage, which began at perf_counter() value started"""
+        if not self.enabled:
+            return
+        duration = time.perf_counter() - started
+        samples = self.samples.get(stage)
+        if samples is None:
+            samples = self.samples[stage] = deque(maxlen=self.window)
+        samples.append(duration)
+        self.trace.append((stage, started, duration))
+
+    def reset(self):
+        self.samples.clear()
+        self.trace.clear()
+        self.epoch = time.perf_counter()
+
+    def last_ms(self, stage):
+        samples = self.samples.get(stage)
+        return samples[-1] * 1000 if samples else None
+
+    def percentiles_ms(self, stage, points=(50, 95, 99)):
+        """Nearest-rank percentiles of the stage's recent samples, in milliseconds (None if no samples)"""
+        samples = self.samples.get(stage)
+        if not samples:
+            return None
+        values = sorted(samples)
+        return tuple(values[min(len(values) - 1, max(0, -(-len(values) * point // 100) - 1))] * 1000
+                     for point in points)
+
+    def summary(self):
+        """Per-stage count, mean, max and p50/p95/p99 over the rolling window, in milliseconds"""
+        result = {}
+        for stage, samples in self.samples.items():
+            if not samples:
+                continue
+            p50, p95, p99 = self.percentiles_ms(stage)
+            result[stage] = {
+                "count": len(samples),
+                "mean_ms": round(sum(samples) / len(samples) * 1000, 3),
+                "max_ms": round(max(samples) * 1000, 3),
+                "p50_ms": round(p50, 3),
+                "p95_ms": round(p95, 3),
+                "p99_ms": round(p99, 3),
+            }
+        return result
+
+    def export_trace(self, path, metadata=None):
+        """Write the trace and summary as JSON; the file is replaced atomically"""
+        events = [{
+            "name": stage,
+            "ph": "X",
+            "ts": round((started - self.epoch) * 1e6, 1),
+            "dur": round(duration * 1e6, 1),
+            "pid": os.getpid(),
+            "tid": 0,
+        } for stage, started, duration in self.trace]
+        document = {
+            "traceEvents": events,
+            "displayTimeUnit": "ms",
+            "summary": self.summary(),
+            "metadata": metadata or {},
+        }
+        temp_path = path + ".tmp"
+        with open(temp_path, "w") as trace_file:
+            json.dump(document, trace_file)
+        os.replace(temp_path, path)
+        return path
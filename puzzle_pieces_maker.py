@@ -1,12 +1,28 @@
 import sys
 import os
-import json
+import time
+import math
+import logging
+import argparse
+from collections import OrderedDict
+import numpy as np
 from PyQt5.QtWidgets import (QApplication, QMainWindow, QVBoxLayout, QHBoxLayout,
                             QWidget, QPushButton, QFileDialog, QLabel, QSpinBox,
                             QDialog, QDialogButtonBox, QFormLayout, QMessageBox,
-                            QScrollArea, QSlider, QFrame)
-from PyQt5.QtGui import QPixmap, QPainter, QPen, QBrush
-from PyQt5.QtCore import Qt, QRect, QPoint, QSize
+                            QScrollArea, QSlider, QFrame, QProgressBar, QShortcut)
+from PyQt5.QtGui import (QPixmap, QImage, QImageReader, QPainter, QPen, QBrush, QPolygonF,
+                         QColor, QFontMetrics, QKeySequence)
+from PyQt5.QtCore import Qt, QRect, QRectF, QPoint, QSize, QTimer, QThread, pyqtSignal
+from puzzle_pyramid import TilePyramid, PYRAMID_MIN_PIXELS, build_pyramid, pyramid_path_for
+from puzzle_log import render_log, drag_log, io_log, configure_logging, LOG_ENV_VAR
+from puzzle_perf import PerfStats
+from puzzle_session import SessionRecorder
+from puzzle_autofit import fit_grid_to_image
+from puzzle_autosave import Autosave, read_recovery
+from puzzle_history import GridHistory
+from puzzle_document import (MAX_GRID_SQUARES, GRID_FORMATS, empty_grid_points, uniform_grid_points, make_document,
+                             write_document, read_document, native_image_path, document_grid_points,
+                             document_grid_format, owned_grid_points)
 
 
 class GridDimensionsDialog(QDialog):
@@ -20,12 +36,12 @@ class GridDimensionsDialog(QDialog):
 
         self.x_spinbox = QSpinBox()
         self.x_spinbox.setMinimum(1)
-        self.x_spinbox.setMaximum(100)
+        self.x_spinbox.setMaximum(MAX_GRID_SQUARES)
         self.x_spinbox.setValue(current_x)
 
         self.y_spinbox = QSpinBox()
         self.y_spinbox.setMinimum(1)
-        self.y_spinbox.setMaximum(100)
+        self.y_spinbox.setMaximum(MAX_GRID_SQUARES)
         self.y_spinbox.setValue(current_y)
 
         layout.addRow("X Squares (Width):", self.x_spinbox)
@@ -45,454 +61,1319 @@ class GridDimensionsDialog(QDialog):
         return self.x_spinbox.value(), self.y_spinbox.value()
 
 
+class ScaledPixmapCache:
+    """Bounded LRU cache of scaled copies of the source image, keyed by zoom level"""
+
+    def __init__(self, max_bytes=256 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.source_key = None  # cacheKey() of the pixmap the entries were scaled from
+        self._entries = OrderedDict()
+
+    @staticmethod
+    def make_key(zoom_factor, transform_mode=Qt.SmoothTransformation):
+        # Round so that float noise from slider/zoom arithmetic maps to the same entry
+        return (round(zoom_factor, 4), int(transform_mode))
+
+    @staticmethod
+    def pixmap_bytes(pixmap):
+        return pixmap.width() * pixmap.height() * max(pixmap.depth(), 8) // 8
+
+    def get(self, key):
+        pixmap = self._entries.get(key)
+        if pixmap is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return pixmap
+
+    def put(self, key, pixmap):
+        if key in self._entries:
+            self.total_bytes -= self.pixmap_bytes(self._entries.pop(key))
+        size = self.pixmap_bytes(pixmap)
+        if size > self.max_bytes:
+            # Too big to ever fit the budget, don't evict everything else for it
+            return
+        self._entries[key] = pixmap
+        self.total_bytes += size
+        while self.total_bytes > self.max_bytes:
+            _key, evicted = self._entries.popitem(last=False)
+            self.total_bytes -= self.pixmap_bytes(evicted)
+
+    def find_nearest(self, zoom_factor, transform_mode=Qt.SmoothTransformation):
+        """Find the cached scale closest to zoom_factor, preferring larger ones, without counting a lookup"""
+        best_key = None
+        for key in self._entries:
+            if key[1] != int(transform_mode):
+                continue
+            if best_key is None:
+                best_key = key
+            elif (key[0] >= zoom_factor) != (best_key[0] >= zoom_factor):
+                # Downscaling a larger image looks better than blowing up a smaller one
+                if key[0] >= zoom_factor:
+                    best_key = key
+            elif abs(key[0] - zoom_factor) < abs(best_key[0] - zoom_factor):
+                best_key = key
+        return self._entries[best_key] if best_key is not None else None
+
+    def clear(self, source_key=None):
+        self._entries.clear()
+        self.total_bytes = 0
+        self.source_key = source_key
+
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def __len__(self):
+        return len(self._entries)
+
+
+def points_to_polygon(points):
+    """QPolygonF of an (n, 2) float array, filled with one buffer copy instead of n QPointF objects"""
+    points = np.ascontiguousarray(points, dtype=np.float64)
+    polygon = QPolygonF(len(points))
+    if len(points):
+        buffer = polygon.data()
+        buffer.setsize(points.nbytes)
+        np.frombuffer(buffer, dtype=np.float64).reshape(-1, 2)[:] = points
+    return polygon
+
+
+class GridLineIndex:
+    """Bounding boxes of every row and column polyline of a grid
+
+    Lets a repaint pick out just the lines crossing the exposed area, so the
+    cost of drawing follows what is on screen rather than the total grid size.
+    """
+
+    def __init__(self, points):
+        self.points = points
+        xs = points[:, :, 0]
+        ys = points[:, :, 1]
+        # Each bounds array holds (left, top, right, bottom) per row/column
+        self.row_bounds = np.stack([xs.min(axis=1), ys.min(axis=1), xs.max(axis=1), ys.max(axis=1)], axis=1)
+        self.col_bounds = np.stack([xs.min(axis=0), ys.min(axis=0), xs.max(axis=0), ys.max(axis=0)], axis=1)
+
+    def include_point(self, row, col):
+        """Grow the bounds of one row and column to cover a point that was moved in place"""
+        x, y = self.points[row, col]
+        for bounds in (self.row_bounds[row], self.col_bounds[col]):
+            bounds[0] = min(bounds[0], x)
+            bounds[1] = min(bounds[1], y)
+            bounds[2] = max(bounds[2], x)
+            bounds[3] = max(bounds[3], y)
+
+    @staticmethod
+    def crossing(bounds, rect):
+        """Indices of the lines whose bounding box intersects rect (a QRectF)"""
+        return np.flatnonzero((bounds[:, 2] >= rect.left()) & (bounds[:, 0] <= rect.right())
+                              & (bounds[:, 3] >= rect.top()) & (bounds[:, 1] <= rect.bottom()))
+
+    @staticmethod
+    def thin(indices, step, last):
+        """Keep every step-th line (counted from 0) plus the last one, which is the grid edge"""
+        if step <= 1:
+            return indices
+        return indices[(indices % step == 0) | (indices == last)]
+
+    @staticmethod
+    def span(first, last, step, count):
+        """Vertex indices along a polyline from one line before first to one after last"""
+        first = max(first - step, 0)
+        last = min(last + step, count - 1)
+        vertices = np.arange(first - first % step, last + 1, step)
+        return np.union1d(vertices[vertices >= first], [first, last])
+
+    @classmethod
+    def lines_crossing(cls, row_bounds, col_bounds, rect, step_x=1, step_y=1):
+        """(rows, col_span, cols, row_span) of the lines crossing rect, keeping every step-th line, or None
+
+        col_span holds the vertices drawn along each of the rows, row_span those along the columns.
+        """
+        row_count, col_count = len(row_bounds), len(col_bounds)
+        rows = cls.crossing(row_bounds, rect)
+        cols = cls.crossing(col_bounds, rect)
+        if not len(rows) and not len(cols):
+            return None
+
+        # A row line is drawn between the visible columns (and vice versa), with one vertex of slack
+        # on each side so the segments leaving the rect are kept
+        if len(cols):
+            col_span = cls.span(cols[0], cols[-1], step_x, col_count)
+        else:
+            col_span = np.arange(col_count)
+        if len(rows):
+            row_span = cls.span(rows[0], rows[-1], step_y, row_count)
+        else:
+            row_span = np.arange(row_count)
+        return cls.thin(rows, step_y, row_count - 1), col_span, cls.thin(cols, step_x, col_count - 1), row_span
+
+    def visible_polylines(self, rect, step_x=1, step_y=1):
+        """(n, 2) point arrays of the row and column lines crossing rect, keeping every step-th line"""
+        lines = self.lines_crossing(self.row_bounds, self.col_bounds, rect, step_x, step_y)
+        if lines is None:
+            return []
+        rows, col_span, cols, row_span = lines
+        polylines = [self.points[row, col_span] for row in rows]
+        polylines.extend(self.points[row_span, col] for col in cols)
+        return polylines
+
+
+class DragHandles:
+    """Compact store of drag handles with a bucket index of their display positions
+
+    Handles are kept as parallel arrays (grid row/column, edge flags, display
+    position) rather than one dict each. The index sorts handles into square
+    buckets of the widget, with each bucket's slice found through a dense
+    offsets table, so a click only looks at the handles in the few buckets
+    around it.
+    """
+    BUCKET_SIZE = 32
+    HANDLE_SIZE = 8
+    # Bucket size doubles until the offsets table is at most this large (or 4 entries per handle)
+    MAX_BUCKETS = 256 * 1024
+    # Moved handles are checked on the side until there are this many, then the index is rebuilt
+    MAX_DISPLACED = 64
+
+    def __init__(self, rows, cols, grid_x_max, grid_y_max):
+        self.rows = np.asarray(rows, dtype=np.intp)
+        self.cols = np.asarray(cols, dtype=np.intp)
+        self.left = self.cols == 0
+        self.right = self.cols == grid_x_max
+        self.top = self.rows == 0
+        self.bottom = self.rows == grid_y_max
+        self.positions = np.zeros((len(self.rows), 2), dtype=np.int64)
+        # Flat grid_points index of every handle, and scratch space, so updating positions allocates nothing
+        self.flat_indices = self.rows * (grid_x_max + 1) + self.cols
+        self.scratch = np.empty((len(self.rows), 2))
+        self.zoom_factor = None  # Zoom the positions were computed for; None when stale
+        self.bucket_size = self.BUCKET_SIZE
+        self.bucket_origin = np.zeros(2, dtype=np.int64)
+        self.bucket_shape = (0, 0)
+        self.bucket_offsets = None
+        self.bucket_members = None
+        self.displaced = set()  # Handles moved since the index was built, possibly out of their bucket
+
+    def __len__(self):
+        return len(self.rows)
+
+    def edges(self, index):
+        """(left, right, top, bottom) flags of one handle"""
+        return (bool(self.left[index]), bool(self.right[index]),
+                bool(self.top[index]), bool(self.bottom[index]))
+
+    def update_positions(self, grid_points, zoom_factor, padding, rebuild_index=True):
+        """Recompute display positions from grid_points, and the bucket index unless told not to"""
+        # mode='clip' lets take write straight into out instead of through a temporary
+        points = grid_points.reshape(-1, 2).take(self.flat_indices, axis=0, out=self.scratch, mode='clip')
+        np.multiply(points, zoom_factor, out=points)
+        # The cast truncates toward zero, matching get_scaled_grid_point's int()
+        np.copyto(self.positions, points, casting='unsafe')
+        self.positions += padding
+        self.zoom_factor = zoom_factor
+        self.bucket_offsets = None
+        if rebuild_index:
+            self.build_index()
+
+    def move_handle(self, index, grid_point, zoom_factor, padding):
+        """Update one handle's display position without rebuilding the index"""
+        self.positions[index] = (np.asarray(grid_point) * zoom_factor).astype(np.int64) + padding
+        if self.bucket_offsets is not None:
+            self.displaced.add(index)
+            if len(self.displaced) > self.MAX_DISPLACED:
+                self.build_index()
+
+    def build_index(self):
+        self.displaced = set()
+        if not len(self):
+            return
+        self.bucket_origin = self.positions.min(axis=0)
+        extent = self.positions.max(axis=0) - self.bucket_origin + 1
+        bucket_size = self.BUCKET_SIZE
+        max_buckets = max(self.MAX_BUCKETS, 4 * len(self))
+        while (extent[0] // bucket_size + 1) * (extent[1] // bucket_size + 1) > max_buckets:
+            bucket_size *= 2
+        self.bucket_size = bucket_size
+        columns = int(extent[0] // bucket_size + 1)
+        rows = int(extent[1] // bucket_size + 1)
+        self.bucket_shape = (columns, rows)
+
+        buckets = (self.positions - self.bucket_origin) // bucket_size
+        keys = buckets[:, 1] * columns + buckets[:, 0]
+        self.bucket_members = np.argsort(keys, kind='stable')
+        self.bucket_offsets = np.zeros(columns * rows + 1, dtype=np.int64)
+        np.cumsum(np.bincount(keys, minlength=columns * rows), out=self.bucket_offsets[1:])
+
+    def drawable(self, indices, step_x=1, step_y=1):
+        """Mask of the handles among indices that sit on grid lines drawn at the given line steps"""
+        rows = self.rows[indices]
+        cols = self.cols[indices]
+        return (((rows % step_y == 0) | self.bottom[indices])
+                & ((cols % step_x == 0) | self.right[indices]))
+
+    def candidates(self, left, top, right, bottom):
+        """Indices of the handles that may lie in the display rect left..right x top..bottom"""
+        if self.bucket_offsets is None:
+            return np.arange(len(self))
+        columns, rows = self.bucket_shape
+        first_x = max((left - self.bucket_origin[0]) // self.bucket_size, 0)
+        last_x = min((right - self.bucket_origin[0]) // self.bucket_size, columns - 1)
+        first_y = max((top - self.bucket_origin[1]) // self.bucket_size, 0)
+        last_y = min((bottom - self.bucket_origin[1]) // self.bucket_size, rows - 1)
+
+        # Buckets are numbered row by row, so each bucket row of the rect is one slice of members
+        slices = [self.bucket_members[self.bucket_offsets[bucket_y * columns + first_x]:
+                                      self.bucket_offsets[bucket_y * columns + last_x + 1]]
+                  for bucket_y in range(first_y, last_y + 1)] if first_x <= last_x else []
+        if self.displaced:
+            slices.append(np.fromiter(self.displaced, dtype=np.intp))
+        if not slices:
+            return np.zeros(0, dtype=np.intp)
+        return np.unique(np.concatenate(slices)) if self.displaced else np.concatenate(slices)
+
+    def in_rect(self, rect, step_x=1, step_y=1):
+        """Indices of the drawable handles centred inside rect (a QRect)"""
+        if not len(self):
+            return np.zeros(0, dtype=np.intp)
+        indices = self.candidates(rect.left(), rect.top(), rect.right(), rect.bottom())
+        x = self.positions[indices, 0]
+        y = self.positions[indices, 1]
+        inside = ((x >= rect.left()) & (x <= rect.right()) & (y >= rect.top()) & (y <= rect.bottom())
+                  & self.drawable(indices, step_x, step_y))
+        return indices[inside]
+
+    def find(self, pos, step_x=1, step_y=1):
+        """Index of the drawable handle under display position pos (a QPoint), or None"""
+        if not len(self):
+            return None
+        if self.bucket_offsets is None:
+            self.build_index()
+        half = self.HANDLE_SIZE // 2
+
+        # A handle at (hx, hy) covers hx - half .. hx + half - 1, the same pixels as its QRect
+        indices = self.candidates(pos.x() - half + 1, pos.y() - half + 1, pos.x() + half, pos.y() + half)
+        dx = pos.x() - self.positions[indices, 0]
+        dy = pos.y() - self.positions[indices, 1]
+        hits = (dx >= -half) & (dx < half) & (dy >= -half) & (dy < half) & self.drawable(indices, step_x, step_y)
+        if not hits.any():
+            return None
+        distance = np.where(hits, dx * dx + dy * dy, np.iinfo(np.int64).max)
+        return int(indices[np.argmin(distance)])
+
+
+class DragOverlay:
+    """Working grid of a crop drag, laid over the committed grid and merged into it on release
+
+    A crop drag moves whole perimeter edges and re-places the interior points
+    between them, keeping their relative spacing, so it changes the x
+    coordinates of every point (left or right edge), the y coordinates (top or
+    bottom edge) or both (corner). Only those coordinate planes are merged back
+    on release; cancelling just deactivates the overlay, as the committed grid
+    was never touched. The buffers are allocated once per grid shape and
+    reused by later drags, so moving a handle allocates nothing.
+
+    Each interior coordinate is its row's (column's) first edge plus a fixed
+    fraction of the distance to the last edge, so a move only shifts the
+    dragged edges and re-places the rest of the perimeter, where the handles
+    are: O(rows + cols), whatever the grid size. The interior of points is
+    stale until placed, which a repaint does for just the lines it draws
+    (visible_polylines) and the release for the whole grid (place_interior).
+
+    The bounds of the working grid follow from the edges alone too: every
+    row's (column's) interior lies between its first and last point scaled by
+    the smallest and largest relative position in it.
+    """
+
+    def __init__(self):
+        self.points = None  # (rows, cols, 2) working grid: the perimeter is current, the interior only once placed
+        self.active = False
+        self.placed = False  # Whether the interior of points is current
+        self.moves_x = False
+        self.moves_y = False
+        self.relative = None  # Per axis: interior coordinates as fractions of the edge-to-edge distance
+        self.scratch = None  # Per axis: two contiguous interior-shaped work arrays, shared between the axes
+        self.relative_range = None  # Per axis: lowest and highest relative position per row/column, edges included
+        self.cross_range = None  # Per axis: the same across the other direction, per column (x) or row (y)
+        self.edge_scratch = None  # Per axis: three edge-length work arrays for bounds()
+        self.fixed_range = [None, None]  # Per axis: (min, max) of a plane the drag doesn't change
+        self.grid_index = None  # GridLineIndex of the committed grid, for the line bounds the drag doesn't change
+        self.row_bounds = None  # Line bounds of the working grid, as in GridLineIndex, set by update_line_bounds()
+        self.col_bounds = None
+
+    @staticmethod
+    def edge_views(points, axis):
+        """(first edge, last edge, interior) views of one coordinate plane: x between columns, y between rows"""
+        plane = points[..., axis]
+        if axis == 0:
+            return plane[:, :1], plane[:, -1:], plane[:, 1:-1]
+        return plane[:1, :], plane[-1:, :], plane[1:-1, :]
+
+    def begin(self, grid_points, moves_x, moves_y, grid_index=None):
+        """Start a drag of grid_points whose handle moves along x and/or y
+
+        grid_index is the GridLineIndex of grid_points, if there is one already.
+        """
+        if self.points is None or self.points.shape != grid_points.shape:
+            self.points = np.empty(grid_points.shape)
+            shapes = [self.edge_views(self.points, axis)[2].shape for axis in (0, 1)]
+            self.relative = [np.empty(shape) for shape in shapes]
+            sizes = [shape[0] * shape[1] for shape in shapes]
+            buffer = np.empty((2, max(sizes)))
+            self.scratch = [(buffer[0, :size].reshape(shape), buffer[1, :size].reshape(shape))
+                            for shape, size in zip(shapes, sizes)]
+            edge_lengths = (grid_points.shape[0], grid_points.shape[1])
+            self.relative_range = [np.empty((2, length)) for length in edge_lengths]
+            self.cross_range = [np.empty((2, length)) for length in reversed(edge_lengths)]
+            self.edge_scratch = [np.empty((3, length)) for length in edge_lengths]
+            self.row_bounds = np.empty((grid_points.shape[0], 4))
+            self.col_bounds = np.empty((grid_points.shape[1], 4))
+        np.copyto(self.points, grid_points)
+        self.grid_index = grid_index if grid_index is not None else GridLineIndex(grid_points)
+        self.moves_x = moves_x
+        self.moves_y = moves_y
+        for axis, moves in ((0, moves_x), (1, moves_y)):
+            if moves:
+                first, last, interior = self.edge_views(self.points, axis)
+                relative, span = self.relative[axis], self.scratch[axis][0]
+                np.copyto(span, last)
+                np.subtract(span, first, out=span)
+                np.subtract(interior, first, out=relative)
+                # Collapsed rows/columns put their interior points on the first edge
+                nonzero = span != 0
+                np.divide(relative, span, out=relative, where=nonzero)
+                np.multiply(relative, nonzero, out=relative)
+                low, high = self.relative_range[axis]
+                low.fill(0.0)
+                high.fill(1.0)
+                # The first and last line across are the edges themselves, at 0 and 1
+                cross_low, cross_high = self.cross_range[axis]
+                cross_low[0], cross_high[0] = 0.0, 0.0
+                cross_low[-1], cross_high[-1] = 1.0, 1.0
+                if relative.size:
+                    np.minimum(low, relative.min(axis=1 - axis), out=low)
+                    np.maximum(high, relative.max(axis=1 - axis), out=high)
+                    relative.min(axis=axis, out=cross_low[1:-1])
+                    relative.max(axis=axis, out=cross_high[1:-1])
+                self.fixed_range[axis] = None
+            else:
+                plane = self.points[..., axis]
+                self.fixed_range[axis] = (float(plane.min()), float(plane.max()))
+        self.active = True
+        self.placed = True
+
+    def bounds(self):
+        """(left, top, right, bottom) of the working grid in image coordinates"""
+        extents = []
+        for axis in (0, 1):
+            if self.fixed_range[axis] is not None:
+                extents.append(self.fixed_range[axis])
+                continue
+            plane = self.points[..., axis]
+            first, last = (plane[:, 0], plane[:, -1]) if axis == 0 else (plane[0, :], plane[-1, :])
+            span, lowest, highest = self.edge_scratch[axis]
+            low, high = self.relative_range[axis]
+            np.subtract(last, first, out=span)
+            # A negative span (crossed edges) swaps which end is lowest
+            np.multiply(low, span, out=lowest)
+            np.multiply(high, span, out=highest)
+            np.maximum(lowest, highest, out=span)
+            np.minimum(lowest, highest, out=lowest)
+            np.add(lowest, first, out=lowest)
+            np.add(span, first, out=span)
+            extents.append((float(lowest.min()), float(span.max())))
+        (left, right), (top, bottom) = extents
+        return left, top, right, bottom
+
+    def update_line_bounds(self):
+        """Bounds of every row and column line of the working grid, in O(rows + cols)
+
+        Along the drag's axis they are exact; across it (the y extent of a row
+        when the top or bottom edge moves) they are bounded from the smallest
+        and largest edge position and edge-to-edge distance, which may be a
+        little wider than the line.
+        """
+        lines = (self.row_bounds, self.col_bounds)
+        committed = (self.grid_index.row_bounds, self.grid_index.col_bounds)
+        for axis, moves in ((0, self.moves_x), (1, self.moves_y)):
+            # Along: rows for x, columns for y; across: the other way round
+            along, across = lines[axis], lines[1 - axis]
+            if not moves:
+                along[:, [axis, axis + 2]] = committed[axis][:, [axis, axis + 2]]
+                across[:, [axis, axis + 2]] = committed[1 - axis][:, [axis, axis + 2]]
+                continue
+            plane = self.points[..., axis]
+            first, last = (plane[:, 0], plane[:, -1]) if axis == 0 else (plane[0, :], plane[-1, :])
+            span = last - first
+            low, high = self.relative_range[axis]
+            along[:, axis] = np.minimum(low * span, high * span) + first
+            along[:, axis + 2] = np.maximum(low * span, high * span) + first
+            cross_low, cross_high = self.cross_range[axis]
+            products = [cross_low * span.min(), cross_low * span.max(), cross_high * span.min(), cross_high * span.max()]
+            across[:, axis] = np.minimum.reduce(products) + first.min()
+            across[:, axis + 2] = np.maximum.reduce(products) + first.max()
+
+    def place(self, rows, cols):
+        """Place the points where the given rows and columns (index arrays) cross"""
+        points = self.points
+        if self.moves_x:
+            inner = cols[(cols > 0) & (cols < points.shape[1] - 1)]
+            first, last = points[rows, :1, 0], points[rows, -1:, 0]
+            points[rows[:, None], inner, 0] = self.relative[0][rows[:, None], inner - 1] * (last - first) + first
+        if self.moves_y:
+            inner = rows[(rows > 0) & (rows < points.shape[0] - 1)]
+            first, last = points[0, cols, 1], points[-1, cols, 1]
+            points[inner[:, None], cols, 1] = self.relative[1][inner[:, None] - 1, cols] * (last - first) + first
+
+    def visible_polylines(self, rect, step_x=1, step_y=1):
+        """GridLineIndex.visible_polylines of the working grid, placing only the points it returns"""
+        self.update_line_bounds()
+        lines = GridLineIndex.lines_crossing(self.row_bounds, self.col_bounds, rect, step_x, step_y)
+        if lines is None:
+            return []
+        rows, col_span, cols, row_span = lines
+        self.place(rows, col_span)
+        self.place(row_span, cols)
+        polylines = [self.points[row, col_span] for row in rows]
+        polylines.extend(self.points[row_span, col] for col in cols)
+        return polylines
+
+    def move(self, delta_x, delta_y, left, right, top, bottom):
+        """Move the dragged edges by a delta in image coordinates and re-place the rest of the perimeter"""
+        points = self.points
+        self.placed = False
+        if left:
+            points[:, 0, 0] += delta_x
+        if right:
+            points[:, -1, 0] += delta_x
+        if top:
+            points[0, :, 1] += delta_y
+        if bottom:
+            points[-1, :, 1] += delta_y
+        # The edges across the dragged ones: the top and bottom row for x, the left and right column for y
+        if self.moves_x:
+            work = self.scratch[0][0][0]
+            for row in (0, -1):
+                np.multiply(self.relative[0][row], points[row, -1, 0] - points[row, 0, 0], out=work)
+                np.add(work, points[row, 0, 0], out=points[row, 1:-1, 0])
+        if self.moves_y:
+            work = self.scratch[1][0][:, 0]
+            for col in (0, -1):
+                np.multiply(self.relative[1][:, col], points[-1, col, 1] - points[0, col, 1], out=work)
+                np.add(work, points[0, col, 1], out=points[1:-1, col, 1])
+
+    def place_interior(self):
+        """Place every interior point (the whole working grid is current afterwards) and return the grid"""
+        points = self.points
+        if self.placed:
+            return points
+        self.placed = True
+        for axis, moves in ((0, self.moves_x), (1, self.moves_y)):
+            if moves:
+                # NumPy buffers ufuncs over broadcast or strided operands, so the edges are first spread
+                # into contiguous arrays of the interior's shape, and the result copied into place
+                first, last, interior = self.edge_views(points, axis)
+                first_full, work = self.scratch[axis]
+                np.copyto(first_full, first)
+                np.copyto(work, last)
+                np.subtract(work, first_full, out=work)
+                np.multiply(self.relative[axis], work, out=work)
+                np.add(work, first_full, out=work)
+                np.copyto(interior, work)
+        return points
+
+    def merge(self, grid_points):
+        """Commit the drag: copy the planes it changed into grid_points, in place"""
+        self.place_interior()
+        for axis, moves in ((0, self.moves_x), (1, self.moves_y)):
+            if moves:
+                np.copyto(grid_points[..., axis], self.points[..., axis])
+        self.active = False
+        self.grid_index = None
+
+    def discard(self):
+        self.active = False
+        self.grid_index = None
+
+    def release(self):
+        """Free the buffers (when leaving crop mode)"""
+        self.__init__()
+
+
+class ImageLoadWorker(QThread):
+    """Decodes an image file off the GUI thread: a reduced preview first, then full resolution"""
+    progress = pyqtSignal(int, str)
+    preview_ready = pyqtSignal(QImage)
+    image_ready = pyqtSignal(QImage)
+    load_failed = pyqtSignal(str)
+
+    def __init__(self, file_path, preview_size=None, parent=None):
+        super().__init__(parent)
+        self.file_path = file_path
+        self.preview_size = preview_size
+        self._cancelled = False
+
+    def cancel(self):
+        """Ask the worker to stop; a decode already in progress is finished and then discarded"""
+        self._cancelled = True
+
+    def is_cancelled(self):
+        return self._cancelled
+
+    def run(self):
+        reader = QImageReader(self.file_path)
+        full_size = reader.size()
+
+        # Decoders like JPEG can produce a reduced image much faster than the full one
+        if (self.preview_size is not None and full_size.isValid()
+                and (full_size.width() > self.preview_size.width()
+                     or full_size.height() > self.preview_size.height())):
+            self.progress.emit(10, "Decoding preview")
+            preview_reader = QImageReader(self.file_path)
+            preview_reader.setScaledSize(full_size.scaled(self.preview_size, Qt.KeepAspectRatio))
+            preview = preview_reader.read()
+            if self._cancelled:
+                return
+            if not preview.isNull():
+                self.preview_ready.emit(preview)
+
+        self.progress.emit(40, "Decoding full resolution")
+        image = reader.read()
+        if self._cancelled:
+            return
+        if image.isNull():
+            self.load_failed.emit(reader.errorString())
+            return
+        self.progress.emit(100, "Done")
+        self.image_ready.emit(image)
+
+
+class PyramidBuildWorker(QThread):
+    """Writes the tile pyramid of a decoded image off the GUI thread (see puzzle_pyramid.build_pyramid)"""
+    pyramid_ready = pyqtSignal(str)
+    build_failed = pyqtSignal(str)
+
+    def __init__(self, image, image_path, pyramid_path, parent=None):
+        super().__init__(parent)
+        # QImage is implicitly shared, so this holds the decoded pixels without copying them
+        self.image = image
+        self.image_path = image_path
+        self.pyramid_path = pyramid_path
+        self._cancelled = False
+
+    def cancel(self):
+        """Ask the worker to stop; the half-written pyramid is removed"""
+        self._cancelled = True
+
+    def is_cancelled(self):
+        return self._cancelled
+
+    def run(self):
+        try:
+            if build_pyramid(self.image, self.image_path, self.pyramid_path, is_cancelled=self.is_cancelled):
+                self.pyramid_ready.emit(self.pyramid_path)
+        except (OSError, ValueError) as e:
+            self.build_failed.emit(str(e))
+
+
 class ImageGridWidget(QLabel):
+    grid_edited = pyqtSignal()  # A drag or auto-fit changed grid_points (not emitted for set_grid/set_grid_points)
+
+    # Zoomed images larger than this many pixels are drawn tile by tile instead of as one pixmap
+    TILED_RENDER_MIN_PIXELS = 4096 * 4096
+    TILE_SIZE = 256
+    # Below this many display pixels between lines, only every 2nd/4th/... grid line is drawn
+    MIN_GRID_LINE_SPACING = 4
+    # Grids larger than this (on either axis) skip the per-row debug output
+    VERBOSE_GRID_MAX_SQUARES = 100
+    # Undo/redo steps of up to this many points update cached geometry point by point
+    MAX_INCREMENTAL_POINTS = 256
+
     def __init__(self):
         super().__init__()
-        self.original_pixmap = None
+        self.original_image = None  # Decoded QImage; may be a reduced preview while loading
+        self.image_pyramid = None  # On-disk TilePyramid, used instead of original_image for huge images
+        self.image_size = QSize()  # Full-resolution size, which grid points and zoom are relative to
+        self.scaled_pixmap = None  # Scaled base image for the current zoom (no grid drawn on it)
+        self.scaled_cache = ScaledPixmapCache()
+        # Viewport-only rendering: 'auto' switches to tiles for large zoomed images
+        self.render_mode = 'auto'  # 'auto', 'full' or 'tiled'
+        self.tiled_rendering = False
+        self.tile_cache = ScaledPixmapCache(max_bytes=64 * 1024 * 1024)
+        self.pyramid_tile_cache = ScaledPixmapCache(max_bytes=64 * 1024 * 1024)
+        self.preview_active = False  # True while a fast preview scale is on screen
+        # Counts renders of the base image (rescales or tile invalidations); layout changes leave it alone
+        self.render_generation = 0
+        self.render_key = None  # (image source, zoom, preview, tiled) of the last render
+        # Smooth re-render once zoom interaction has been idle for a moment
+        self.smooth_render_timer = QTimer(self)
+        self.smooth_render_timer.setSingleShot(True)
+        self.smooth_render_timer.setInterval(150)
+        self.smooth_render_timer.timeout.connect(self.finish_zoom_preview)
         self.grid_x_max = 0
         self.grid_y_max = 0
         self.zoom_factor = 1.0
         self.crop_mode = False
-        self.drag_handles = []
+        self.drag_endpoints_mode = False
+        self.drag_handles = None  # DragHandles of the perimeter (crop mode) or interior points (drag endpoints mode)
+        self.drag_start_point = None  # Original position of the point dragged in drag endpoints mode
+        self.drag_backdrop = None  # Static layer of the visible area, cached for the length of a crop drag
+        self.drag_backdrop_rect = QRect()
+        self.drag_dirty_rect = None  # Area covered by the working grid and handles at the last repaint
         self.padding = 10  # Add 10 pixel padding around the image
-        self.grid_points = []  # 2D array to store grid point locations
-        self.drag_grid_points = []  # Copy of grid points when dragging begins
+        self.grid_points = empty_grid_points()  # (rows+1, cols+1, 2) float array of grid point locations
+        self.grid_index = None  # Cached GridLineIndex of grid_points, see get_grid_index()
+        self.drag_overlay = DragOverlay()
+        self.drag_grid_points = None  # Working grid of a crop drag (drag_overlay.points, see DragOverlay), None otherwise
         self.is_dragging = False  # Flag to track if we're currently dragging
-        self.dragging_handle = None  # Reference to the handle being dragged
+        self.dragging_handle = None  # Index into drag_handles of the handle being dragged
+        self.history = GridHistory()  # Undo/redo of drags and auto-fits; cleared when the grid is replaced
         self.setAlignment(Qt.AlignCenter)
         self.setStyleSheet("border: 1px solid gray;")
         self.setMinimumSize(400, 300)
         # Enable focus so we can receive keyboard events
         self.setFocusPolicy(Qt.StrongFocus)
+        # paintEvent fills every exposed pixel, so Qt can skip erasing and scroll by blitting
+        self.setAttribute(Qt.WA_OpaquePaintEvent)
+        # Stage timings (paint, grid, display, mouse_move) and the optional on-screen overlay
+        self.perf = PerfStats()
+        self.show_perf_hud = False
+        self.perf_hud_rect = QRect()
+        self.perf_hud_timer = QTimer(self)
+        self.perf_hud_timer.setInterval(500)
+        self.perf_hud_timer.timeout.connect(lambda: self.update(self.perf_hud_rect))
+        self.session_recorder = None  # SessionRecorder while a session is being recorded
+
+    def set_image_source(self, image=None, pyramid=None, image_size=None):
+        """Set the image to display, either a decoded image, a tile pyramid, or both
+
+        image may be a reduced-size preview of the real image, in which case
+        image_size gives the full resolution the grid and zoom refer to.
+        """
+        if isinstance(image, QPixmap):
+            image = image.toImage()
+        if self.image_pyramid is not None and self.image_pyramid is not pyramid:
+            self.image_pyramid.close()
+        self.original_image = image
+        self.image_pyramid = pyramid
+        if image_size is not None:
+            self.image_size = QSize(image_size)
+        elif image is not None:
+            self.image_size = image.size()
+        elif pyramid is not None:
+            self.image_size = QSize(pyramid.width, pyramid.height)
+        else:
+            self.image_size = QSize()
+        self.scaled_pixmap = None
+        self.render_key = None
+        self.pyramid_tile_cache.clear(self.image_source_key())
+
+    def has_image(self):
+        return self.original_image is not None or self.image_pyramid is not None
+
+    def has_full_image(self):
+        """True once the full-resolution image is decoded (not just a preview)"""
+        return self.original_image is not None and self.original_image.size() == self.image_size
+
+    def image_source_key(self):
+        """Identifies the current image source, so caches know when to drop their entries"""
+        if self.image_pyramid is not None:
+            return ('pyramid', self.image_pyramid.path)
+        if self.original_image is not None:
+            return self.original_image.cacheKey()
+        return None
 
-    def set_image_and_grid(self, pixmap, grid_x_max, grid_y_max):
-        self.original_pixmap = pixmap
+    def set_image_and_grid(self, image, grid_x_max, grid_y_max):
+        self.set_image_source(image)
+        self.zoom_factor = 1.0  # Reset zoom when new image is loaded
+        self.set_grid(grid_x_max, grid_y_max)
+
+    def set_grid(self, grid_x_max, grid_y_max):
+        """Replace the grid with a uniform one, keeping the current image and zoom"""
+        if self.session_recorder is not None:
+            self.session_recorder.grid(grid_x_max, grid_y_max)
         self.grid_x_max = grid_x_max
         self.grid_y_max = grid_y_max
-        self.zoom_factor = 1.0  # Reset zoom when new image is loaded
         self.calculate_grid_points()  # Calculate grid points BEFORE update_display
         self.update_display()
 
-    def set_zoom(self, zoom_factor):
-        self.zoom_factor = zoom_factor
-        self.update_display()  # Grid points don't need recalculating for zoom changes
-
-    def update_display(self):
-        if not self.original_pixmap:
-            return
+    def auto_fit_grid(self):
+        """Snap the grid lines to the seams in the image (see puzzle_autofit); False if there is nothing to fit"""
+        if not self.has_grid() or not self.has_full_image():
+            return False
+        if self.session_recorder is not None:
+            self.session_recorder.autofit()
+        fitted = fit_grid_to_image(self.original_image, self.grid_x_max, self.grid_y_max)
+        self.history.record_change(self.grid_points, fitted)
+        self.grid_points = fitted
+        self.grid_points_changed()
+        if self.drag_handles is not None:
+            self.create_drag_handles()
+        self.update_display()
+        self.grid_edited.emit()
+        return True
 
-        # Calculate the size based on zoom factor
-        original_size = self.original_pixmap.size()
-        zoomed_size = original_size * self.zoom_factor
-        
-        # Scale pixmap with zoom factor
-        scaled_pixmap = self.original_pixmap.scaled(
-            zoomed_size, Qt.KeepAspectRatio, Qt.SmoothTransformation
-        )
+    def set_zoom(self, zoom_factor, preview=False):
+        """Change the zoom; with preview=True show a fast scale now and a smooth one once idle"""
+        if self.session_recorder is not None:
+            self.session_recorder.zoom(zoom_factor, preview)
+        self.zoom_factor = zoom_factor
+        if preview:
+            # Restarting the timer coalesces a burst of zoom changes into one smooth render
+            self.smooth_render_timer.start()
+            self.update_display(preview=True)
+        else:
+            self.smooth_render_timer.stop()
+            self.update_display()  # Grid points don't need recalculating for zoom changes
 
-        # Draw grid on the scaled pixmap
-        gridded_pixmap = self.draw_grid(scaled_pixmap)
+    def finish_zoom_preview(self):
+        """Replace the fast preview scale with the smooth one"""
+        self.smooth_render_timer.stop()
+        if self.preview_active:
+            self.update_display()
 
-        # Create a larger pixmap with padding
-        padded_size = QSize(gridded_pixmap.width() + 2 * self.padding,
-                           gridded_pixmap.height() + 2 * self.padding)
-        padded_pixmap = QPixmap(padded_size)
-        padded_pixmap.fill(Qt.lightGray)  # Fill padding area with light gray
+    def update_display(self, preview=False):
+        """Bring the base image up to date with the zoom and image, resize to it and repaint
 
-        # Draw the image centered in the padded pixmap
-        painter = QPainter(padded_pixmap)
-        painter.drawPixmap(self.padding, self.padding, gridded_pixmap)
+        The image is only re-rendered when the image source, zoom, preview state
+        or render mode changed since the last render; otherwise (grid and edit
+        mode changes) this just repaints.
+        """
+        if not self.has_image():
+            return
+        started = time.perf_counter()
+
+        # A cached drag backdrop is only valid for the zoom and grid it was rendered at
+        self.drag_backdrop = None
+
+        zoomed_size = self.get_zoomed_size()
+        tiled = self.use_tiled_rendering(zoomed_size)
+        source_key = self.image_source_key()
+        # A smooth render on screen also does for a preview
+        if self.render_key not in ((source_key, self.zoom_factor, preview, tiled),
+                                   (source_key, self.zoom_factor, False, tiled)):
+            self.render_base_image(zoomed_size, preview, tiled)
+            self.render_key = (source_key, self.zoom_factor, self.preview_active, tiled)
+        self.update_layout()
+        self.update()
+        self.perf.record("display", started)
+
+    def render_base_image(self, zoomed_size, preview, tiled):
+        """Fetch (or drop, for tiled rendering) the scaled base image; the grid is painted on top in paintEvent"""
+        self.render_generation += 1
+        self.tiled_rendering = tiled
+        render_log.debug("Render %d: zoom %.3f, %dx%d, %s%s", self.render_generation, self.zoom_factor,
+                         zoomed_size.width(), zoomed_size.height(),
+                         "tiled" if self.tiled_rendering else "full pixmap", " preview" if preview else "")
+
+        if self.tiled_rendering:
+            # Only the exposed tiles get rasterized, in paintEvent
+            self.scaled_pixmap = None
+            self.preview_active = preview
+        elif preview:
+            if not (self.scaled_pixmap and self.preview_active and self.scaled_pixmap.size() == zoomed_size):
+                self.scaled_pixmap = self.get_preview_pixmap(self.zoom_factor)
+        else:
+            self.scaled_pixmap = self.get_scaled_pixmap(self.zoom_factor)
+            self.preview_active = False
+
+    def update_layout(self):
+        """Size the widget to the zoomed image plus padding; only repositions, nothing is re-rendered"""
+        zoomed_size = self.get_zoomed_size()
+        size = QSize(zoomed_size.width() + 2 * self.padding, zoomed_size.height() + 2 * self.padding)
+        if self.size() != size:
+            self.resize(size)
+
+    def get_zoomed_size(self):
+        """Size of the whole image at the current zoom, in display pixels"""
+        return self.image_size * self.zoom_factor
+
+    def use_tiled_rendering(self, zoomed_size):
+        """Decide whether the current zoom is drawn as viewport tiles or one scaled pixmap"""
+        if self.render_mode == 'tiled' or self.original_image is None:
+            return True
+        if self.render_mode == 'full':
+            return False
+        return zoomed_size.width() * zoomed_size.height() > self.TILED_RENDER_MIN_PIXELS
+
+    def get_scaled_pixmap(self, zoom_factor):
+        """Return the original image scaled to zoom_factor, reusing cached scales when possible"""
+        source_key = self.image_source_key()
+        if self.scaled_cache.source_key != source_key:
+            # A different image was loaded, none of the cached scales apply any more
+            self.scaled_cache.clear(source_key)
+
+        key = ScaledPixmapCache.make_key(zoom_factor)
+        scaled_pixmap = self.scaled_cache.get(key)
+        if scaled_pixmap is None:
+            zoomed_size = self.image_size * zoom_factor
+            scaled_pixmap = QPixmap.fromImage(self.original_image.scaled(
+                zoomed_size, Qt.KeepAspectRatio, Qt.SmoothTransformation
+            ))
+            self.scaled_cache.put(key, scaled_pixmap)
+        return scaled_pixmap
+
+    def get_preview_pixmap(self, zoom_factor):
+        """Return a cheap scale of the image for use while the zoom is still changing"""
+        zoomed_size = self.image_size * zoom_factor
+        if self.scaled_cache.source_key == self.image_source_key():
+            key = ScaledPixmapCache.make_key(zoom_factor)
+            scaled_pixmap = self.scaled_cache.get(key)
+            if scaled_pixmap is not None:
+                # The smooth scale is already available, no need for a preview
+                self.preview_active = False
+                return scaled_pixmap
+            # Fast-scale from the nearest cached level rather than from the full size original
+            nearest = self.scaled_cache.find_nearest(zoom_factor)
+            if nearest is not None:
+                self.preview_active = True
+                return nearest.scaled(zoomed_size, Qt.KeepAspectRatio, Qt.FastTransformation)
+
+        self.preview_active = True
+        return QPixmap.fromImage(self.original_image.scaled(zoomed_size, Qt.KeepAspectRatio, Qt.FastTransformation))
+
+    def get_image_tile(self, tile_x, tile_y, transform_mode):
+        """Return one TILE_SIZE square of the zoomed image, rendering it from the source if needed"""
+        source_key = self.image_source_key()
+        if self.tile_cache.source_key != source_key:
+            self.tile_cache.clear(source_key)
+
+        key = (round(self.zoom_factor, 4), int(transform_mode), tile_x, tile_y)
+        tile = self.tile_cache.get(key)
+        if tile is not None:
+            return tile
+
+        zoomed_size = self.get_zoomed_size()
+        width = min(self.TILE_SIZE, zoomed_size.width() - tile_x * self.TILE_SIZE)
+        height = min(self.TILE_SIZE, zoomed_size.height() - tile_y * self.TILE_SIZE)
+        tile = QPixmap(width, height)
+        tile.fill(Qt.lightGray)
+        painter = QPainter(tile)
+        if transform_mode == Qt.SmoothTransformation:
+            painter.setRenderHint(QPainter.SmoothPixmapTransform)
+        if self.image_pyramid is not None:
+            self.draw_pyramid_region(painter, tile_x, tile_y, width, height)
+        else:
+            self.draw_pixmap_region(painter, tile_x, tile_y, width, height)
         painter.end()
 
-        self.setPixmap(padded_pixmap)
+        self.tile_cache.put(key, tile)
+        return tile
+
+    def draw_pixmap_region(self, painter, tile_x, tile_y, width, height):
+        """Render a display tile by sampling the matching region of original_image"""
+        # Source pixels per display pixel; the source may be a preview smaller than image_size
+        zoomed_size = self.get_zoomed_size()
+        scale_x = self.original_image.width() / zoomed_size.width()
+        scale_y = self.original_image.height() / zoomed_size.height()
+
+        # Sample only the part of the original under this tile, plus a couple of source pixels
+        # of margin so bilinear filtering doesn't show seams between neighbouring tiles
+        source_rect = QRectF(tile_x * self.TILE_SIZE * scale_x, tile_y * self.TILE_SIZE * scale_y,
+                             width * scale_x, height * scale_y)
+        source_rect = source_rect.adjusted(-2, -2, 2, 2).intersected(QRectF(self.original_image.rect()))
+        target_rect = QRectF(source_rect.x() / scale_x - tile_x * self.TILE_SIZE,
+                             source_rect.y() / scale_y - tile_y * self.TILE_SIZE,
+                             source_rect.width() / scale_x, source_rect.height() / scale_y)
+        painter.drawImage(target_rect, self.original_image, source_rect)
+
+    def draw_pyramid_region(self, painter, tile_x, tile_y, width, height):
+        """Render a display tile from the pyramid level closest to the current zoom"""
+        pyramid = self.image_pyramid
+        level = pyramid.level_for_zoom(self.zoom_factor)
+        level_info = pyramid.levels[level]
+        # Display pixels per level pixel
+        scale = self.zoom_factor / pyramid.level_scale(level)
+
+        # Region of the level covered by this display tile, with a pixel of margin for filtering
+        left = (tile_x * self.TILE_SIZE) / scale - 1
+        top = (tile_y * self.TILE_SIZE) / scale - 1
+        right = (tile_x * self.TILE_SIZE + width) / scale + 1
+        bottom = (tile_y * self.TILE_SIZE + height) / scale + 1
+        size = pyramid.tile_size
+        first_col, last_col = max(0, int(left // size)), min(level_info["cols"] - 1, int(right // size))
+        first_row, last_row = max(0, int(top // size)), min(level_info["rows"] - 1, int(bottom // size))
+
+        painter.save()
+        painter.scale(scale, scale)
+        painter.translate(-(tile_x * self.TILE_SIZE) / scale, -(tile_y * self.TILE_SIZE) / scale)
+        for row in range(first_row, last_row + 1):
+            for col in range(first_col, last_col + 1):
+                # Clip to the level so the padding of edge tiles never shows
+                source_width = min(size, level_info["width"] - col * size)
+                source_height = min(size, level_info["height"] - row * size)
+                painter.drawPixmap(QRectF(col * size, row * size, source_width, source_height),
+                                   self.get_pyramid_tile(level, col, row),
+                                   QRectF(0, 0, source_width, source_height))
+        painter.restore()
+
+    def get_pyramid_tile(self, level, col, row):
+        """Upload one pyramid tile to a pixmap; only the pages of the mapped file it covers are read"""
+        key = (level, col, row)
+        pixmap = self.pyramid_tile_cache.get(key)
+        if pixmap is None:
+            pixmap = QPixmap.fromImage(self.image_pyramid.tile_image(level, col, row))
+            self.pyramid_tile_cache.put(key, pixmap)
+        return pixmap
+
+    def draw_image_tiles(self, painter, exposed_rect):
+        """Draw the tiles of the zoomed image that intersect exposed_rect"""
+        area = exposed_rect.intersected(self.get_image_rect())
+        if area.isEmpty():
+            return
 
-        # Adjust widget size to match the padded pixmap
-        self.resize(padded_pixmap.size())
+        transform_mode = Qt.FastTransformation if self.preview_active else Qt.SmoothTransformation
+        first_col = (area.left() - self.padding) // self.TILE_SIZE
+        last_col = (area.right() - self.padding) // self.TILE_SIZE
+        first_row = (area.top() - self.padding) // self.TILE_SIZE
+        last_row = (area.bottom() - self.padding) // self.TILE_SIZE
+        for tile_y in range(first_row, last_row + 1):
+            for tile_x in range(first_col, last_col + 1):
+                tile = self.get_image_tile(tile_x, tile_y, transform_mode)
+                painter.drawPixmap(self.padding + tile_x * self.TILE_SIZE,
+                                   self.padding + tile_y * self.TILE_SIZE, tile)
 
     def get_image_rect(self):
         """Get the rectangle where the actual image is drawn (excluding padding)"""
-        if not self.original_pixmap:
+        if not self.has_image():
             return QRect()
 
         # Calculate the scaled image size
-        original_size = self.original_pixmap.size()
+        original_size = self.image_size
         zoomed_size = original_size * self.zoom_factor
 
         # Return the rectangle where the image is positioned (with padding offset)
         return QRect(self.padding, self.padding, zoomed_size.width(), zoomed_size.height())
 
-    def draw_grid_lines(self, painter, grid_points_to_use, scale_x, scale_y, pen=None):
-        """Shared function to draw grid lines using specified grid points and scaling"""
+    def get_grid_index(self):
+        """Line index of the committed grid, rebuilt only after grid_points changes"""
+        if self.grid_index is None:
+            self.grid_index = GridLineIndex(self.grid_points)
+        return self.grid_index
+
+    def grid_points_changed(self):
+        """Call whenever grid_points is replaced or edited, to drop geometry cached from it"""
+        self.grid_index = None
+        if self.drag_handles is not None:
+            self.drag_handles.zoom_factor = None
+
+    def grid_line_steps(self):
+        """Level of detail: draw every step-th line so lines stay MIN_GRID_LINE_SPACING apart on screen"""
+        steps = []
+        for length, squares in ((self.image_size.width(), self.grid_x_max),
+                                (self.image_size.height(), self.grid_y_max)):
+            spacing = length * self.zoom_factor / max(squares, 1)
+            step = 1
+            while spacing * step < self.MIN_GRID_LINE_SPACING and step < squares:
+                step *= 2
+            steps.append(step)
+        return steps
+
+    def exposed_image_rect(self, exposed_rect, margin=2):
+        """The exposed widget rect in original image coordinates, grown by margin display pixels"""
+        rect = QRectF(exposed_rect).adjusted(-margin, -margin, margin, margin)
+        rect.translate(-self.padding, -self.padding)
+        return QRectF(rect.x() / self.zoom_factor, rect.y() / self.zoom_factor,
+                      rect.width() / self.zoom_factor, rect.height() / self.zoom_factor)
+
+    def draw_grid_lines(self, painter, grid_index, exposed_rect, pen=None):
+        """Shared function to draw the lines of a grid that cross exposed_rect (widget coordinates)"""
         if pen:
+            # Cosmetic, so the scale transform below doesn't widen the pen with the zoom
+            pen = QPen(pen)
+            pen.setCosmetic(True)
             painter.setPen(pen)
 
-        # Draw vertical line segments using grid points
-        for col in range(self.grid_x_max + 1):
-            # Draw segments between consecutive points in this column
-            for row in range(self.grid_y_max):
-                # Get start point (current row)
-                start_x = int(grid_points_to_use[row][col][0] * scale_x)
-                start_y = int(grid_points_to_use[row][col][1] * scale_y)
-
-                # Get end point (next row)
-                end_x = int(grid_points_to_use[row + 1][col][0] * scale_x)
-                end_y = int(grid_points_to_use[row + 1][col][1] * scale_y)
-
-                # Draw line segment between these two points
-                painter.drawLine(start_x, start_y, end_x, end_y)
-
-        # Draw horizontal line segments using grid points
-        for row in range(self.grid_y_max + 1):
-            # Draw segments between consecutive points in this row
-            for col in range(self.grid_x_max):
-                # Get start point (current column)
-                start_x = int(grid_points_to_use[row][col][0] * scale_x)
-                start_y = int(grid_points_to_use[row][col][1] * scale_y)
-
-                # Get end point (next column)
-                end_x = int(grid_points_to_use[row][col + 1][0] * scale_x)
-                end_y = int(grid_points_to_use[row][col + 1][1] * scale_y)
-
-                # Draw line segment between these two points
-                painter.drawLine(start_x, start_y, end_x, end_y)
-
-    def draw_grid(self, pixmap):
-        # Create a copy to draw on
-        result_pixmap = pixmap.copy()
-        painter = QPainter(result_pixmap)
-
-        # Set up pen for grid lines
-        pen = QPen(Qt.red, 2)
-        painter.setPen(pen)
+        step_x, step_y = self.grid_line_steps()
+        polylines = grid_index.visible_polylines(self.exposed_image_rect(exposed_rect), step_x, step_y)
 
-        width = result_pixmap.width()
-        height = result_pixmap.height()
+        # The scaling to display coordinates is done by the painter transform
+        painter.save()
+        painter.translate(self.padding, self.padding)
+        painter.scale(self.zoom_factor, self.zoom_factor)
+        for polyline in polylines:
+            painter.drawPolyline(points_to_polygon(polyline))
+        painter.restore()
 
+    def draw_grid(self, painter, exposed_rect):
+        """Draw the grid overlay on top of the scaled image"""
         # Only draw grid if we have grid points
-        if not self.grid_points or self.grid_x_max == 0 or self.grid_y_max == 0:
-            painter.end()
-            return result_pixmap
-
-        # Calculate scaling factor from original image to current pixmap
-        original_size = self.original_pixmap.size()
-        scale_x = width / original_size.width()
-        scale_y = height / original_size.height()
+        if not self.has_grid():
+            return
 
-        # Use shared drawing function
-        self.draw_grid_lines(painter, self.grid_points, scale_x, scale_y, pen)
+        started = time.perf_counter()
+        self.draw_grid_lines(painter, self.get_grid_index(), exposed_rect, QPen(Qt.red, 2))
+        self.perf.record("grid", started)
 
-        painter.end()
-        return result_pixmap
+    def draw_perimeter(self, painter, grid_points_to_use, pen):
+        """Draw the outline of a grid as one closed polygon"""
+        pen = QPen(pen)
+        pen.setCosmetic(True)
+        painter.setPen(pen)
+        outline = np.concatenate([grid_points_to_use[0, :-1], grid_points_to_use[:-1, -1],
+                                  grid_points_to_use[-1, :0:-1], grid_points_to_use[:0:-1, 0]])
+        painter.save()
+        painter.translate(self.padding, self.padding)
+        painter.scale(self.zoom_factor, self.zoom_factor)
+        painter.drawPolygon(points_to_polygon(outline))
+        painter.restore()
 
     def resizeEvent(self, event):
         super().resizeEvent(event)
-        if self.original_pixmap:
-            self.update_display()
+        # The content depends on the zoom and grid, not on the widget size: keep the size, don't re-render
+        if self.has_image():
+            self.update_layout()
 
     def set_crop_mode(self, enabled):
         """Enable or disable crop mode"""
+        if self.session_recorder is not None:
+            self.session_recorder.mode("crop", enabled)
         self.crop_mode = enabled
         if enabled:
+            self.drag_endpoints_mode = False
             self.create_drag_handles()
         else:
-            self.drag_handles = []
+            self.drag_handles = None
+            self.drag_overlay.release()
         self.update_display()
 
     def set_drag_endpoints_mode(self, enabled):
-        """Enable or disable drag endpoints mode"""
-        # For now, this is a placeholder implementation
-        # In the future, this could enable dragging of all grid intersection points
-        # rather than just the perimeter points like crop mode does
+        """Enable or disable drag endpoints mode, where any interior grid intersection can be dragged"""
+        if self.session_recorder is not None:
+            self.session_recorder.mode("endpoints", enabled)
+        self.drag_endpoints_mode = enabled
         if enabled:
-            # TODO: Implement drag endpoints functionality
-            # This would create drag handles for ALL grid intersection points,
-            # not just the perimeter ones
-            print("Drag endpoints mode enabled - functionality to be implemented")
+            self.crop_mode = False
+            self.create_drag_handles()
         else:
-            print("Drag endpoints mode disabled")
-
-        # For now, just update the display
+            self.drag_handles = None
         self.update_display()
 
     def create_drag_handles(self):
-        """Create drag handles at all grid perimeter points"""
-        self.drag_handles = []
-        if not self.original_pixmap or self.grid_x_max == 0 or self.grid_y_max == 0 or not self.grid_points:
+        """Create drag handles at all grid perimeter points, or all interior points in drag endpoints mode"""
+        self.drag_handles = None
+        if not self.has_image() or not self.has_grid():
             return
 
-        # Create handles for all perimeter points of the grid
-        # Store (scaled_point, row, col) tuples to avoid duplicate lookups
-        perimeter_points = set()  # Use set to avoid duplicate points at corners
-
-        # Top edge: all points in row 0
-        for col in range(self.grid_x_max + 1):
-            scaled_point = self.get_scaled_grid_point(0, col)
-            if scaled_point:
-                perimeter_points.add((scaled_point, 0, col))
-
-        # Bottom edge: all points in last row
-        for col in range(self.grid_x_max + 1):
-            scaled_point = self.get_scaled_grid_point(self.grid_y_max, col)
-            if scaled_point:
-                perimeter_points.add((scaled_point, self.grid_y_max, col))
-
-        # Left edge: all points in column 0 (excluding corners already added)
-        for row in range(1, self.grid_y_max):
-            scaled_point = self.get_scaled_grid_point(row, 0)
-            if scaled_point:
-                perimeter_points.add((scaled_point, row, 0))
-
-        # Right edge: all points in last column (excluding corners already added)
-        for row in range(1, self.grid_y_max):
-            scaled_point = self.get_scaled_grid_point(row, self.grid_x_max)
-            if scaled_point:
-                perimeter_points.add((scaled_point, row, self.grid_x_max))
-
-        # Convert set to list of drag handles with edge flags
-        for scaled_point, point_row, point_col in perimeter_points:
-            x, y = scaled_point
-
-            # Set edge flags based on stored indices
-            is_left = point_col == 0
-            is_right = point_col == self.grid_x_max
-            is_top = point_row == 0
-            is_bottom = point_row == self.grid_y_max
-
-            self.drag_handles.append({
-                'pos': QPoint(int(x), int(y)),
-                'left': is_left,
-                'right': is_right,
-                'top': is_top,
-                'bottom': is_bottom,
-                'row': point_row,
-                'col': point_col
-            })
+        if self.drag_endpoints_mode:
+            rows, cols = np.mgrid[1:self.grid_y_max, 1:self.grid_x_max]
+            self.drag_handles = DragHandles(rows.ravel(), cols.ravel(), self.grid_x_max, self.grid_y_max)
+            self.drag_handles.update_positions(self.grid_points, self.zoom_factor, self.padding)
+            return
+
+        # Perimeter points: top and bottom rows in full, then the left and right columns
+        # without the corners, which the rows already include
+        cols = np.arange(self.grid_x_max + 1)
+        inner_rows = np.arange(1, self.grid_y_max)
+        rows = np.concatenate([np.zeros_like(cols), np.full_like(cols, self.grid_y_max),
+                               inner_rows, inner_rows])
+        cols = np.concatenate([cols, cols, np.zeros_like(inner_rows), np.full_like(inner_rows, self.grid_x_max)])
+
+        self.drag_handles = DragHandles(rows, cols, self.grid_x_max, self.grid_y_max)
+        self.drag_handles.update_positions(self.grid_points, self.zoom_factor, self.padding)
+
+    def get_drag_handles(self):
+        """Drag handles with positions (and index) current for the zoom and committed grid"""
+        handles = self.drag_handles
+        if handles is not None and handles.zoom_factor != self.zoom_factor and self.drag_grid_points is None:
+            handles.update_positions(self.grid_points, self.zoom_factor, self.padding)
+        return handles
 
     def paintEvent(self, event):
+        started = time.perf_counter()
         super().paintEvent(event)
-        if not self.pixmap() or not self.crop_mode or not self.drag_handles:
-            return
-
-        # Check grid validity before creating painter
-        if not self.grid_points or self.grid_x_max == 0 or self.grid_y_max == 0:
+        if not self.has_image() or not (self.scaled_pixmap or self.tiled_rendering):
             return
 
         painter = QPainter(self)
+        # Only touch the exposed area, and keep the label border visible around the padding
+        exposed_rect = event.rect().intersected(self.contentsRect())
+        painter.setClipRect(exposed_rect)
+        self.draw_frame(painter, exposed_rect)
+        if self.show_perf_hud:
+            self.draw_perf_hud(painter)
+        painter.end()
+        self.perf.record("paint", started)
+
+    def draw_frame(self, painter, exposed_rect):
+        """Draw the image, grid and editing overlays for the exposed area"""
+        # During a crop drag everything but the working grid and handles comes from the cached layer
+        if self.drag_backdrop is not None and self.drag_backdrop_rect.contains(exposed_rect):
+            painter.drawPixmap(exposed_rect, self.drag_backdrop,
+                               exposed_rect.translated(-self.drag_backdrop_rect.topLeft()))
+        else:
+            self.draw_static_layer(painter, exposed_rect)
 
-        # Check if we're currently dragging and have a copy of the original grid
-        is_dragging = any(handle.get('dragging', False) for handle in self.drag_handles)
+        handles = self.get_drag_handles()
+        if not (self.crop_mode or self.drag_endpoints_mode) or not handles or not self.has_grid():
+            return
 
-        if is_dragging and self.drag_grid_points:
-            # Draw the full grid using the original grid points copy
+        # Check if we're currently dragging and have a copy of the original grid
+        if self.crop_mode and self.is_dragging and self.drag_grid_points is not None:
+            # Draw the working grid from the drag copy of the grid points
             pen = QPen(Qt.green, 1, Qt.SolidLine)  # Use green solid line for original grid
-            painter.setPen(pen)
-
-            # Calculate scaling factor from original image to current display
-            original_size = self.original_pixmap.size()
-            scale_x = self.zoom_factor
-            scale_y = self.zoom_factor
+            self.draw_grid_lines(painter, self.drag_overlay, exposed_rect, pen)
 
-            # Use shared drawing function with the copied grid points
-            # Offset the drawing by padding amount
-            painter.translate(self.padding, self.padding)
-            self.draw_grid_lines(painter, self.drag_grid_points, scale_x, scale_y, pen)
-            painter.translate(-self.padding, -self.padding)  # Reset translation
+        self.draw_drag_handles(painter, handles, exposed_rect)
 
-        # Draw the current perimeter (crop boundary) with blue dashed lines
-        pen = QPen(Qt.blue, 2, Qt.DashLine)
-        painter.setPen(pen)
+    def set_perf_hud(self, enabled):
+        """Show or hide the frame-time overlay in the top-left corner of the visible area"""
+        self.show_perf_hud = enabled
+        if enabled:
+            self.perf_hud_timer.start()
+        else:
+            self.perf_hud_timer.stop()
+        self.update()
 
-        # Draw line segments between adjacent perimeter points
-        # Draw top edge: connect all points in row 0
-        for col in range(self.grid_x_max):
-            start_point = self.get_scaled_grid_point(0, col)
-            end_point = self.get_scaled_grid_point(0, col + 1)
-            if start_point and end_point:
-                painter.drawLine(start_point[0], start_point[1], end_point[0], end_point[1])
-
-        # Draw bottom edge: connect all points in last row
-        for col in range(self.grid_x_max):
-            start_point = self.get_scaled_grid_point(self.grid_y_max, col)
-            end_point = self.get_scaled_grid_point(self.grid_y_max, col + 1)
-            if start_point and end_point:
-                painter.drawLine(start_point[0], start_point[1], end_point[0], end_point[1])
-
-        # Draw left edge: connect all points in column 0
-        for row in range(self.grid_y_max):
-            start_point = self.get_scaled_grid_point(row, 0)
-            end_point = self.get_scaled_grid_point(row + 1, 0)
-            if start_point and end_point:
-                painter.drawLine(start_point[0], start_point[1], end_point[0], end_point[1])
-
-        # Draw right edge: connect all points in last column
-        for row in range(self.grid_y_max):
-            start_point = self.get_scaled_grid_point(row, self.grid_x_max)
-            end_point = self.get_scaled_grid_point(row + 1, self.grid_x_max)
-            if start_point and end_point:
-                painter.drawLine(start_point[0], start_point[1], end_point[0], end_point[1])
-
-        # Draw drag handles
-        """
-        if self.drag_handles:
-            print("Drawing drag handles, top-left handle at:", self.drag_handles[0]['pos'])  # Debug output
-        """
-        for handle in self.drag_handles:
-            self.draw_drag_handle(painter, handle)
+    def perf_hud_lines(self):
+        lines = []
+        for stage, label in (("paint", "frame"), ("grid", "grid"), ("display", "display"), ("mouse_move", "move")):
+            percentiles = self.perf.percentiles_ms(stage)
+            if percentiles:
+                lines.append(f"{label:<8}{self.perf.last_ms(stage):6.1f} ms  p50 {percentiles[0]:.1f}"
+                             f"  p95 {percentiles[1]:.1f}  p99 {percentiles[2]:.1f}")
+        pixmap_bytes = (self.scaled_cache.total_bytes + self.tile_cache.total_bytes
+                        + self.pyramid_tile_cache.total_bytes)
+        lines.append(f"pixmaps {pixmap_bytes / (1024 * 1024):.1f} MB  ({len(self.scaled_cache)} scaled, "
+                     f"{len(self.tile_cache) + len(self.pyramid_tile_cache)} tiles)")
+        lines.append(f"cache hits  scaled {self.scaled_cache.hit_rate():.0%}  tiles {self.tile_cache.hit_rate():.0%}"
+                     f"  pyramid {self.pyramid_tile_cache.hit_rate():.0%}")
+        return lines
+
+    def draw_perf_hud(self, painter):
+        """Draw the overlay; it is pinned to the visible area and refreshed by perf_hud_timer"""
+        lines = self.perf_hud_lines()
+        metrics = QFontMetrics(painter.font())
+        width = max(metrics.horizontalAdvance(line) for line in lines) + 12
+        height = metrics.height() * len(lines) + 8
+        origin = self.visibleRegion().boundingRect().topLeft() + QPoint(8, 8)
+        self.perf_hud_rect = QRect(origin, QSize(width, height))
+
+        painter.save()
+        painter.setClipping(False)
+        painter.fillRect(self.perf_hud_rect, QColor(0, 0, 0, 170))
+        painter.setPen(Qt.white)
+        for index, line in enumerate(lines):
+            painter.drawText(origin.x() + 6, origin.y() + 4 + metrics.ascent() + index * metrics.height(), line)
+        painter.restore()
+
+    def perf_metadata(self):
+        """Context stored alongside an exported trace"""
+        return {
+            "image_size": [self.image_size.width(), self.image_size.height()],
+            "grid": [self.grid_x_max, self.grid_y_max],
+            "zoom_factor": self.zoom_factor,
+            "render_mode": self.render_mode,
+            "tiled_rendering": self.tiled_rendering,
+            "pyramid": self.image_pyramid is not None,
+            "crop_mode": self.crop_mode,
+            "drag_endpoints_mode": self.drag_endpoints_mode,
+            "scaled_cache_hit_rate": self.scaled_cache.hit_rate(),
+            "tile_cache_hit_rate": self.tile_cache.hit_rate(),
+        }
 
-    def draw_drag_handle(self, painter, handle):
-        """Draw a single drag handle"""
-        size = 8
-        rect = QRect(handle['pos'] - QPoint(size // 2, size // 2), QSize(size, size))
-        painter.drawRect(rect)
+    def draw_static_layer(self, painter, exposed_rect):
+        """Draw everything that stays put while a crop drag is in progress"""
+        # Padding area, the scaled image, then the grid overlay
+        painter.fillRect(exposed_rect, Qt.lightGray)
+        if self.tiled_rendering:
+            self.draw_image_tiles(painter, exposed_rect)
+        else:
+            source_rect = exposed_rect.intersected(self.get_image_rect()).translated(-self.padding, -self.padding)
+            painter.drawPixmap(source_rect.translated(self.padding, self.padding), self.scaled_pixmap, source_rect)
+        self.draw_grid(painter, exposed_rect)
+
+        if self.crop_mode and self.has_grid():
+            # Draw the current perimeter (crop boundary) with blue dashed lines
+            self.draw_perimeter(painter, self.grid_points, QPen(Qt.blue, 2, Qt.DashLine))
+
+    def cache_drag_backdrop(self):
+        """Render the static layer of the visible area once, for the repaints of a crop drag"""
+        visible_rect = self.visibleRegion().boundingRect().intersected(self.contentsRect())
+        if visible_rect.isEmpty():
+            self.drag_backdrop = None
+            return
+        backdrop = QPixmap(visible_rect.size())
+        painter = QPainter(backdrop)
+        painter.translate(-visible_rect.topLeft())
+        painter.setClipRect(visible_rect)
+        self.draw_static_layer(painter, visible_rect)
+        painter.end()
+        self.drag_backdrop = backdrop
+        self.drag_backdrop_rect = visible_rect
+
+    def clear_drag_backdrop(self):
+        self.drag_backdrop = None
+        self.drag_dirty_rect = None
+
+    def bounds_display_rect(self, bounds, margin):
+        """Display rect around (left, top, right, bottom) image coordinates, grown by margin pixels"""
+        left, top, right, bottom = bounds
+        left = math.floor(left * self.zoom_factor) + self.padding
+        top = math.floor(top * self.zoom_factor) + self.padding
+        right = math.ceil(right * self.zoom_factor) + self.padding
+        bottom = math.ceil(bottom * self.zoom_factor) + self.padding
+        return QRect(left - margin, top - margin, right - left + 2 * margin + 1, bottom - top + 2 * margin + 1)
+
+    def draw_drag_handles(self, painter, handles, exposed_rect):
+        """Draw the handles inside the exposed area that sit on the grid lines currently drawn"""
+        painter.setPen(QPen(Qt.blue, 2, Qt.DashLine))
+        size = DragHandles.HANDLE_SIZE
+        step_x, step_y = self.grid_line_steps()
+        for index in handles.in_rect(exposed_rect.adjusted(-size, -size, size, size), step_x, step_y):
+            self.draw_drag_handle(painter, handles.positions[index])
+
+    def draw_drag_handle(self, painter, position):
+        """Draw a single drag handle centred on a display position"""
+        size = DragHandles.HANDLE_SIZE
+        painter.drawRect(int(position[0]) - size // 2, int(position[1]) - size // 2, size, size)
 
     def update_drag_handle_positions(self):
-        for handle in self.drag_handles:
-            if not handle.get('updated', True):
-                x, y = self.get_scaled_grid_point(handle['row'], handle['col'], self.drag_grid_points)
-                old_y = handle['pos'].y()
-                handle['pos'] = QPoint(int(x), int(y))
-                new_y = handle['pos'].y()
-            handle['updated'] = False  # Reset for next update
-        """
-        print("update drag handles, top-left handle at:", self.drag_handles[0]['pos'])  # Debug output\
-        print("Top-left grid point:", self.get_grid_point(0, 0, self.drag_grid_points))  # Debug output
-        print("Top-left rgrid point:", self.drag_grid_points[0][0])  # Debug output
-        """
-
-    def get_old_x_values_to_the_right(self, handle_row, drag_col, end_col):
-        left_old, _col = self.drag_grid_points[handle_row][drag_col]
-        right_old, _col = self.drag_grid_points[handle_row][end_col]
-        width_old = right_old - left_old
-        preserve_values = []
-        for col in range(drag_col + 1, end_col):
-            old_x, old_y = self.drag_grid_points[handle_row][col]
-            relative_pos = (old_x - left_old) / width_old
-            preserve_values.append(relative_pos)
-
-        return (handle_row, drag_col, end_col, left_old, right_old, width_old, preserve_values)
-
-    def get_old_x_values_to_the_left(self, handle_row, start_col, drag_col):
-        left_old, _col = self.drag_grid_points[handle_row][start_col]
-        right_old, _col = self.drag_grid_points[handle_row][drag_col]
-        width_old = right_old - left_old
-        preserve_values = []
-        for col in range(start_col + 1, drag_col):
-            old_x, old_y = self.drag_grid_points[handle_row][col]
-            relative_pos = (old_x - right_old) / width_old
-            preserve_values.append(relative_pos)
-        return (handle_row, start_col, drag_col, left_old, right_old, width_old, preserve_values)
-
-    def get_old_y_values_to_the_bottom(self, handle_col, drag_row, end_row):
-        _row, top_old = self.drag_grid_points[drag_row][handle_col]
-        _row, bottom_old = self.drag_grid_points[end_row][handle_col]
-        height_old = bottom_old - top_old
-        preserve_values = []
-        for row in range(drag_row + 1, end_row):
-            old_x, old_y = self.drag_grid_points[row][handle_col]
-            relative_pos = (old_y - top_old) / height_old
-            preserve_values.append(relative_pos)
-        return (handle_col, drag_row, end_row, top_old, bottom_old, height_old, preserve_values)
-
-    def get_old_y_values_to_the_top(self, handle_col, start_row, drag_row):
-        _row, top_old = self.drag_grid_points[start_row][handle_col]
-        _row, bottom_old = self.drag_grid_points[drag_row][handle_col]
-        height_old = bottom_old - top_old
-        preserve_values = []
-        for row in range(start_row + 1, drag_row):
-            old_x, old_y = self.drag_grid_points[row][handle_col]
-            relative_pos = (old_y - bottom_old) / height_old
-            preserve_values.append(relative_pos)
-        return (handle_col, start_row, drag_row, top_old, bottom_old, height_old, preserve_values)
-
-    def preserve_x_spacing_to_the_right(self, handle_row, drag_col, end_col, left_old, right_old, width_old, preserve_values):
-        left_new, _col = self.drag_grid_points[handle_row][drag_col]
-        width_new = right_old - left_new
-        """Adjust points in the same row to preserve relative X spacing"""
-        preserve_index = 0
-        for col in range(drag_col + 1, end_col):
-            old_x, old_y = self.drag_grid_points[handle_row][col]
-            relative_pos = preserve_values[preserve_index]
-            preserve_index += 1
-            new_x = int(left_new + relative_pos * width_new)
-            if handle_row == 0:
-                print(
-                    f"Preserve right: col {col}, row {handle_row}, old_x {old_x}, relative_pos {relative_pos}, new_x {new_x}")
-            self.drag_grid_points[handle_row][col] = (new_x, old_y)
-            # grid_point_counts[handle_row][col] += 1
-
-    def preserve_x_spacing_to_the_left(self, handle_row, start_col, drag_col, left_old, right_old, width_old,
-                                       preserve_values):
-        right_new, _col = self.drag_grid_points[handle_row][drag_col]
-        width_new = right_new - left_old
-        """Adjust points in the same row to preserve relative Y spacing"""
-        preserve_index = 0
-        for col in range(start_col + 1, drag_col):
-            old_x, old_y = self.drag_grid_points[handle_row][col]
-            relative_pos = preserve_values[preserve_index]
-            preserve_index += 1
-            new_x = int(right_new + relative_pos * width_new)
-            self.drag_grid_points[handle_row][col] = (new_x, old_y)
-            # grid_point_counts[handle_row][col] += 1
-
-    def preserve_y_spacing_to_the_bottom(self, handle_col, drag_row, end_row, top_old, bottom_old, height_old,
-                                         preserve_values):
-        _row, top_new = self.drag_grid_points[drag_row][handle_col]
-        height_new = bottom_old - top_new
-        """Adjust points in the same column to preserve relative Y spacing"""
-        preserve_index = 0
-        for row in range(drag_row + 1, end_row):
-            old_x, old_y = self.drag_grid_points[row][handle_col]
-            relative_pos = preserve_values[preserve_index]
-            preserve_index += 1
-            new_y = int(top_new + relative_pos * height_new)
-            self.drag_grid_points[row][handle_col] = (old_x, new_y)
-            # grid_point_counts[row][handle_col] += 1
-
-    def preserve_y_spacing_to_the_top(self, handle_col, start_row, drag_row, top_old, bottom_old, height_old,
-                                      preserve_values):
-        _row, bottom_new = self.drag_grid_points[drag_row][handle_col]
-        height_new = bottom_new - top_old
-        """Adjust points in the same column to preserve relative Y spacing"""
-        preserve_index = 0
-        for row in range(start_row + 1, drag_row):
-            old_x, old_y = self.drag_grid_points[row][handle_col]
-            relative_pos = preserve_values[preserve_index]
-            preserve_index += 1
-            new_y = int(bottom_new + relative_pos * height_new)
-            self.drag_grid_points[row][handle_col] = (old_x, new_y)
-            # grid_point_counts[row][handle_col] += 1
+        """Move every handle to its point in the drag copy of the grid"""
+        # No clicks land mid-drag, so the bucket index is left to be rebuilt on demand
+        self.drag_handles.update_positions(self.drag_grid_points, self.zoom_factor, self.padding,
+                                           rebuild_index=False)
 
     def mousePressEvent(self, event):
+        if self.session_recorder is not None:
+            self.session_recorder.mouse("press", event)
         super().mousePressEvent(event)
-        if event.button() == Qt.LeftButton and self.crop_mode:
+        if event.button() == Qt.LeftButton and self.drag_endpoints_mode:
+            self.setFocus()
+            self.start_endpoint_drag(event.pos())
+        elif event.button() == Qt.LeftButton and self.crop_mode:
             # Set focus so we can receive keyboard events
             self.setFocus()
 
             # Check if a drag handle was clicked
-            for handle in self.drag_handles:
-                if QRect(handle['pos'] - QPoint(4, 4), QSize(8, 8)).contains(event.pos()):
-                    # Set dragging state
-                    self.is_dragging = True
-                    self.dragging_handle = handle
-                    handle['dragging'] = True
-                    # Copy current grid points to drag_grid_points
-                    self.drag_grid_points = [row.copy() for row in self.grid_points]
-                    self.last_drag_pos = event.pos()
-                    self.update()
-                    self.drag_preserve_values = None
-                    return
+            handles = self.get_drag_handles()
+            handle = handles.find(event.pos(), *self.grid_line_steps()) if handles else None
+            if handle is not None:
+                # Set dragging state
+                self.is_dragging = True
+                self.dragging_handle = handle
+                drag_log.debug("Crop drag of point (%d,%d) started", handles.rows[handle], handles.cols[handle])
+                left, right, top, bottom = handles.edges(handle)
+                self.drag_overlay.begin(self.grid_points, left or right, top or bottom, self.get_grid_index())
+                self.drag_grid_points = self.drag_overlay.points
+                self.last_drag_pos = event.pos()
+                self.cache_drag_backdrop()
+                self.drag_dirty_rect = self.bounds_display_rect(self.drag_overlay.bounds(), DragHandles.HANDLE_SIZE + 2)
+                self.update(self.drag_dirty_rect)
+                return
 
     def mouseMoveEvent(self, event):
+        started = time.perf_counter()
+        if self.session_recorder is not None:
+            self.session_recorder.mouse("move", event)
         super().mouseMoveEvent(event)
-        if event.buttons() & Qt.LeftButton and self.crop_mode and self.is_dragging and self.dragging_handle and self.drag_grid_points:
-            handle = self.dragging_handle
-
-            grid_point_counts = []
-            for row in range(self.grid_y_max + 1):  # +1 because we need lines at both edges
-                grid_row = [0 for col in range(self.grid_x_max + 1)]
-                grid_point_counts.append(grid_row)
+        if event.buttons() & Qt.LeftButton and self.drag_endpoints_mode and self.is_dragging:
+            self.move_endpoint(event.pos())
+        elif event.buttons() & Qt.LeftButton and self.crop_mode and self.is_dragging and self.dragging_handle is not None and self.drag_grid_points is not None:
 
-            print("\nStart drag")
             # Calculate the movement delta in original image coordinates
             old_pos = self.last_drag_pos
             self.last_drag_pos = event.pos()
@@ -503,144 +1384,111 @@ class ImageGridWidget(QLabel):
             delta_x = display_delta_x / self.zoom_factor
             delta_y = display_delta_y / self.zoom_factor
 
-            print("display delta:", display_delta_x, display_delta_y, "-> grid delta:", delta_x, delta_y)
-
-            doing_left = handle['left']
-            doing_right = handle['right']
-            doing_top = handle['top']
-            doing_bottom = handle['bottom']
-
-            # Determine which axes this handle can move along
-            can_move_x = doing_left or doing_right
-            can_move_y = doing_top or doing_bottom
-
-            # Set delta to 0 if movement is not allowed
-            if not can_move_x:
-                delta_x = 0
-            if not can_move_y:
-                delta_y = 0
-
-            # Update grid points directly in original image coordinates
-            # Get old values for spacing preservation before making changes
-            if self.drag_preserve_values is None:
-                self.drag_preserve_values = {
-                    "left": {},
-                    "right": {},
-                    "top": {},
-                    "bottom": {},
-                }
-
-                old_values = {}
-                for other_handle in self.drag_handles:
-                    other_handle_row = other_handle['row']
-                    other_handle_col = other_handle['col']
-
-                    if doing_left and other_handle['left'] and can_move_x:
-                        #key = f"left_{other_handle_row}"
-                        key = (other_handle_row, other_handle_col, self.grid_x_max)
-                        if key not in self.drag_preserve_values['left']:
-                            self.drag_preserve_values['left'][key] = self.get_old_x_values_to_the_right(*key)
-                        else:
-                            print("Already have old values for", key)
-
-                    if doing_right and other_handle['right'] and can_move_x:
-                        #key = f"right_{other_handle_row}"
-                        key = (other_handle_row, 0, other_handle_col)
-                        if key not in self.drag_preserve_values['right']:
-                            self.drag_preserve_values['right'][key] = self.get_old_x_values_to_the_left(*key)
-                        else:
-                            print("Already have old values for", key)
-
-                    if doing_top and other_handle['top'] and can_move_y:
-                        #key = f"top_{other_handle_col}"
-                        key = (other_handle_col, other_handle_row, self.grid_y_max)
-                        if key not in self.drag_preserve_values['top']:
-                            self.drag_preserve_values['top'][key] = self.get_old_y_values_to_the_bottom(*key)
-                        else:
-                            print("Already have old values for", key)
-
-                    if doing_bottom and other_handle['bottom'] and can_move_y:
-                        #key = f"bottom_{other_handle_col}"
-                        key = (other_handle_col, 0, other_handle_row)
-                        if key not in self.drag_preserve_values['bottom']:
-                            self.drag_preserve_values['bottom'][key] = self.get_old_y_values_to_the_top(*key)
-                        else:
-                            print("Already have old values for", key)
-            else:
-                print("Not updating old values during drag")
-
-            # Apply movement to grid points and update handle positions
-            for other_handle in self.drag_handles:
-                other_handle_row = other_handle['row']
-                other_handle_col = other_handle['col']
-
-                # Check if this handle should be moved
-                should_move_x = (doing_left and other_handle['left']) or (doing_right and other_handle['right'])
-                should_move_y = (doing_top and other_handle['top']) or (doing_bottom and other_handle['bottom'])
-
-                if should_move_x or should_move_y:
-                    # Get current grid point
-                    old_x, old_y = self.drag_grid_points[other_handle_row][other_handle_col]
-
-                    # Apply delta in original coordinates
-                    new_x = old_x + (delta_x if should_move_x else 0)
-                    new_y = old_y + (delta_y if should_move_y else 0)
-
-                    # Update grid point
-                    self.drag_grid_points[other_handle_row][other_handle_col] = (int(new_x), int(new_y))
-                    grid_point_counts[other_handle_row][other_handle_col] += 1
-
-                    # Update handle display position from grid point
-                    scaled_point = self.get_scaled_grid_point(other_handle_row, other_handle_col, self.drag_grid_points)
-                    if scaled_point:
-                        other_handle['pos'] = QPoint(int(scaled_point[0]), int(scaled_point[1]))
-                        other_handle['updated'] = True
-
-            # Preserve spacing after all handles have been moved
-            for key, values in self.drag_preserve_values['left'].items():
-                self.preserve_x_spacing_to_the_right(*values)
-            for key, values in self.drag_preserve_values['right'].items():
-                self.preserve_x_spacing_to_the_left(*values)
-            for key, values in self.drag_preserve_values['top'].items():
-                self.preserve_y_spacing_to_the_bottom(*values)
-            for key, values in self.drag_preserve_values['bottom'].items():
-                self.preserve_y_spacing_to_the_top(*values)
-
-            for row in range(self.grid_y_max + 1):  # +1 because we need lines at both edges
-                for col in range(self.grid_x_max + 1):
-                    if grid_point_counts[row][col] > 1:
-                        print(f"Point ({row},{col}) modified {grid_point_counts[row][col]} times during this drag")
-                print("for row %d: %s" % (row, grid_point_counts[row]))  # Debug output for each row
+            drag_log.debug("Crop drag: display delta %d, %d -> grid delta %.3f, %.3f",
+                           display_delta_x, display_delta_y, delta_x, delta_y)
+
+            # Move the whole edge(s) the handle belongs to; the points between them are only placed
+            # when drawn. Done in the overlay's buffers: nothing is allocated per move
+            self.drag_overlay.move(delta_x, delta_y, *self.drag_handles.edges(self.dragging_handle))
 
             self.update_drag_handle_positions()
-            self.update()
+
+            # Repaint where the working grid and handles were and where they are now
+            dirty_rect = self.bounds_display_rect(self.drag_overlay.bounds(), DragHandles.HANDLE_SIZE + 2)
+            self.update(dirty_rect.united(self.drag_dirty_rect))
+            self.drag_dirty_rect = dirty_rect
+
+        if self.is_dragging:
+            self.perf.record("mouse_move", started)
 
     def mouseReleaseEvent(self, event):
+        if self.session_recorder is not None:
+            self.session_recorder.mouse("release", event)
         super().mouseReleaseEvent(event)
-        if event.button() == Qt.LeftButton and self.crop_mode:
-            # Copy modified grid points back to the main grid_points if we were dragging
-            if self.is_dragging and self.drag_grid_points:
-                # Deep copy the modified grid points back to the main grid
-                self.grid_points = [row.copy() for row in self.drag_grid_points]
-                print(f"Grid points updated from drag copy after dragging")  # Debug output
-                # Clear the copy to free memory and ensure clean state
-                self.drag_grid_points = []
-                self.drag_preserve_values = None
+        if event.button() == Qt.LeftButton and self.drag_endpoints_mode:
+            # The point was edited in place, so there is nothing to copy back
+            moved = False
+            if self.is_dragging and self.dragging_handle is not None:
+                row, col = self.drag_handles.rows[self.dragging_handle], self.drag_handles.cols[self.dragging_handle]
+                moved = not np.array_equal(self.grid_points[row, col], self.drag_start_point)
+                if moved:
+                    self.history.record([row * (self.grid_x_max + 1) + col], self.drag_start_point,
+                                        self.grid_points[row, col])
+            self.is_dragging = False
+            self.dragging_handle = None
+            self.drag_start_point = None
+            if moved:
+                self.grid_edited.emit()
+        elif event.button() == Qt.LeftButton and self.crop_mode:
+            # Merge the drag overlay into the main grid_points if we were dragging
+            if self.is_dragging and self.drag_grid_points is not None:
+                self.history.record_change(self.grid_points, self.drag_overlay.place_interior())
+                self.drag_overlay.merge(self.grid_points)
+                self.grid_points_changed()
+                drag_log.debug("Grid points updated from the drag overlay after dragging")
+                self.drag_grid_points = None
+                self.clear_drag_backdrop()
                 # Redraw the grid with the updated points
                 self.update_display()
+                self.grid_edited.emit()
 
             # Clear dragging state
             self.is_dragging = False
             self.dragging_handle = None
 
-            for handle in self.drag_handles:
-                handle['dragging'] = False
-
             # Handle dragging is complete, but keep crop mode active
             # User can exit crop mode manually using the crop button
 
+    def start_endpoint_drag(self, pos):
+        """Pick up the interior point under pos; the grid is edited in place, without a copy"""
+        handles = self.get_drag_handles()
+        handle = handles.find(pos, *self.grid_line_steps()) if handles else None
+        if handle is None:
+            return
+        self.is_dragging = True
+        self.dragging_handle = handle
+        self.drag_start_point = self.grid_points[handles.rows[handle], handles.cols[handle]].copy()
+        drag_log.debug("Endpoint drag of point (%d,%d) started", handles.rows[handle], handles.cols[handle])
+        self.last_drag_pos = pos
+
+    def move_endpoint(self, pos):
+        """Move the dragged point by the mouse delta and repaint just the area around it"""
+        handles = self.drag_handles
+        row, col = handles.rows[self.dragging_handle], handles.cols[self.dragging_handle]
+        old_pos = self.last_drag_pos
+        self.last_drag_pos = pos
+
+        dirty_rect = self.endpoint_dirty_rect(row, col)
+        point = self.grid_points[row, col]
+        point[0] += (pos.x() - old_pos.x()) / self.zoom_factor
+        point[1] += (pos.y() - old_pos.y()) / self.zoom_factor
+        self.grid_point_moved(row, col)
+        self.update(dirty_rect.united(self.endpoint_dirty_rect(row, col)))
+
+    def grid_point_moved(self, row, col):
+        """Bring cached geometry up to date after one grid point was moved in place"""
+        if self.grid_index is not None:
+            self.grid_index.include_point(row, col)
+        if self.drag_handles is not None and self.dragging_handle is not None:
+            self.drag_handles.move_handle(self.dragging_handle, self.grid_points[row, col],
+                                          self.zoom_factor, self.padding)
+
+    def endpoint_dirty_rect(self, row, col):
+        """Display rect covering a grid point, its handle and the drawn segments that end at it"""
+        step_x, step_y = self.grid_line_steps()
+        rows = [row, max(row - step_y, 0), min(row + step_y, self.grid_y_max), row, row]
+        cols = [col, col, col, max(col - step_x, 0), min(col + step_x, self.grid_x_max)]
+        points = self.grid_points[rows, cols] * self.zoom_factor + self.padding
+        left, top = points.min(axis=0)
+        right, bottom = points.max(axis=0)
+        margin = DragHandles.HANDLE_SIZE + 2
+        return QRect(int(left) - margin, int(top) - margin,
+                     int(right - left) + 2 * margin + 1, int(bottom - top) + 2 * margin + 1)
+
     def keyPressEvent(self, event):
         """Handle key press events - particularly Escape to cancel drag operations"""
+        if self.session_recorder is not None:
+            self.session_recorder.key(event)
         super().keyPressEvent(event)
 
         # Check if Escape key is pressed while dragging
@@ -655,78 +1503,132 @@ class ImageGridWidget(QLabel):
         if not self.is_dragging:
             return
 
-        print("Drag operation cancelled - restoring original positions")
+        drag_log.info("Drag operation cancelled - restoring original positions")
 
-        # Restore handle positions from the original grid points
-        if self.drag_grid_points:
-            # Recreate handles at their original positions
-            self.create_drag_handles()
+        if self.drag_endpoints_mode:
+            # Put the dragged point back where it started
+            handles = self.drag_handles
+            row, col = handles.rows[self.dragging_handle], handles.cols[self.dragging_handle]
+            dirty_rect = self.endpoint_dirty_rect(row, col)
+            self.grid_points[row, col] = self.drag_start_point
+            self.grid_point_moved(row, col)
+            self.update(dirty_rect.united(self.endpoint_dirty_rect(row, col)))
+            self.is_dragging = False
+            self.dragging_handle = None
+            self.drag_start_point = None
+            return
 
-        # Clear the drag grid points copy without applying changes
-        self.drag_grid_points = []
-        self.drag_preserve_values = None
+        # The committed grid was never touched: drop the overlay and put the handles back on it
+        if self.drag_grid_points is not None:
+            self.drag_overlay.discard()
+            self.drag_grid_points = None
+            self.drag_handles.update_positions(self.grid_points, self.zoom_factor, self.padding)
+        self.clear_drag_backdrop()
 
         # Clear dragging state
         self.is_dragging = False
         self.dragging_handle = None
 
-        # Clear dragging flags from all handles
-        for handle in self.drag_handles:
-            handle['dragging'] = False
-
         # Redraw to show the restored state
         self.update()
 
-    def calculate_grid_points(self):
-        """Calculate the 2D array of grid point locations in original image dimensions"""
-        self.grid_points = []
+    def undo(self):
+        """Step back one grid edit; False if there is nothing to undo (or a drag is in progress)"""
+        return self.step_history(self.history.undo, "undo")
 
-        if not self.original_pixmap or self.grid_x_max == 0 or self.grid_y_max == 0:
-            return
+    def redo(self):
+        """Reapply the last undone grid edit; False if there is nothing to redo"""
+        return self.step_history(self.history.redo, "redo")
+
+    def step_history(self, step, event_type):
+        if self.is_dragging:
+            return False
+        if self.session_recorder is not None:
+            self.session_recorder.history(event_type)
+        indices = step(self.grid_points)
+        if indices is None:
+            return False
+        self.history_points_changed(indices)
+        self.update()
+        self.grid_edited.emit()
+        return True
 
-        # Use original image dimensions (unscaled)
-        original_size = self.original_pixmap.size()
-        width = original_size.width()
-        height = original_size.height()
+    def history_points_changed(self, indices):
+        """Bring cached geometry up to date after undo/redo wrote the points at the given flat indices"""
+        if len(indices) > self.MAX_INCREMENTAL_POINTS:
+            self.grid_points_changed()
+            return
+        rows, cols = np.divmod(indices, self.grid_x_max + 1)
+        if self.grid_index is not None:
+            for row, col in zip(rows.tolist(), cols.tolist()):
+                self.grid_index.include_point(row, col)
+        if self.drag_handles is not None and self.drag_endpoints_mode:
+            # Interior points only, in row-major order (see create_drag_handles)
+            interior = (rows > 0) & (rows < self.grid_y_max) & (cols > 0) & (cols < self.grid_x_max)
+            for row, col in zip(rows[interior].tolist(), cols[interior].tolist()):
+                self.drag_handles.move_handle((row - 1) * (self.grid_x_max - 1) + col - 1, self.grid_points[row, col],
+                                              self.zoom_factor, self.padding)
+        elif self.drag_handles is not None:
+            self.drag_handles.zoom_factor = None
 
-        # Calculate grid spacing in original image coordinates
-        x_spacing = width / self.grid_x_max
-        y_spacing = height / self.grid_y_max
+    def calculate_grid_points(self):
+        """Calculate the 2D array of grid point locations in original image dimensions"""
+        self.grid_points = empty_grid_points()
+        self.grid_points_changed()
+        self.history.clear()
 
-        # Create 2D array with grid point coordinates in original image dimensions
-        # Array structure: grid_points[row][col] = (x, y) in original image pixels
-        for row in range(self.grid_y_max + 1):  # +1 because we need lines at both edges
-            grid_row = []
-            y = int(row * y_spacing)
+        if not self.image_size.isValid() or self.grid_x_max == 0 or self.grid_y_max == 0:
+            return
 
-            for col in range(self.grid_x_max + 1):  # +1 because we need lines at both edges
-                x = int(col * x_spacing)
-                grid_row.append((x, y))
+        # Grid points are in original image coordinates: grid_points[row, col] = (x, y) in original image pixels
+        width = self.image_size.width()
+        height = self.image_size.height()
+        self.grid_points = uniform_grid_points(width, height, self.grid_x_max, self.grid_y_max)
 
-            self.grid_points.append(grid_row)
-            print("Row %d: %s" % (row, grid_row))  # Debug output for each row
+        if self.verbose_grid() and render_log.isEnabledFor(logging.DEBUG):
+            for row in range(self.grid_y_max + 1):
+                render_log.debug("Row %d: %s", row, self.grid_points[row].tolist())
 
-        # Print debug information about grid points (can be removed later)
-        print(f"Grid points calculated: {len(self.grid_points)} rows x {len(self.grid_points[0]) if self.grid_points else 0} cols")
-        print(f"Original image size: {width}x{height}")
-        if self.grid_points:
-            print(f"Top-left corner: {self.grid_points[0][0]}")
-            print(f"Bottom-right corner: {self.grid_points[-1][-1]}")
+        render_log.debug("Grid points calculated: %d rows x %d cols for a %dx%d image, corners %s and %s",
+                         self.grid_points.shape[0], self.grid_points.shape[1], width, height,
+                         self.grid_points[0, 0], self.grid_points[-1, -1])
 
     def set_grid_points(self, grid_points):
-        """Set the grid points directly from loaded data"""
-        self.grid_points = grid_points if grid_points else []
-        print(f"Grid points loaded: {len(self.grid_points)} rows x {len(self.grid_points[0]) if self.grid_points else 0} cols")
-        if self.grid_points:
-            print(f"Loaded top-left corner: {self.grid_points[0][0]}")
-            print(f"Loaded bottom-right corner: {self.grid_points[-1][-1]}")
+        """Set the grid points directly from loaded data (nested lists or an array, which is used without copying)"""
+        if grid_points is None or len(grid_points) == 0:
+            self.grid_points = empty_grid_points()
+        else:
+            self.grid_points = np.asarray(grid_points, dtype=np.float64)
+            if self.grid_points.ndim != 3 or self.grid_points.shape[2] != 2:
+                raise ValueError("Grid points must be a rows x columns array of (x, y) pairs.")
+        self.grid_points_changed()
+        self.history.clear()
+        io_log.debug("Grid points loaded: %d rows x %d cols", self.grid_points.shape[0], self.grid_points.shape[1])
+
+    def own_grid_points(self):
+        """Copy grid_points off a memory-mapped grid file, so the file can be replaced"""
+        grid_points = owned_grid_points(self.grid_points)
+        if grid_points is not self.grid_points:
+            self.grid_points = grid_points
+            # The line index and the handles still refer to the mapped array
+            self.grid_points_changed()
+
+    def verbose_grid(self):
+        """True if the grid is small enough for the per-row debug output"""
+        return max(self.grid_x_max, self.grid_y_max) <= self.VERBOSE_GRID_MAX_SQUARES
+
+    def has_grid(self):
+        """True if there is a grid to draw or edit"""
+        return self.grid_points.size > 0 and self.grid_x_max > 0 and self.grid_y_max > 0
 
     def get_grid_point(self, row, col, grid_points=None):
         """Get the coordinates of a specific grid point in original image dimensions"""
         if grid_points is None:
             grid_points = self.grid_points
-        if (grid_points and 0 <= row < len(grid_points) and 0 <= col < len(grid_points[0])):
-            return grid_points[row][col]
+        rows, cols = grid_points.shape[:2]
+        if -rows <= row < rows and -cols <= col < cols:
+            x, y = grid_points[row, col]
+            return (float(x), float(y))
         return None
 
     def get_scaled_grid_point(self, row, col, grid_points=None):
@@ -850,6 +1752,11 @@ class PuzzleGridViewer(QMainWindow):
         self.drag_endpoints_button.setCheckable(True)
         toolbar_layout.addWidget(self.drag_endpoints_button)
 
+        self.auto_fit_button = QPushButton("Auto-Fit Grid")
+        self.auto_fit_button.clicked.connect(self.auto_fit_grid)
+        self.auto_fit_button.setEnabled(False)
+        toolbar_layout.addWidget(self.auto_fit_button)
+
         toolbar_layout.addStretch()
         layout.addWidget(toolbar_frame)
 
@@ -862,12 +1769,48 @@ class PuzzleGridViewer(QMainWindow):
         self.scroll_area.setWidget(self.image_widget)
         layout.addWidget(self.scroll_area)
 
-        # Status
+        # Performance overlay and trace export
+        QShortcut(QKeySequence("F3"), self, activated=self.toggle_perf_hud)
+        # Scrolling blits the old overlay along with the image, so repaint while it is shown
+        for scroll_bar in (self.scroll_area.horizontalScrollBar(), self.scroll_area.verticalScrollBar()):
+            scroll_bar.valueChanged.connect(
+                lambda _value: self.image_widget.show_perf_hud and self.image_widget.update())
+        QShortcut(QKeySequence("Ctrl+Shift+T"), self, activated=self.export_perf_trace)
+        # Session recording, for replay with puzzle_session.py
+        QShortcut(QKeySequence("Ctrl+Shift+R"), self, activated=self.toggle_session_recording)
+        # Undo/redo of grid edits
+        QShortcut(QKeySequence.Undo, self, activated=self.undo)
+        QShortcut(QKeySequence.Redo, self, activated=self.redo)
+
+        # Status, with progress and cancel for background image decoding
+        status_layout = QHBoxLayout()
         self.status_label = QLabel("Click 'Open Image' to start")
-        layout.addWidget(self.status_label)
+        status_layout.addWidget(self.status_label, 1)
+
+        self.load_progress = QProgressBar()
+        self.load_progress.setRange(0, 100)
+        self.load_progress.setMaximumWidth(200)
+        self.load_progress.setVisible(False)
+        status_layout.addWidget(self.load_progress)
+
+        self.cancel_load_button = QPushButton("Cancel")
+        self.cancel_load_button.clicked.connect(self.cancel_image_load)
+        self.cancel_load_button.setVisible(False)
+        status_layout.addWidget(self.cancel_load_button)
+        layout.addLayout(status_layout)
 
         self.current_image_path = None
         self.current_document_path = None
+        # How grid points are saved (see puzzle_document.GRID_FORMATS); documents keep the format they were loaded in
+        self.default_grid_format = "json"
+        self.grid_format = self.default_grid_format
+        self.image_loader = None  # ImageLoadWorker decoding current_image_path, if any
+        self.pyramid_builder = None  # PyramidBuildWorker writing the tile pyramid of the current image, if any
+        self.image_loaded_callback = None
+        # Journals grid edits to the current document and snapshots them to its recovery file in the background
+        self.autosave = Autosave(lambda: self.image_widget.grid_points, self)
+        self.autosave.status.connect(self.status_label.setText)
+        self.image_widget.grid_edited.connect(self.grid_edited)
 
     def open_image(self):
         file_path, _ = QFileDialog.getOpenFileName(
@@ -878,43 +1821,144 @@ class PuzzleGridViewer(QMainWindow):
         )
 
         if file_path:
-            pixmap = QPixmap(file_path)
-            if pixmap.isNull():
-                QMessageBox.warning(self, "Error", "Could not load the selected image file.")
-                return
+            self.open_image_from_path(file_path)
 
-            self.current_image_path = file_path
-            # Clear current document path since this is a new image
-            self.current_document_path = None
+    def open_image_from_path(self, file_path, grid_dimensions=None, recover=None):
+        """Open an image without a document; grid_dimensions (grid_x, grid_y) skips the grid dialog
 
-            # clear away existing grid and crop mode
-            self.clear_crop_mode()
+        Until the grid is saved to a document, its edits are journaled next to
+        the image, and unsaved edits left by a crash are offered (or applied
+        as recover says) when the image is opened again.
+        """
+        # Only the header is read here; decoding happens in the background
+        image_size = QImageReader(file_path).size()
+        if not image_size.isValid():
+            QMessageBox.warning(self, "Error", "Could not load the selected image file.")
+            return False
 
-            # Get grid dimensions
+        # A recorded session only covers one image
+        self.stop_session_recording()
+        self.autosave.discard()
+        self.current_image_path = file_path
+        # Clear current document path since this is a new image
+        self.current_document_path = None
+        self.grid_format = self.default_grid_format
+
+        # clear away existing grid and editing modes
+        self.clear_edit_modes()
+
+        # Start decoding now, so the image is (partly) ready by the time the dialog closes
+        self.image_widget.set_image_source(image_size=image_size)
+        self.start_image_load(file_path, image_size)
+        self.image_widget.zoom_factor = 1.0  # Reset zoom when new image is loaded
+
+        # A never-saved grid is journaled against "no grid", so whatever was edited can be recovered
+        recovered_grid, recovered = read_recovery(file_path, empty_grid_points())
+        if recovered and not self.confirm_recovery(file_path, recovered, recover):
+            recovered = 0
+        if recovered:
+            grid_dimensions = (recovered_grid.shape[1] - 1, recovered_grid.shape[0] - 1)
+        elif grid_dimensions is None:
             dialog = GridDimensionsDialog(self)
-            if dialog.exec_() == QDialog.Accepted:
-                grid_x, grid_y = dialog.get_dimensions()
-
-                # Display image with grid
-                self.image_widget.set_image_and_grid(pixmap, grid_x, grid_y)
-                self.grid_button.setEnabled(True)
-                self.save_button.setEnabled(True)
-                self.save_as_button.setEnabled(True)
-                self.crop_button.setEnabled(True)
-                self.enable_zoom_controls(True)
-
-                filename = os.path.basename(file_path)
-                self.status_label.setText(f"Image: {filename} | Grid: {grid_x}x{grid_y}")
-            else:
-                # User cancelled, just show image without grid
-                self.image_widget.set_image_and_grid(pixmap, 0, 0)
-                self.grid_button.setEnabled(True)
-                self.save_button.setEnabled(True)
-                self.save_as_button.setEnabled(True)
-                self.crop_button.setEnabled(True)
-                self.enable_zoom_controls(True)
-                filename = os.path.basename(file_path)
-                self.status_label.setText(f"Image: {filename} | No grid")
+            # User cancelled, just show image without grid
+            grid_dimensions = dialog.get_dimensions() if dialog.exec_() == QDialog.Accepted else (0, 0)
+        grid_x, grid_y = grid_dimensions
+
+        # Display image with grid
+        self.image_widget.set_grid(grid_x, grid_y)
+        if recovered:
+            self.image_widget.set_grid_points(recovered_grid)
+            self.image_widget.update_display()
+            self.autosave.attach(file_path, empty_grid_points(), recovered_grid, recovered)
+        else:
+            self.autosave.attach(file_path, empty_grid_points())
+        self.grid_button.setEnabled(True)
+        self.save_button.setEnabled(True)
+        self.save_as_button.setEnabled(True)
+        self.crop_button.setEnabled(True)
+        self.drag_endpoints_button.setEnabled(True)
+        self.auto_fit_button.setEnabled(True)
+        self.enable_zoom_controls(True)
+
+        filename = os.path.basename(file_path)
+        self.status_label.setText(f"Image: {filename} | " + (f"Grid: {grid_x}x{grid_y}" if grid_x else "No grid")
+                                  + (f" | Recovered {recovered} unsaved edits (not saved yet)" if recovered else ""))
+        return True
+
+    def start_image_load(self, file_path, image_size, on_loaded=None):
+        """Decode file_path on a worker thread, showing a fit-to-window preview as soon as it's ready"""
+        self.cancel_image_load(quiet=True)
+
+        worker = ImageLoadWorker(file_path, self.scroll_area.viewport().size(), self)
+        worker.progress.connect(self.image_load_progress)
+        worker.preview_ready.connect(self.image_preview_ready)
+        worker.image_ready.connect(self.image_load_finished)
+        worker.load_failed.connect(self.image_load_failed)
+        worker.finished.connect(worker.deleteLater)
+        self.image_loader = worker
+        self.image_loaded_callback = on_loaded
+
+        self.load_progress.setValue(0)
+        self.load_progress.setVisible(True)
+        self.cancel_load_button.setVisible(True)
+        io_log.info("Decoding %s (%dx%d) in the background", file_path, image_size.width(), image_size.height())
+        worker.start()
+
+    def cancel_image_load(self, quiet=False):
+        """Stop waiting for the background decode; whatever preview is shown stays"""
+        if self.image_loader is None:
+            return
+        self.image_loader.cancel()
+        self.image_loader = None
+        self.image_loaded_callback = None
+        self.finish_image_load_ui()
+        if not quiet:
+            self.status_label.setText(f"{self.status_label.text()} | Full-resolution load cancelled")
+
+    def wait_for_image_load(self):
+        """Block until the background decode (if any) has been delivered; for scripted use"""
+        while self.image_loader is not None:
+            self.image_loader.wait()
+            QApplication.processEvents()
+
+    def finish_image_load_ui(self):
+        self.load_progress.setVisible(False)
+        self.cancel_load_button.setVisible(False)
+
+    def image_load_progress(self, percent, message):
+        if self.sender() is self.image_loader:
+            self.load_progress.setValue(percent)
+            self.load_progress.setFormat(f"{message} %p%")
+
+    def image_preview_ready(self, image):
+        if self.sender() is not self.image_loader or self.image_widget.has_full_image():
+            return
+        self.image_widget.set_image_source(image, image_size=self.image_widget.image_size)
+        self.image_widget.update_display()
+
+    def image_load_finished(self, image):
+        if self.sender() is not self.image_loader:
+            return
+        # Keep the full-resolution image in memory; grid changes never go back to disk
+        io_log.info("Full-resolution image ready: %dx%d", image.width(), image.height())
+        self.image_widget.set_image_source(image)
+        self.image_widget.update_display()
+
+        callback = self.image_loaded_callback
+        self.image_loader = None
+        self.image_loaded_callback = None
+        self.finish_image_load_ui()
+        if callback:
+            callback()
+
+    def image_load_failed(self, message):
+        if self.sender() is not self.image_loader:
+            return
+        self.image_loader = None
+        self.image_loaded_callback = None
+        self.finish_image_load_ui()
+        io_log.warning("Could not load %s: %s", self.current_image_path, message)
+        QMessageBox.warning(self, "Error", f"Could not load the image:\n{self.current_image_path}\n\n{message}")
 
     def enable_zoom_controls(self, enabled):
         """Enable or disable all zoom controls"""
@@ -930,44 +1974,47 @@ class PuzzleGridViewer(QMainWindow):
 
         dialog = GridDimensionsDialog(self, self.image_widget.grid_x_max, self.image_widget.grid_y_max)
         if dialog.exec_() == QDialog.Accepted:
-            # clear away existing grid and crop mode
-            self.clear_crop_mode()
+            # clear away existing grid and editing modes
+            self.clear_edit_modes()
 
             grid_x, grid_y = dialog.get_dimensions()
 
-            # Reload the original image and apply new grid
-            pixmap = QPixmap(self.current_image_path)
-            self.image_widget.set_image_and_grid(pixmap, grid_x, grid_y)
+            # Apply the new grid to the image already in memory
+            self.image_widget.set_grid(grid_x, grid_y)
+            self.grid_edited()
 
             filename = os.path.basename(self.current_image_path)
             self.status_label.setText(f"Image: {filename} | Grid: {grid_x}x{grid_y}")
 
+    def apply_zoom(self, zoom_factor):
+        """Interactive zoom shared by the slider and the zoom buttons"""
+        self.image_widget.set_zoom(zoom_factor, preview=True)
+        # Keep the slider in sync without re-entering zoom_changed
+        self.zoom_slider.blockSignals(True)
+        self.zoom_slider.setValue(int(round(zoom_factor * 100)))
+        self.zoom_slider.blockSignals(False)
+        self.zoom_label.setText(f"{int(round(zoom_factor * 100))}%")
+
     def zoom_in(self):
         current_zoom = self.image_widget.zoom_factor
         new_zoom = min(current_zoom * 1.1, 5.0)  # Max zoom 500%
-        self.image_widget.set_zoom(new_zoom)
-        self.zoom_slider.setValue(int(new_zoom * 100))
-        self.zoom_label.setText(f"{int(new_zoom * 100)}%")
+        self.apply_zoom(new_zoom)
 
     def zoom_out(self):
         current_zoom = self.image_widget.zoom_factor
         new_zoom = max(current_zoom / 1.1, 0.1)  # Min zoom 10%
-        self.image_widget.set_zoom(new_zoom)
-        self.zoom_slider.setValue(int(new_zoom * 100))
-        self.zoom_label.setText(f"{int(new_zoom * 100)}%")
+        self.apply_zoom(new_zoom)
 
     def zoom_changed(self, value):
-        zoom_factor = value / 100.0
-        self.image_widget.set_zoom(zoom_factor)
-        self.zoom_label.setText(f"{value}%")
+        self.apply_zoom(value / 100.0)
 
     def zoom_fit(self):
-        if self.image_widget.original_pixmap:
+        if self.image_widget.has_image():
             # Get the scroll area's viewport size (available space for the image)
             viewport_size = self.scroll_area.viewport().size()
 
             # Get original image size
-            image_size = self.image_widget.original_pixmap.size()
+            image_size = self.image_widget.image_size
 
             # Calculate zoom factors needed to fit width and height
             width_zoom = viewport_size.width() / image_size.width()
@@ -980,63 +2027,131 @@ class PuzzleGridViewer(QMainWindow):
             fit_zoom = max(0.1, min(fit_zoom, 5.0))
 
             # Apply the calculated zoom
-            self.image_widget.set_zoom(fit_zoom)
-            self.zoom_slider.setValue(int(fit_zoom * 100))
-            self.zoom_label.setText(f"{int(fit_zoom * 100)}%")
+            self.apply_zoom(fit_zoom)
 
     def zoom_actual(self):
-        if self.image_widget.original_pixmap:
-            self.image_widget.set_zoom(1.0)
-            self.zoom_slider.setValue(100)
-            self.zoom_label.setText("100%")
+        if self.image_widget.has_image():
+            self.apply_zoom(1.0)
+
+    def current_document_data(self):
+        """Document dict (see make_document) of the current image, grid, zoom and window geometry"""
+        if self.grid_format != "json":
+            # The grid file is about to be replaced, which Windows refuses while it is mapped
+            self.image_widget.own_grid_points()
+        geometry = self.geometry()
+        return make_document(self.current_image_path, self.image_widget.grid_x_max,
+                             self.image_widget.grid_y_max, self.image_widget.grid_points,
+                             self.image_widget.zoom_factor,
+                             (geometry.x(), geometry.y(), geometry.width(), geometry.height()))
 
-    def _save_document_to_file(self, file_path):
-        """Helper function to save document data to a specified file path"""
-        if not self.current_image_path:
-            return False
+    def grid_edited(self):
+        """Journal a finished edit of the grid for autosave"""
+        self.autosave.grid_edited(self.image_widget.grid_points)
 
-        # Create the document data with all required information
-        # Convert backslashes to forward slashes for cross-platform compatibility
-        normalized_image_path = self.current_image_path.replace('\\', '/')
+    def _save_document_to_file(self, file_path, notify=True):
+        """Helper function to save document data to a specified file path
 
-        # Get current window geometry
-        geometry = self.geometry()
+        Success is shown in the status line. With notify=False no message boxes
+        are shown (for scripted and headless use); failures are still logged and
+        reported through the return value.
+        """
+        if not self.current_image_path:
+            return False
 
-        document_data = {
-            "grid_x": self.image_widget.grid_x_max,
-            "grid_y": self.image_widget.grid_y_max,
-            "image_path": normalized_image_path,
-            "zoom_value": self.image_widget.zoom_factor,
-            "grid_points": self.image_widget.grid_points,  # Save grid points array
-            "window_width": geometry.width(),
-            "window_height": geometry.height(),
-            "window_x": geometry.x(),
-            "window_y": geometry.y()
-        }
+        document_data = self.current_document_data()
 
         try:
-            with open(file_path, "w") as json_file:
-                json.dump(document_data, json_file, indent=2)
-
-            QMessageBox.information(
-                self,
-                "Document Saved",
-                f"Document saved successfully to:\n{file_path}\n\n"
-                f"Grid: {document_data['grid_x']}x{document_data['grid_y']}\n"
-                f"Zoom: {int(document_data['zoom_value'] * 100)}%"
-            )
+            write_document(file_path, document_data, self.grid_format)
+            io_log.info("Saved %s (grid %dx%d, %s)", file_path, document_data["grid_x"], document_data["grid_y"],
+                        self.grid_format)
+            self.status_label.setText(f"Saved {os.path.basename(file_path)} | Grid: {document_data['grid_x']}x"
+                                      f"{document_data['grid_y']} | Zoom: {int(document_data['zoom_value'] * 100)}%")
+
+            # Nothing is unsaved any more: recovery starts over from the saved grid (of the new document, for Save As)
+            self.autosave.attach(file_path, document_data["grid_points"])
             # Enable reload button since we have a loaded document
             self.reload_button.setEnabled(True)
 
+            self.ensure_image_pyramid(file_path)
             return True
         except Exception as e:
-            QMessageBox.critical(
-                self,
-                "Save Error",
-                f"Failed to save document:\n{str(e)}"
-            )
+            io_log.warning("Failed to save %s: %s", file_path, e)
+            if notify:
+                QMessageBox.critical(
+                    self,
+                    "Save Error",
+                    f"Failed to save document:\n{str(e)}"
+                )
             return False
 
+    def ensure_image_pyramid(self, document_path):
+        """Build the tile pyramid next to document_path for huge images, so later loads skip decoding"""
+        widget = self.image_widget
+        if not widget.has_full_image() or not self.current_image_path:
+            return
+        if widget.image_size.width() * widget.image_size.height() <= PYRAMID_MIN_PIXELS:
+            return
+
+        pyramid = TilePyramid.open_for(document_path, self.current_image_path)
+        if pyramid is not None:
+            widget.set_image_source(widget.original_image, pyramid)
+            return
+
+        pyramid_path = pyramid_path_for(document_path, self.current_image_path)
+        if self.pyramid_builder is not None and self.pyramid_builder.pyramid_path == pyramid_path:
+            return
+        # The decoded image stays on screen until the pyramid is written, then the pyramid is swapped in
+        self.cancel_pyramid_build()
+        worker = PyramidBuildWorker(widget.original_image, self.current_image_path, pyramid_path, self)
+        worker.pyramid_ready.connect(self.pyramid_build_finished)
+        worker.build_failed.connect(self.pyramid_build_failed)
+        worker.finished.connect(worker.deleteLater)
+        self.pyramid_builder = worker
+        self.status_label.setText(f"{self.status_label.text()} | Building tile pyramid {os.path.basename(pyramid_path)}")
+        io_log.info("Building tile pyramid %s in the background", pyramid_path)
+        worker.start()
+
+    def cancel_pyramid_build(self, wait=False):
+        """Stop the background pyramid build, if any; with wait=True until its thread has exited"""
+        worker = self.pyramid_builder
+        if worker is None:
+            return
+        worker.cancel()
+        self.pyramid_builder = None
+        if wait:
+            worker.wait()
+
+    def wait_for_pyramid_build(self):
+        """Block until the background pyramid build (if any) has been delivered; for scripted use"""
+        while self.pyramid_builder is not None:
+            self.pyramid_builder.wait()
+            QApplication.processEvents()
+
+    def pyramid_build_finished(self, pyramid_path):
+        worker = self.sender()
+        if worker is not self.pyramid_builder:
+            return
+        self.pyramid_builder = None
+        widget = self.image_widget
+        # Only swapped in if the image it was built from is still the one shown
+        if worker.image_path != self.current_image_path or not widget.has_full_image():
+            return
+        try:
+            pyramid = TilePyramid(pyramid_path)
+        except (OSError, ValueError) as e:
+            io_log.warning("Could not open tile pyramid %s: %s", pyramid_path, e)
+            return
+        io_log.info("Tile pyramid %s ready", pyramid_path)
+        widget.set_image_source(widget.original_image, pyramid)
+        widget.update_display()
+
+    def pyramid_build_failed(self, message):
+        worker = self.sender()
+        if worker is not self.pyramid_builder:
+            return
+        self.pyramid_builder = None
+        io_log.warning("Could not build tile pyramid %s: %s", worker.pyramid_path, message)
+
     def save_document(self):
         if not self.current_image_path:
             return
@@ -1082,20 +2197,36 @@ class PuzzleGridViewer(QMainWindow):
             self.crop_button.setChecked(False)
             self.toggle_crop_mode()
 
-    def load_document_from_path(self, file_path):
+    def clear_drag_endpoints_mode(self):
+        if self.drag_endpoints_mode:
+            self.image_widget.cancel_drag_operation()
+            self.drag_endpoints_button.setChecked(False)
+            self.toggle_drag_endpoints_mode()
+
+    def clear_edit_modes(self):
+        """Leave crop and drag endpoints mode, abandoning any drag in progress"""
         self.clear_crop_mode()
+        self.clear_drag_endpoints_mode()
+
+    def load_document_from_path(self, file_path, recover=None):
+        """Load a document from a given file path
+
+        Unsaved edits left by a session that ended without saving are recovered
+        if recover is True, thrown away if it is False, and offered otherwise.
+        """
+        self.stop_session_recording()
+        self.clear_edit_modes()
+        self.autosave.discard()
 
-        """Load a document from a given file path"""
         try:
-            with open(file_path, "r") as json_file:
-                document_data = json.load(json_file)
+            io_log.info("Loading document %s", file_path)
+            document_data = read_document(file_path)
 
-            # Validate document data
             grid_x = document_data.get("grid_x")
             grid_y = document_data.get("grid_y")
             image_path = document_data.get("image_path")
             zoom_value = document_data.get("zoom_value", 1.0)
-            saved_grid_points = document_data.get("grid_points")  # Load saved grid points
+            saved_grid_points = document_grid_points(document_data, file_path)  # Saved grid points, if any
 
             # Get window dimensions (with fallbacks for older documents)
             window_width = document_data.get("window_width")
@@ -1103,16 +2234,12 @@ class PuzzleGridViewer(QMainWindow):
             window_x = document_data.get("window_x")
             window_y = document_data.get("window_y")
 
-            if grid_x is None or grid_y is None or image_path is None:
-                raise ValueError("Invalid document structure.")
-
-            # Convert forward slashes back to native path format if needed
-            if '/' in image_path and os.sep == '\\':
-                image_path = image_path.replace('/', '\\')
+            image_path = native_image_path(image_path)
 
             # Update viewer state
             self.current_image_path = image_path
             self.current_document_path = file_path  # Set the current document path
+            self.grid_format = document_grid_format(document_data)
 
             # Restore window dimensions if available, ensuring it's on screen
             if all(v is not None for v in [window_width, window_height, window_x, window_y]):
@@ -1122,24 +2249,46 @@ class PuzzleGridViewer(QMainWindow):
                 )
                 self.setGeometry(adjusted_x, adjusted_y, adjusted_width, adjusted_height)
 
-            # Load and display the image
-            pixmap = QPixmap(image_path)
-            if pixmap.isNull():
-                QMessageBox.warning(self, "Error", f"Could not load the image from the document:\n{image_path}")
-                return False
+            # Huge images are read lazily from their tile pyramid instead of being decoded whole
+            pyramid = TilePyramid.open_for(file_path, image_path)
+            if pyramid is not None:
+                self.cancel_image_load(quiet=True)
+                self.image_widget.set_image_source(pyramid=pyramid)
+            else:
+                # Decode in the background; grid and zoom only need the size from the header
+                image_size = QImageReader(image_path).size()
+                if not image_size.isValid():
+                    QMessageBox.warning(self, "Error", f"Could not load the image from the document:\n{image_path}")
+                    return False
+                self.image_widget.set_image_source(image_size=image_size)
+                self.start_image_load(image_path, image_size,
+                                      on_loaded=lambda: self.ensure_image_pyramid(file_path))
 
             # Set up the image widget
-            self.image_widget.original_pixmap = pixmap
             self.image_widget.grid_x_max = grid_x
             self.image_widget.grid_y_max = grid_y
 
             # Load saved grid points if available, otherwise calculate them
-            if saved_grid_points:
+            if saved_grid_points is not None:
                 self.image_widget.set_grid_points(saved_grid_points)
-                print("Using saved grid points from document")
+                io_log.debug("Using saved grid points from document")
             else:
                 self.image_widget.calculate_grid_points()
-                print("No saved grid points found, calculated new ones")
+                io_log.debug("No saved grid points found, calculated new ones")
+
+            # Edits journaled since the last save survive a crash, but only go into the grid if the user wants them
+            saved_grid = self.image_widget.grid_points
+            recovered_grid, recovered = read_recovery(file_path, saved_grid)
+            if recovered and not self.confirm_recovery(file_path, recovered, recover):
+                recovered = 0
+            if recovered:
+                self.image_widget.set_grid_points(recovered_grid)
+                grid_y, grid_x = recovered_grid.shape[0] - 1, recovered_grid.shape[1] - 1
+                self.image_widget.grid_x_max = grid_x
+                self.image_widget.grid_y_max = grid_y
+                self.autosave.attach(file_path, saved_grid, recovered_grid, recovered)
+            else:
+                self.autosave.attach(file_path, saved_grid)
 
             # Set zoom and update display
             self.image_widget.zoom_factor = 1.0  # Reset to default first
@@ -1152,7 +2301,8 @@ class PuzzleGridViewer(QMainWindow):
 
             # Update status
             filename = os.path.basename(image_path)
-            self.status_label.setText(f"Image: {filename} | Grid: {grid_x}x{grid_y} | Zoom: {int(zoom_value * 100)}%")
+            self.status_label.setText(f"Image: {filename} | Grid: {grid_x}x{grid_y} | Zoom: {int(zoom_value * 100)}%"
+                                      + (f" | Recovered {recovered} unsaved edits (not saved yet)" if recovered else ""))
 
             # Update window title to include document name
             document_name = os.path.basename(file_path)
@@ -1165,6 +2315,7 @@ class PuzzleGridViewer(QMainWindow):
             self.crop_button.setEnabled(True)
             self.enable_zoom_controls(True)
             self.drag_endpoints_button.setEnabled(True)
+            self.auto_fit_button.setEnabled(True)
 
             # Enable reload button since we have a loaded document
             self.reload_button.setEnabled(True)
@@ -1179,6 +2330,19 @@ class PuzzleGridViewer(QMainWindow):
             )
             return False
 
+    def confirm_recovery(self, file_path, edits, recover=None):
+        """Whether to apply the unsaved edits found for a document; asks unless recover says"""
+        if recover is not None:
+            return recover
+        reply = QMessageBox.question(
+            self,
+            "Recover Unsaved Edits",
+            f"{os.path.basename(file_path)} has {edits} unsaved edits from a session that did not end normally.\n"
+            "Recover them? They are not saved to the document until you save it.",
+            QMessageBox.Yes | QMessageBox.No
+        )
+        return reply == QMessageBox.Yes
+
     def load_document(self):
         """Load document using file dialog"""
         file_path, _ = QFileDialog.getOpenFileName(
@@ -1201,6 +2365,7 @@ class PuzzleGridViewer(QMainWindow):
                 QMessageBox.Yes | QMessageBox.No
             )
             if reply == QMessageBox.Yes:
+                self.autosave.discard()
                 self.load_document_from_path(self.current_document_path)
         else:
             QMessageBox.warning(self, "Reload Error", "No document to reload or file not found.")
@@ -1208,7 +2373,8 @@ class PuzzleGridViewer(QMainWindow):
     def toggle_crop_mode(self):
         """Toggle crop mode on/off"""
         if self.crop_button.isChecked():
-            # Enable crop mode
+            # Enable crop mode; the two editing modes are exclusive
+            self.clear_drag_endpoints_mode()
             self.crop_mode = True
             self.image_widget.set_crop_mode(True)
             self.crop_button.setText("Exit Crop")
@@ -1221,7 +2387,8 @@ class PuzzleGridViewer(QMainWindow):
     def toggle_drag_endpoints_mode(self):
         """Toggle drag endpoints mode on/off"""
         if self.drag_endpoints_button.isChecked():
-            # Enable drag endpoints mode
+            # Enable drag endpoints mode; the two editing modes are exclusive
+            self.clear_crop_mode()
             self.drag_endpoints_mode = True
             self.image_widget.set_drag_endpoints_mode(True)
             self.drag_endpoints_button.setText("Exit Drag Endpoints")
@@ -1231,6 +2398,91 @@ class PuzzleGridViewer(QMainWindow):
             self.image_widget.set_drag_endpoints_mode(False)
             self.drag_endpoints_button.setText("Drag Endpoints")
 
+    def auto_fit_grid(self):
+        """Snap the grid to the piece seams in the image, keeping its dimensions and the edit mode"""
+        if not self.image_widget.has_grid():
+            return
+        if not self.image_widget.has_full_image():
+            self.status_label.setText("Auto-fit needs the full-resolution image, which is not loaded")
+            return
+        self.image_widget.cancel_drag_operation()
+        started = time.perf_counter()
+        self.image_widget.auto_fit_grid()
+        filename = os.path.basename(self.current_image_path)
+        self.status_label.setText(f"Image: {filename} | Grid: {self.image_widget.grid_x_max}x"
+                                  f"{self.image_widget.grid_y_max} | Auto-fitted in "
+                                  f"{(time.perf_counter() - started) * 1000:.0f} ms")
+
+    def undo(self):
+        if self.image_widget.undo():
+            self.status_label.setText(f"Undo ({len(self.image_widget.history.undo_stack)} more)")
+
+    def redo(self):
+        if self.image_widget.redo():
+            self.status_label.setText(f"Redo ({len(self.image_widget.history.redo_stack)} more)")
+
+    def toggle_perf_hud(self):
+        """Show or hide the frame-time overlay (F3)"""
+        self.image_widget.set_perf_hud(not self.image_widget.show_perf_hud)
+
+    def export_perf_trace(self, file_path=None):
+        """Write the collected timings as a JSON trace (Ctrl+Shift+T asks where)"""
+        if not file_path:
+            file_path, _ = QFileDialog.getSaveFileName(self, "Export Performance Trace", "puzzle-trace.json",
+                                                       "JSON Files (*.json);;All Files (*)")
+            if not file_path:
+                return None
+        metadata = self.image_widget.perf_metadata()
+        metadata["image_path"] = self.current_image_path
+        metadata["document_path"] = self.current_document_path
+        try:
+            self.image_widget.perf.export_trace(file_path, metadata)
+        except OSError as e:
+            QMessageBox.critical(self, "Export Error", f"Failed to export the trace:\n{str(e)}")
+            return None
+        io_log.info("Performance trace written to %s", file_path)
+        return file_path
+
+    def start_session_recording(self, file_path=None):
+        """Record the grid state and the editing events that follow, for replay with puzzle_session.py"""
+        widget = self.image_widget
+        if widget.session_recorder is not None or not widget.has_image():
+            return False
+        if not file_path:
+            file_path, _ = QFileDialog.getSaveFileName(self, "Record Session", "puzzle-session.json",
+                                                       "JSON Files (*.json);;All Files (*)")
+            if not file_path:
+                return False
+        # A drag that is already under way could not be replayed from its start
+        widget.cancel_drag_operation()
+        # Nor could undo steps from before the recording
+        widget.history.clear()
+        widget.session_recorder = SessionRecorder(widget, self.current_image_path, file_path)
+        self.status_label.setText(f"Recording session to {os.path.basename(file_path)} (Ctrl+Shift+R to stop)")
+        io_log.info("Recording session to %s", file_path)
+        return True
+
+    def stop_session_recording(self):
+        """Stop recording and write the session file"""
+        recorder = self.image_widget.session_recorder
+        if recorder is None:
+            return None
+        self.image_widget.session_recorder = None
+        try:
+            file_path = recorder.save()
+        except OSError as e:
+            QMessageBox.critical(self, "Session Error", f"Failed to write the session:\n{str(e)}")
+            return None
+        self.status_label.setText(f"Session saved to {os.path.basename(file_path)}")
+        return file_path
+
+    def toggle_session_recording(self):
+        """Start or stop session recording (Ctrl+Shift+R)"""
+        if self.image_widget.session_recorder is None:
+            self.start_session_recording()
+        else:
+            self.stop_session_recording()
+
     def ensure_window_on_screen(self, x, y, width, height):
         """Ensure the window position is visible on screen, adjusting if necessary"""
         # Get the desktop widget to access screen geometry
@@ -1284,17 +2536,46 @@ class PuzzleGridViewer(QMainWindow):
         return x, y, width, height
 
 def main():
-    app = QApplication(sys.argv)
+    parser = argparse.ArgumentParser(description="View images with an editable puzzle grid overlay.")
+    parser.add_argument("document", nargs="?", help="puzzle document (.puz.json) to open")
+    parser.add_argument("--log", metavar="SPEC",
+                        help="log verbosity, e.g. 'debug' or 'info,drag=debug,io=off' "
+                             f"(categories: render, drag, io; default ${LOG_ENV_VAR} or warnings only)")
+    parser.add_argument("--hud", action="store_true", help="show the frame-time overlay (toggle with F3)")
+    parser.add_argument("--perf-trace", metavar="FILE", help="write a JSON performance trace to FILE on exit")
+    parser.add_argument("--grid-format", choices=GRID_FORMATS, default="json",
+                        help="how new documents store their grid points: in the JSON (default), or in a "
+                             "memory-mapped (binary) or compressed grid file next to it")
+    parser.add_argument("--record-session", metavar="FILE",
+                        help="record the editing session on the opened document to FILE, for puzzle_session.py")
+    # Anything not recognised is left for Qt (-style, -platform, ...)
+    args, qt_args = parser.parse_known_args()
+    try:
+        configure_logging(args.log)
+    except ValueError as e:
+        parser.error(str(e))
+
+    app = QApplication(sys.argv[:1] + qt_args)
     viewer = PuzzleGridViewer()
+    viewer.default_grid_format = viewer.grid_format = args.grid_format
+    if args.hud:
+        viewer.image_widget.set_perf_hud(True)
+    if args.perf_trace:
+        app.aboutToQuit.connect(lambda: viewer.export_perf_trace(args.perf_trace))
+    app.aboutToQuit.connect(viewer.stop_session_recording)
+    # Quitting without saving drops the unsaved edits; only a crash leaves them for recovery
+    app.aboutToQuit.connect(viewer.autosave.discard)
+    app.aboutToQuit.connect(lambda: viewer.cancel_pyramid_build(wait=True))
 
     # Check for command line arguments
-    if len(sys.argv) > 1:
-        document_path = sys.argv[1]
+    if args.document:
+        document_path = args.document
         # Check if the file exists and has the right extension
         if os.path.exists(document_path) and document_path.lower().endswith(('.puz.json', '.json')):
             # Load the document after the viewer is shown
             viewer.show()
-            viewer.load_document_from_path(document_path)
+            if viewer.load_document_from_path(document_path) and args.record_session:
+                viewer.start_session_recording(args.record_session)
         else:
             viewer.show()
             if not os.path.exists(document_path):
@@ -0,0 +1,201 @@
+"""Memory-mapped tile pyramids, so very large images can be shown without decoding them whole
+
+Images above PYRAMID_MIN_PIXELS get a pyramid file (<image name>.pyramid) next
+to their document: the image cut into fixed-size RGB888 tiles at full
+resolution and at every halving down to a single tile. The viewer builds it
+on a worker thread from the decoded image the first time the document is saved
+or loaded; later loads map it and read only the tiles the current view needs.
+The header records the source image's size and modification time, and a
+pyramid whose source has changed is ignored (and rebuilt).
+"""
+import os
+import json
+import mmap
+import struct
+import ctypes
+from PyQt5 import sip
+from PyQt5.QtGui import QImage
+from PyQt5.QtCore import Qt, QRect
+
+
+# Images with more pixels than this get a tile pyramid next to their document
+PYRAMID_MIN_PIXELS = 8192 * 8192
+
+PYRAMID_MAGIC = b"PUZPYR01"
+PYRAMID_EXTENSION = ".pyramid"
+PYRAMID_ALIGNMENT = 4096
+
+
+def pyramid_path_for(document_path, image_path):
+    """Location of the tile pyramid for image_path, stored next to the document"""
+    directory = os.path.dirname(os.path.abspath(document_path))
+    image_name = os.path.splitext(os.path.basename(image_path))[0]
+    return os.path.join(directory, image_name + PYRAMID_EXTENSION)
+
+
+class TilePyramid:
+    """Read-only, memory-mapped mip pyramid of fixed-size RGB888 tiles
+
+    File layout: magic, little-endian uint32 header length, JSON header, then
+    the tiles of every level, each tile_size x tile_size x 3 bytes, row-major.
+    Level 0 is the full-resolution image and each level halves the previous one.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._map = None
+        self._anchor = None
+        self._file = open(path, "rb")
+        try:
+            # Copy-on-write mapping: pages are still read lazily from the file, but the buffer is
+            # writable as far as ctypes is concerned, which lets us take its address
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_COPY)
+        except Exception:
+            self._file.close()
+            raise
+
+        if self._map[:len(PYRAMID_MAGIC)] != PYRAMID_MAGIC:
+            self.close()
+            raise ValueError(f"Not a tile pyramid: {path}")
+        header_length, = struct.unpack_from("<I", self._map, len(PYRAMID_MAGIC))
+        header_start = len(PYRAMID_MAGIC) + 4
+        self.header = json.loads(self._map[header_start:header_start + header_length].decode("utf-8"))
+
+        self.width = self.header["width"]
+        self.height = self.header["height"]
+        self.tile_size = self.header["tile_size"]
+        self.levels = self.header["levels"]
+        self.tile_bytes = self.tile_size * self.tile_size * 3
+        # Base address of the mapping, so tiles can be wrapped by QImage without copying
+        self._anchor = ctypes.c_char.from_buffer(self._map)
+        self._base_address = ctypes.addressof(self._anchor)
+
+    def close(self):
+        if self._map is not None:
+            self._anchor = None
+            self._base_address = None
+            self._map.close()
+            self._map = None
+        self._file.close()
+
+    def matches_source(self, image_path):
+        """True if the pyramid was built from the current contents of image_path"""
+        try:
+            stat = os.stat(image_path)
+        except OSError:
+            return False
+        return (self.header.get("source_name") == os.path.basename(image_path)
+                and self.header.get("source_size") == stat.st_size
+                and self.header.get("source_mtime") == int(stat.st_mtime))
+
+    def level_for_zoom(self, zoom_factor):
+        """Coarsest level that still has at least zoom_factor resolution"""
+        level = 0
+        while level + 1 < len(self.levels) and 0.5 ** (level + 1) >= zoom_factor:
+            level += 1
+        return level
+
+    def level_scale(self, level):
+        """Scale of a level relative to the full-resolution image"""
+        return self.levels[level]["width"] / self.width
+
+    def tile_image(self, level, col, row):
+        """QImage of one tile, pointing straight into the memory map (valid while the pyramid is open)"""
+        info = self.levels[level]
+        offset = info["offset"] + (row * info["cols"] + col) * self.tile_bytes
+        address = sip.voidptr(self._base_address + offset)
+        return QImage(address, self.tile_size, self.tile_size, self.tile_size * 3, QImage.Format_RGB888)
+
+    @classmethod
+    def open_for(cls, document_path, image_path):
+        """Open the pyramid stored next to document_path if it is up to date for image_path"""
+        path = pyramid_path_for(document_path, image_path)
+        if not os.path.exists(path):
+            return None
+        try:
+            pyramid = cls(path)
+        except (OSError, ValueError):
+            return None
+        if not pyramid.matches_source(image_path):
+            pyramid.close()
+            return None
+        return pyramid
+
+
+def build_pyramid(image, image_path, output_path, tile_size=256, is_cancelled=None):
+    """Write the tile pyramid for image (a decoded QImage of image_path) to output_path
+
+    The file is written under a temporary name and renamed into place, so a
+    half-written pyramid is never picked up by TilePyramid.open_for. When
+    is_cancelled() turns true the build stops between tile rows, removes the
+    temporary file and returns None.
+    """
+    level_image = image.convertToFormat(QImage.Format_RGB888)
+    tile_bytes = tile_size * tile_size * 3
+
+    # Work out the level geometry first so the header can carry every offset
+    levels = []
+    width, height = level_image.width(), level_image.height()
+    while True:
+        levels.append({
+            "width": width,
+            "height": height,
+            "cols": (width + tile_size - 1) // tile_size,
+            "rows": (height + tile_size - 1) // tile_size,
+        })
+        if width <= tile_size and height <= tile_size:
+            break
+        width, height = max(1, width // 2), max(1, height // 2)
+
+    stat = os.stat(image_path)
+    header = {
+        "width": level_image.width(),
+        "height": level_image.height(),
+        "tile_size": tile_size,
+        "source_name": os.path.basename(image_path),
+        "source_size": stat.st_size,
+        "source_mtime": int(stat.st_mtime),
+        "levels": levels,
+    }
+
+    # Offsets don't change the header length by much; pad generously and fix them up
+    header_start = len(PYRAMID_MAGIC) + 4
+    offset = PYRAMID_ALIGNMENT
+    while True:
+        data_offset = offset
+        for level in levels:
+            level["offset"] = data_offset
+            data_offset += level["cols"] * level["rows"] * tile_bytes
+        header_bytes = json.dumps(header).encode("utf-8")
+        if header_start + len(header_bytes) <= offset:
+            break
+        offset += PYRAMID_ALIGNMENT
+
+    temp_path = output_path + ".tmp"
+    with open(temp_path, "wb") as pyramid_file:
+        pyramid_file.write(PYRAMID_MAGIC)
+        pyramid_file.write(struct.pack("<I", len(header_bytes)))
+        pyramid_file.write(header_bytes)
+        pyramid_file.write(b"\0" * (offset - header_start - len(header_bytes)))
+
+        for index, level in enumerate(levels):
+            if is_cancelled is not None and is_cancelled():
+                break
+            if index > 0:
+                # Smooth scaling hands back a 32-bit image, so convert again to keep 3 bytes per pixel
+                level_image = level_image.scaled(level["width"], level["height"],
+                                                 Qt.IgnoreAspectRatio, Qt.SmoothTransformation)
+                level_image = level_image.convertToFormat(QImage.Format_RGB888)
+            for row in range(level["rows"]):
+                if is_cancelled is not None and is_cancelled():
+                    break
+                for col in range(level["cols"]):
+                    # copy() pads tiles hanging off the right/bottom edge, so every tile has the same stride
+                    tile = level_image.copy(QRect(col * tile_size, row * tile_size, tile_size, tile_size))
+                    pyramid_file.write(tile.constBits().asstring(tile_bytes))
+
+    if is_cancelled is not None and is_cancelled():
+        os.remove(temp_path)
+        return None
+    os.replace(temp_path, output_path)
+    return output_path
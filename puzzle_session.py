@@ -0,0 +1,291 @@
+"""Record and replay interactive editing sessions
+
+A session is the grid document state when recording started plus the
+timestamped stream of press, move, release, key, zoom, mode, grid, auto-fit
+and undo/redo events that reached ImageGridWidget afterwards, and a digest
+of the grid it ended with. Replaying feeds the events back into an ImageGridWidget,
+checks that the resulting grid_points match the recorded digest bit for bit
+and times every event, so a recorded session works both as a correctness and
+as a performance fixture.
+
+    python puzzle_session.py SESSION [SESSION ...] [--realtime] [--trace FILE]
+
+Replay runs headless (offscreen Qt platform unless QT_QPA_PLATFORM is set)
+and exits with status 1 if any session ends with a different grid.
+"""
+import os
+import sys
+import json
+import time
+import hashlib
+import argparse
+import numpy as np
+from PyQt5.QtGui import QImage, QColor, QMouseEvent, QKeyEvent
+from PyQt5.QtCore import Qt, QEvent, QPointF, QSize
+from puzzle_log import io_log, configure_logging
+from puzzle_perf import PerfStats
+
+
+SESSION_VERSION = 1
+
+MOUSE_EVENT_TYPES = {
+    "press": QEvent.MouseButtonPress,
+    "move": QEvent.MouseMove,
+    "release": QEvent.MouseButtonRelease,
+}
+
+
+def grid_digest(grid_points):
+    """SHA-256 of the grid's shape and float64 values; equal digests mean bit-identical grids"""
+    points = np.ascontiguousarray(grid_points, dtype=np.float64)
+    digest = hashlib.sha256(repr(points.shape).encode("ascii"))
+    digest.update(points.tobytes())
+    return digest.hexdigest()
+
+
+def widget_mode(widget):
+    if widget.crop_mode:
+        return "crop"
+    if widget.drag_endpoints_mode:
+        return "endpoints"
+    return None
+
+
+class SessionRecorder:
+    """Collects the events reaching an ImageGridWidget; the widget calls it from its handlers"""
+
+    def __init__(self, widget, image_path, file_path):
+        self.widget = widget
+        self.file_path = file_path
+        self.started = time.perf_counter()
+        self.events = []
+        viewport = widget.parentWidget() or widget
+        self.initial_state = {
+            "image_path": image_path.replace('\\', '/') if image_path else None,
+            "image_width": widget.image_size.width(),
+            "image_height": widget.image_size.height(),
+            "grid_x": widget.grid_x_max,
+            "grid_y": widget.grid_y_max,
+            "zoom_value": widget.zoom_factor,
+            "mode": widget_mode(widget),
+            "viewport_width": viewport.width(),
+            "viewport_height": viewport.height(),
+            "grid_points": widget.grid_points.tolist(),
+        }
+
+    def add(self, event_type, **fields):
+        fields["t"] = round(time.perf_counter() - self.started, 6)
+        fields["type"] = event_type
+        self.events.append(fields)
+
+    def mouse(self, event_type, event):
+        fields = {
+            "x": event.pos().x(),
+            "y": event.pos().y(),
+            "button": int(event.button()),
+            "buttons": int(event.buttons()),
+            "modifiers": int(event.modifiers()),
+        }
+        if event_type == "press":
+            # Where the widget was scrolled to; it decides how much a repaint has to cover
+            fields["scroll_x"] = -self.widget.x()
+            fields["scroll_y"] = -self.widget.y()
+        self.add(event_type, **fields)
+
+    def key(self, event):
+        self.add("key", key=event.key(), modifiers=int(event.modifiers()))
+
+    def zoom(self, zoom_factor, preview):
+        self.add("zoom", zoom=zoom_factor, preview=preview)
+
+    def mode(self, mode, enabled):
+        self.add("mode", mode=mode, enabled=enabled)
+
+    def grid(self, grid_x, grid_y):
+        self.add("grid", grid_x=grid_x, grid_y=grid_y)
+
+    def autofit(self):
+        self.add("autofit")
+
+    def history(self, event_type):
+        """An undo or redo step"""
+        self.add(event_type)
+
+    def session(self):
+        """The recorded session as a JSON-serialisable dict"""
+        session = dict(self.initial_state)
+        session.update({
+            "version": SESSION_VERSION,
+            "duration": round(time.perf_counter() - self.started, 6),
+            "events": self.events,
+            "final_grid_digest": grid_digest(self.widget.grid_points),
+        })
+        return session
+
+    def save(self):
+        """Write the session to file_path; the file is replaced atomically"""
+        temp_path = self.file_path + ".tmp"
+        with open(temp_path, "w") as session_file:
+            json.dump(self.session(), session_file)
+        os.replace(temp_path, self.file_path)
+        io_log.info("Session with %d events written to %s", len(self.events), self.file_path)
+        return self.file_path
+
+
+def load_session(file_path):
+    with open(file_path, "r") as session_file:
+        session = json.load(session_file)
+    if session.get("version") != SESSION_VERSION:
+        raise ValueError(f"Unsupported session version {session.get('version')} in {file_path}")
+    return session
+
+
+def session_image(session):
+    """The session's image, or a blank stand-in of the same size when the file is not available"""
+    image_path = session.get("image_path")
+    if image_path and os.path.exists(image_path):
+        image = QImage(image_path)
+        if not image.isNull():
+            return image
+    io_log.warning("Image %s not found, replaying over a blank image of the same size", image_path)
+    image = QImage(QSize(session["image_width"], session["image_height"]), QImage.Format_RGB32)
+    image.fill(QColor(128, 128, 128))
+    return image
+
+
+def set_mode(widget, mode, enabled):
+    # The viewer always abandons a drag before switching modes
+    widget.cancel_drag_operation()
+    if mode == "crop":
+        widget.set_crop_mode(enabled)
+    elif mode == "endpoints":
+        widget.set_drag_endpoints_mode(enabled)
+
+
+class ReplayResult:
+    """Outcome of a replay: whether the grid matched, plus per-event-type latencies in perf"""
+
+    def __init__(self, expected_digest, actual_digest, perf):
+        self.expected_digest = expected_digest
+        self.actual_digest = actual_digest
+        self.perf = perf
+
+    @property
+    def matches(self):
+        return self.expected_digest == self.actual_digest
+
+
+def replay_session(widget, session, app=None, scroll_area=None, image=None, realtime=False):
+    """Restore the session's starting state in widget, feed it the recorded events and time each one
+
+    With app given, pending events (repaints) are processed after every event and
+    count towards its latency. With realtime=True the recorded pacing is kept,
+    otherwise events are sent back to back.
+    """
+    widget.cancel_drag_operation()
+    set_mode(widget, "crop", False)
+    set_mode(widget, "endpoints", False)
+    widget.set_image_source(image if image is not None else session_image(session))
+    widget.grid_x_max = session["grid_x"]
+    widget.grid_y_max = session["grid_y"]
+    widget.set_grid_points(session["grid_points"])
+    widget.set_zoom(session["zoom_value"])
+    if session.get("mode"):
+        set_mode(widget, session["mode"], True)
+    if scroll_area is not None:
+        scroll_area.viewport().resize(session["viewport_width"], session["viewport_height"])
+    if app is not None:
+        app.processEvents()
+
+    events = session["events"]
+    perf = PerfStats(window=max(1, len(events)), trace_length=max(1, len(events)))
+    replay_started = time.perf_counter()
+    for event in events:
+        if realtime:
+            delay = event["t"] - (time.perf_counter() - replay_started)
+            if delay > 0:
+                time.sleep(delay)
+
+        event_type = event["type"]
+        if event_type == "press" and scroll_area is not None:
+            scroll_area.horizontalScrollBar().setValue(event.get("scroll_x", 0))
+            scroll_area.verticalScrollBar().setValue(event.get("scroll_y", 0))
+            if app is not None:
+                app.processEvents()
+
+        started = time.perf_counter()
+        if event_type in MOUSE_EVENT_TYPES:
+            mouse_event = QMouseEvent(MOUSE_EVENT_TYPES[event_type], QPointF(event["x"], event["y"]),
+                                      Qt.MouseButton(event["button"]), Qt.MouseButtons(event["buttons"]),
+                                      Qt.KeyboardModifiers(event["modifiers"]))
+            if event_type == "press":
+                widget.mousePressEvent(mouse_event)
+            elif event_type == "move":
+                widget.mouseMoveEvent(mouse_event)
+            else:
+                widget.mouseReleaseEvent(mouse_event)
+        elif event_type == "key":
+            widget.keyPressEvent(QKeyEvent(QEvent.KeyPress, event["key"], Qt.KeyboardModifiers(event["modifiers"])))
+        elif event_type == "zoom":
+            widget.set_zoom(event["zoom"], preview=event["preview"])
+        elif event_type == "mode":
+            set_mode(widget, event["mode"], event["enabled"])
+        elif event_type == "grid":
+            widget.set_grid(event["grid_x"], event["grid_y"])
+        elif event_type == "autofit":
+            widget.auto_fit_grid()
+        elif event_type == "undo":
+            widget.undo()
+        elif event_type == "redo":
+            widget.redo()
+        else:
+            raise ValueError(f"Unknown session event type '{event_type}'")
+        if app is not None:
+            app.processEvents()
+        perf.record(event_type, started)
+
+    widget.finish_zoom_preview()
+    return ReplayResult(session["final_grid_digest"], grid_digest(widget.grid_points), perf)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay recorded Puzzle Pieces Maker sessions headlessly.")
+    parser.add_argument("sessions", nargs="+", help="session files recorded with Ctrl+Shift+R or --record-session")
+    parser.add_argument("--realtime", action="store_true", help="keep the recorded pacing between events")
+    parser.add_argument("--trace", metavar="FILE", help="write the event latencies of the last session as a JSON trace")
+    parser.add_argument("--log", metavar="SPEC", help="log verbosity, as for puzzle_pieces_maker.py")
+    args = parser.parse_args()
+    try:
+        configure_logging(args.log)
+    except ValueError as e:
+        parser.error(str(e))
+
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    from PyQt5.QtWidgets import QApplication, QScrollArea
+    from puzzle_pieces_maker import ImageGridWidget
+
+    app = QApplication(sys.argv[:1])
+    scroll_area = QScrollArea()
+    scroll_area.setWidgetResizable(False)
+    scroll_area.setAlignment(Qt.AlignCenter)
+    widget = ImageGridWidget()
+    scroll_area.setWidget(widget)
+    scroll_area.show()
+
+    failures = 0
+    for session_path in args.sessions:
+        session = load_session(session_path)
+        result = replay_session(widget, session, app=app, scroll_area=scroll_area, realtime=args.realtime)
+        print(f"{session_path}: {len(session['events'])} events, "
+              f"grid {'matches' if result.matches else 'DOES NOT MATCH'}")
+        for event_type, stats in sorted(result.perf.summary().items()):
+            print(f"  {event_type:<8} n={stats['count']:<6} p50 {stats['p50_ms']:8.2f} ms  "
+                  f"p95 {stats['p95_ms']:8.2f} ms  p99 {stats['p99_ms']:8.2f} ms  max {stats['max_ms']:8.2f} ms")
+        if args.trace:
+            result.perf.export_trace(args.trace, {"session": session_path, "grid_matches": result.matches})
+        failures += not result.matches
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
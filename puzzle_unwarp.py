@@ -0,0 +1,239 @@
+"""Resample warped grid cells into axis-aligned rectangles
+
+After crop and endpoint dragging every cell of grid_points is an arbitrary
+quadrilateral, e.g. a puzzle photographed at an angle. This maps each cell
+onto a cell_width x cell_height rectangle, either with the cell's homography
+(straight lines stay straight, right for perspective) or with a bilinear map
+of its corners.
+
+The per-cell maps come from one closed-form, vectorised pass over all cells,
+and the pixels are sampled (bilinear interpolation) for whole rows of cells
+at a time with NumPy; there is no per-pixel Python.
+
+    python puzzle_unwarp.py DOCUMENT --output rectified.png [--cell-size 64x64] [--method bilinear]
+    python puzzle_unwarp.py DOCUMENT --tiles DIR
+
+Like the other command line tools this only uses QtGui, for reading and writing images.
+"""
+import os
+import sys
+import time
+import argparse
+import numpy as np
+from puzzle_log import io_log, configure_logging
+from puzzle_export import load_export_source, piece_file_name
+
+
+METHODS = ("homography", "bilinear")
+
+# Output pixels sampled per batch; bounds the size of the coordinate and gather arrays
+BATCH_PIXELS = 4 * 1024 * 1024
+
+
+def cell_corners(grid_points):
+    """(rows, cols, 4, 2) corners of every cell: top left, top right, bottom right, bottom left"""
+    return np.stack([grid_points[:-1, :-1], grid_points[:-1, 1:], grid_points[1:, 1:], grid_points[1:, :-1]], axis=2)
+
+
+def square_to_quad(corners):
+    """Homographies taking the unit square onto each quad, as (..., 3, 3) matrices
+
+    Closed form (Heckbert's square-to-quad mapping): (0,0), (1,0), (1,1), (0,1)
+    go to the four corners in order. Parallelograms give affine maps.
+    """
+    x0, x1, x2, x3 = (corners[..., index, 0] for index in range(4))
+    y0, y1, y2, y3 = (corners[..., index, 1] for index in range(4))
+    sum_x = x0 - x1 + x2 - x3
+    sum_y = y0 - y1 + y2 - y3
+    dx1, dx2 = x1 - x2, x3 - x2
+    dy1, dy2 = y1 - y2, y3 - y2
+    det = dx1 * dy2 - dx2 * dy1
+    # Degenerate (collapsed) quads get g = h = 0, which is the affine map of three of their corners
+    safe_det = np.where(det == 0, 1.0, det)
+    g = np.where(det == 0, 0.0, (sum_x * dy2 - dx2 * sum_y) / safe_det)
+    h = np.where(det == 0, 0.0, (dx1 * sum_y - sum_x * dy1) / safe_det)
+
+    matrices = np.empty(corners.shape[:-2] + (3, 3))
+    matrices[..., 0, 0] = x1 - x0 + g * x1
+    matrices[..., 0, 1] = x3 - x0 + h * x3
+    matrices[..., 0, 2] = x0
+    matrices[..., 1, 0] = y1 - y0 + g * y1
+    matrices[..., 1, 1] = y3 - y0 + h * y3
+    matrices[..., 1, 2] = y0
+    matrices[..., 2, 0] = g
+    matrices[..., 2, 1] = h
+    matrices[..., 2, 2] = 1.0
+    return matrices
+
+
+def source_coordinates(corners, matrices, cell_width, cell_height, method):
+    """Source image (x, y) of every output pixel centre, shape (rows, cols, cell_height, cell_width)"""
+    u = (np.arange(cell_width) + 0.5) / cell_width
+    v = (np.arange(cell_height) + 0.5) / cell_height
+    u, v = u[np.newaxis, :], v[:, np.newaxis]
+    if method == "homography":
+        m = matrices[..., np.newaxis, np.newaxis, :, :]
+        w = m[..., 2, 0] * u + m[..., 2, 1] * v + m[..., 2, 2]
+        xs = (m[..., 0, 0] * u + m[..., 0, 1] * v + m[..., 0, 2]) / w
+        ys = (m[..., 1, 0] * u + m[..., 1, 1] * v + m[..., 1, 2]) / w
+        return xs, ys
+    c = corners[..., np.newaxis, np.newaxis, :, :]
+    weights = ((1 - u) * (1 - v), u * (1 - v), u * v, (1 - u) * v)
+    xs = sum(weight * c[..., index, 0] for index, weight in enumerate(weights))
+    ys = sum(weight * c[..., index, 1] for index, weight in enumerate(weights))
+    return xs, ys
+
+
+def sample_bilinear(pixels, xs, ys):
+    """Bilinear samples of an (height, width, 4) uint8 image at continuous image coordinates
+
+    Coordinate (x, y) is a position in the image plane, so pixel (i, j) covers
+    [i, i+1) x [j, j+1) and its centre is at (i + 0.5, j + 0.5). Samples outside
+    the image repeat the edge pixels.
+    """
+    height, width = pixels.shape[:2]
+    xs = np.clip(xs - 0.5, 0, width - 1).astype(np.float32)
+    ys = np.clip(ys - 0.5, 0, height - 1).astype(np.float32)
+    left = np.minimum(xs.astype(np.intp), max(width - 2, 0))
+    top = np.minimum(ys.astype(np.intp), max(height - 2, 0))
+    fx = (xs - left)[..., np.newaxis]
+    fy = (ys - top)[..., np.newaxis]
+
+    # Gather whole pixels as 32-bit words from the flattened image, then blend the bytes
+    words = np.ascontiguousarray(pixels).view(np.uint32).reshape(-1)
+    index = top * width + left
+    step_x = 1 if width > 1 else 0
+    step_y = width if height > 1 else 0
+
+    def gather(offset):
+        return words.take(index + offset).view(np.uint8).reshape(xs.shape + (4,))
+
+    upper = gather(0) * (1 - fx) + gather(step_x) * fx
+    lower = gather(step_y) * (1 - fx) + gather(step_y + step_x) * fx
+    return (upper * (1 - fy) + lower * fy + 0.5).astype(np.uint8)
+
+
+def unwarp_rows(pixels, grid_points, cell_width, cell_height, method="homography"):
+    """Yield (first_row, cells) with cells of shape (rows, cols, cell_height, cell_width, channels)
+
+    The maps of all cells are computed up front; the pixels are then sampled a
+    batch of grid rows at a time, so memory stays bounded for large grids.
+    """
+    if method not in METHODS:
+        raise ValueError(f"Unknown unwarp method '{method}', expected one of: {', '.join(METHODS)}")
+    corners = cell_corners(grid_points)
+    matrices = square_to_quad(corners) if method == "homography" else None
+    rows, cols = corners.shape[:2]
+    batch_rows = max(1, BATCH_PIXELS // max(1, cols * cell_width * cell_height))
+    for first_row in range(0, rows, batch_rows):
+        batch = slice(first_row, min(rows, first_row + batch_rows))
+        xs, ys = source_coordinates(corners[batch], matrices[batch] if matrices is not None else None,
+                                    cell_width, cell_height, method)
+        yield first_row, sample_bilinear(pixels, xs, ys)
+
+
+def rectify_image(pixels, grid_points, cell_width, cell_height, method="homography"):
+    """The whole grid unwarped into one (rows * cell_height, cols * cell_width) image"""
+    rows, cols = grid_points.shape[0] - 1, grid_points.shape[1] - 1
+    output = np.empty((rows * cell_height, cols * cell_width, pixels.shape[2]), dtype=np.uint8)
+    for first_row, cells in unwarp_rows(pixels, grid_points, cell_width, cell_height, method):
+        # (rows, cols, height, width, channels) -> rows of cells side by side
+        band = cells.transpose(0, 2, 1, 3, 4).reshape(-1, cols * cell_width, pixels.shape[2])
+        output[first_row * cell_height:first_row * cell_height + band.shape[0]] = band
+    return output
+
+
+def default_cell_size(grid_points):
+    """Median cell width and height of the grid, in whole pixels"""
+    widths = np.diff(grid_points[:, :, 0], axis=1)
+    heights = np.diff(grid_points[:, :, 1], axis=0)
+    return max(1, int(round(float(np.median(widths))))), max(1, int(round(float(np.median(heights)))))
+
+
+def image_to_array(image):
+    """Copy of a QImage as an (height, width, 4) uint8 array in QImage.Format_ARGB32 byte order"""
+    from PyQt5.QtGui import QImage
+
+    image = image.convertToFormat(QImage.Format_ARGB32)
+    bits = image.constBits()
+    bits.setsize(image.bytesPerLine() * image.height())
+    rows = np.frombuffer(bits, dtype=np.uint8).reshape(image.height(), image.bytesPerLine())
+    return rows[:, :image.width() * 4].reshape(image.height(), image.width(), 4).copy()
+
+
+def array_to_image(pixels):
+    """QImage (owning a copy of the pixels) of an (height, width, 4) Format_ARGB32 array"""
+    from PyQt5.QtGui import QImage
+
+    pixels = np.ascontiguousarray(pixels)
+    height, width = pixels.shape[:2]
+    return QImage(pixels.data, width, height, width * 4, QImage.Format_ARGB32).copy()
+
+
+def parse_cell_size(value):
+    try:
+        width, height = (int(part) for part in value.lower().split("x"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"cell size must look like 64x48, not '{value}'")
+    if width < 1 or height < 1:
+        raise argparse.ArgumentTypeError("cell size must be positive")
+    return width, height
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Unwarp the cells of a puzzle document into rectangles.")
+    parser.add_argument("document", help="puzzle document (.puz.json)")
+    parser.add_argument("--output", "-o", help="write the rectified image here")
+    parser.add_argument("--tiles", metavar="DIR", help="write one rectified PNG per cell into DIR")
+    parser.add_argument("--cell-size", type=parse_cell_size,
+                        help="output size of each cell, WIDTHxHEIGHT (default: the grid's median cell size)")
+    parser.add_argument("--method", choices=METHODS, default="homography",
+                        help="per-cell perspective (default) or bilinear corner map")
+    parser.add_argument("--log", metavar="SPEC", help="log verbosity, as for puzzle_pieces_maker.py")
+    args = parser.parse_args()
+    try:
+        configure_logging(args.log)
+    except ValueError as e:
+        parser.error(str(e))
+    if not args.output and not args.tiles:
+        parser.error("give --output, --tiles or both")
+
+    from PyQt5.QtGui import QImage
+
+    try:
+        image_path, _image_size, grid_points = load_export_source(args.document)
+    except (OSError, ValueError) as e:
+        parser.exit(1, f"{args.document}: {e}\n")
+    started = time.perf_counter()
+    image = QImage(image_path)
+    if image.isNull():
+        parser.exit(1, f"Could not read {image_path}\n")
+    pixels = image_to_array(image)
+    cell_width, cell_height = args.cell_size or default_cell_size(grid_points)
+    io_log.info("Decoded %s in %.0f ms; cells %dx%d", image_path, (time.perf_counter() - started) * 1000,
+                cell_width, cell_height)
+
+    started = time.perf_counter()
+    if args.output:
+        rectified = rectify_image(pixels, grid_points, cell_width, cell_height, args.method)
+        io_log.info("Rectified in %.0f ms", (time.perf_counter() - started) * 1000)
+        if not array_to_image(rectified).save(args.output):
+            parser.exit(1, f"Could not write {args.output}\n")
+        print(f"{args.output}: {rectified.shape[1]}x{rectified.shape[0]}")
+    if args.tiles:
+        os.makedirs(args.tiles, exist_ok=True)
+        digits = len(str(max(grid_points.shape[:2])))
+        count = 0
+        for first_row, cells in unwarp_rows(pixels, grid_points, cell_width, cell_height, args.method):
+            for row_offset, row_cells in enumerate(cells):
+                for col, cell in enumerate(row_cells):
+                    file_path = os.path.join(args.tiles, piece_file_name(first_row + row_offset, col, digits))
+                    if not array_to_image(cell).save(file_path):
+                        parser.exit(1, f"Could not write {file_path}\n")
+                    count += 1
+        print(f"{args.tiles}: {count} tiles of {cell_width}x{cell_height}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,201 @@
+import tracemalloc
+
+import numpy as np
+import pytest
+from PyQt5.QtCore import Qt, QEvent, QPoint, QRectF
+from PyQt5.QtGui import QImage, QMouseEvent
+
+import puzzle_pieces_maker as puzzle
+
+
+WARM_UP_MOVES = 200
+MEASURED_MOVES = 2000
+
+
+def mouse_event(event_type, pos, buttons=Qt.LeftButton):
+    button = Qt.NoButton if event_type == QEvent.MouseMove else Qt.LeftButton
+    return QMouseEvent(event_type, pos, button, buttons, Qt.NoModifier)
+
+
+def warped_grid(rows, cols, seed=0):
+    rng = np.random.default_rng(seed)
+    ys, xs = np.meshgrid(np.linspace(0, 600, rows), np.linspace(0, 800, cols), indexing="ij")
+    return np.stack([xs, ys], axis=-1) + rng.normal(0, 5, (rows, cols, 2))
+
+
+@pytest.fixture
+def widget(qt_app):
+    widget = puzzle.ImageGridWidget()
+    image = QImage(800, 600, QImage.Format_RGB32)
+    image.fill(Qt.white)
+    widget.set_image_and_grid(image, 100, 100)
+    widget.show()
+    qt_app.processEvents()
+    yield widget
+    widget.close()
+
+
+def handle_position(widget, row, col):
+    handles = widget.get_drag_handles()
+    index = np.flatnonzero((handles.rows == row) & (handles.cols == col))[0]
+    return QPoint(*(int(value) for value in handles.positions[index]))
+
+
+@pytest.mark.parametrize("mode, row, col", [("crop", 0, 0), ("crop", 50, 100), ("endpoints", 50, 50)])
+def test_drag_moves_allocate_nothing_after_warm_up(widget, mode, row, col):
+    if mode == "crop":
+        widget.set_crop_mode(True)
+    else:
+        widget.set_drag_endpoints_mode(True)
+    # Timing samples go into bounded deques, which fill up by design
+    widget.perf.enabled = False
+    position = handle_position(widget, row, col)
+    widget.mousePressEvent(mouse_event(QEvent.MouseButtonPress, position))
+    assert widget.is_dragging
+    events = [mouse_event(QEvent.MouseMove, position + QPoint(step % 3, step % 2))
+              for step in range(WARM_UP_MOVES + MEASURED_MOVES)]
+    # Warming up under tracemalloc too, so state replaced by every move (the last mouse position, the
+    # dirty rect, NumPy's small-array caches) was already allocated while tracing
+    tracemalloc.start()
+    try:
+        for event in events[:WARM_UP_MOVES]:
+            widget.mouseMoveEvent(event)
+        before = tracemalloc.take_snapshot()
+        for event in events[WARM_UP_MOVES:]:
+            widget.mouseMoveEvent(event)
+        after = tracemalloc.take_snapshot()
+    finally:
+        tracemalloc.stop()
+    # Not counting the snapshots and this test's own bookkeeping
+    ignored = [tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, __file__)]
+    growth = sum(stat.size_diff for stat in after.filter_traces(ignored).compare_to(before.filter_traces(ignored),
+                                                                                      "filename"))
+    widget.mouseReleaseEvent(mouse_event(QEvent.MouseButtonRelease, position, Qt.NoButton))
+    # A move that kept even one object would add at least 16 bytes per move; what is left below one
+    # byte per move is the interpreter's float and wrapper freelists settling, independent of the count
+    assert growth < MEASURED_MOVES, f"{MEASURED_MOVES} {mode} drag moves kept {growth} bytes allocated"
+
+
+@pytest.mark.parametrize("moves_x, moves_y, edges", [
+    (True, False, (True, False, False, False)),
+    (False, True, (False, False, False, True)),
+    (True, True, (False, True, True, False)),
+])
+def test_overlay_bounds_match_working_grid(moves_x, moves_y, edges):
+    overlay = puzzle.DragOverlay()
+    overlay.begin(warped_grid(13, 17), moves_x, moves_y)
+    for delta_x, delta_y in ((25.0, -10.0), (-400.0, 300.0), (3.5, 0.25)):
+        overlay.move(delta_x, delta_y, *edges)
+        points = overlay.place_interior()
+        xs, ys = points[..., 0], points[..., 1]
+        np.testing.assert_allclose(overlay.bounds(), (xs.min(), ys.min(), xs.max(), ys.max()), atol=1e-9)
+
+
+def eager_drag(grid, moves_x, moves_y, moves):
+    """The working grid of a drag, re-placing every interior point on every move"""
+    points = grid.copy()
+    relative = []
+    for axis in (0, 1):
+        first, last, interior = puzzle.DragOverlay.edge_views(points, axis)
+        span = last - first
+        relative.append(np.where(span != 0, (interior - first) / np.where(span != 0, span, 1), 0.0))
+    for delta_x, delta_y, left, right, top, bottom in moves:
+        points[:, 0, 0] += delta_x * left
+        points[:, -1, 0] += delta_x * right
+        points[0, :, 1] += delta_y * top
+        points[-1, :, 1] += delta_y * bottom
+        for axis, moves_axis in ((0, moves_x), (1, moves_y)):
+            if moves_axis:
+                first, last, interior = puzzle.DragOverlay.edge_views(points, axis)
+                interior[...] = relative[axis] * (last - first) + first
+    return points
+
+
+@pytest.mark.parametrize("moves_x, moves_y, edges", [
+    (True, False, (False, True, False, False)),
+    (False, True, (False, False, True, False)),
+    (True, True, (True, False, False, True)),
+])
+def test_moves_only_touch_the_perimeter(moves_x, moves_y, edges):
+    grid = warped_grid(40, 30, seed=2)
+    overlay = puzzle.DragOverlay()
+    overlay.begin(grid, moves_x, moves_y)
+    moves = [(12.0, -7.5, *edges), (-3.25, 40.0, *edges), (0.5, 0.5, *edges)]
+    for move in moves:
+        overlay.move(*move)
+    expected = eager_drag(grid, moves_x, moves_y, moves)
+
+    # The interior is left as it was until it is placed; the perimeter, where the handles are, is current
+    np.testing.assert_array_equal(overlay.points[1:-1, 1:-1], grid[1:-1, 1:-1])
+    for edge in (np.s_[0, :], np.s_[-1, :], np.s_[:, 0], np.s_[:, -1]):
+        np.testing.assert_array_equal(overlay.points[edge], expected[edge])
+    np.testing.assert_array_equal(overlay.place_interior(), expected)
+
+
+@pytest.mark.parametrize("moves_x, moves_y, edges", [
+    (True, False, (True, False, False, False)),
+    (False, True, (False, False, False, True)),
+    (True, True, (False, True, True, False)),
+])
+def test_visible_polylines_place_the_drawn_points(moves_x, moves_y, edges):
+    grid = warped_grid(60, 80, seed=3)
+    overlay = puzzle.DragOverlay()
+    overlay.begin(grid, moves_x, moves_y)
+    overlay.move(-60.0, 45.0, *edges)
+    overlay.move(15.5, -5.0, *edges)
+    expected = eager_drag(grid, moves_x, moves_y, [(-60.0, 45.0, *edges), (15.5, -5.0, *edges)])
+    exact = puzzle.GridLineIndex(expected)
+
+    for rect, steps in ((QRectF(100, 80, 200, 150), (1, 1)), (QRectF(-50, -50, 1000, 800), (4, 2)),
+                        (QRectF(700, 0, 50, 50), (1, 1))):
+        polylines = overlay.visible_polylines(rect, *steps)
+        # Line bounds hold the working grid's lines: exact along the drag, possibly wider across it
+        assert (overlay.row_bounds[:, :2] <= exact.row_bounds[:, :2] + 1e-9).all()
+        assert (overlay.row_bounds[:, 2:] >= exact.row_bounds[:, 2:] - 1e-9).all()
+        assert (overlay.col_bounds[:, :2] <= exact.col_bounds[:, :2] + 1e-9).all()
+        assert (overlay.col_bounds[:, 2:] >= exact.col_bounds[:, 2:] - 1e-9).all()
+        # Every line the committed index would draw is drawn, with the same points
+        wanted = puzzle.GridLineIndex.lines_crossing(exact.row_bounds, exact.col_bounds, rect, *steps)
+        drawn = puzzle.GridLineIndex.lines_crossing(overlay.row_bounds, overlay.col_bounds, rect, *steps)
+        assert set(wanted[0]) <= set(drawn[0]) and set(wanted[2]) <= set(drawn[2])
+        rows, col_span, cols, row_span = drawn
+        expected_polylines = [expected[row, col_span] for row in rows] + [expected[row_span, col] for col in cols]
+        assert len(polylines) == len(expected_polylines)
+        for polyline, expected_polyline in zip(polylines, expected_polylines):
+            np.testing.assert_array_equal(polyline, expected_polyline)
+
+
+def test_overlay_merge_and_discard():
+    grid = warped_grid(6, 9)
+    committed = grid.copy()
+    overlay = puzzle.DragOverlay()
+
+    overlay.begin(grid, True, False)
+    overlay.move(30.0, 0.0, True, False, False, False)
+    overlay.discard()
+    np.testing.assert_array_equal(grid, committed)
+
+    overlay.begin(grid, True, False)
+    overlay.move(30.0, 0.0, True, False, False, False)
+    working = overlay.place_interior().copy()
+    overlay.merge(grid)
+    np.testing.assert_array_equal(grid, working)
+    np.testing.assert_array_equal(grid[..., 1], committed[..., 1])
+    np.testing.assert_array_equal(grid[:, -1], committed[:, -1])
+
+
+def test_crop_drag_commits_the_working_grid(widget, qt_app):
+    widget.set_crop_mode(True)
+    committed = widget.grid_points.copy()
+    position = handle_position(widget, 100, 100)
+    widget.mousePressEvent(mouse_event(QEvent.MouseButtonPress, position))
+    for offset in (QPoint(-10, -4), QPoint(-25, -30)):
+        widget.mouseMoveEvent(mouse_event(QEvent.MouseMove, position + offset))
+        widget.repaint()
+    widget.mouseReleaseEvent(mouse_event(QEvent.MouseButtonRelease, position + QPoint(-25, -30), Qt.NoButton))
+
+    zoom = widget.zoom_factor
+    moves = [(-10 / zoom, -4 / zoom, False, True, False, True), (-15 / zoom, -26 / zoom, False, True, False, True)]
+    np.testing.assert_array_equal(widget.grid_points, eager_drag(committed, True, True, moves))
+    widget.undo()
+    np.testing.assert_array_equal(widget.grid_points, committed)
@@ -0,0 +1,117 @@
+import os
+import json
+
+import numpy as np
+import pytest
+from PyQt5.QtGui import QImage
+
+import puzzle_atlas as atlas
+from puzzle_document import write_document, make_document, uniform_grid_points
+from test_puzzle_export import write_gradient
+
+
+def overlaps(first, second):
+    """Whether two (x, y, width, height) rectangles share a pixel"""
+    return (first[0] < second[0] + second[2] and second[0] < first[0] + first[2]
+            and first[1] < second[1] + second[3] and second[1] < first[1] + first[3])
+
+
+def random_sizes(count, seed=0, largest=90):
+    rng = np.random.default_rng(seed)
+    return [(int(width), int(height)) for width, height in rng.integers(1, largest, (count, 2))]
+
+
+def test_max_rects_places_without_overlap():
+    packer = atlas.MaxRectsPacker(256, 256)
+    placed = []
+    for width, height in random_sizes(200):
+        position = packer.insert(width, height)
+        if position is None:
+            continue
+        rect = (*position, width, height)
+        assert rect[0] >= 0 and rect[1] >= 0 and rect[0] + width <= 256 and rect[1] + height <= 256
+        assert not any(overlaps(rect, other) for other in placed)
+        placed.append(rect)
+    assert len(placed) > 10
+    assert packer.used_width == max(x + width for x, _, width, _ in placed)
+    assert packer.used_height == max(y + height for _, y, _, height in placed)
+    # The free rectangles are free: none of them overlaps a placed one
+    for left, top, right, bottom in packer.free_rects.tolist():
+        assert not any(overlaps((left, top, right - left, bottom - top), rect) for rect in placed)
+
+
+def test_max_rects_fills_exactly():
+    packer = atlas.MaxRectsPacker(64, 64)
+    positions = {packer.insert(32, 32) for _ in range(4)}
+    assert positions == {(0, 0), (32, 0), (0, 32), (32, 32)}
+    assert packer.insert(1, 1) is None
+    assert len(packer.free_rects) == 0
+
+
+@pytest.mark.parametrize("padding", [0, 2])
+def test_pack_rectangles_over_several_pages(padding):
+    sizes = random_sizes(300, seed=1)
+    placements, pages = atlas.pack_rectangles(sizes, 256, padding)
+    assert len(placements) == len(sizes)
+    assert len(pages) > 1
+    for page, packer in enumerate(pages):
+        rects = [(x, y, width + padding, height + padding)
+                 for (placed_page, x, y), (width, height) in zip(placements, sizes) if placed_page == page]
+        assert rects
+        for index, rect in enumerate(rects):
+            assert rect[0] + rect[2] <= packer.used_width <= 256
+            assert rect[1] + rect[3] <= packer.used_height <= 256
+            assert not any(overlaps(rect, other) for other in rects[index + 1:])
+    # The last page is repacked into a smaller square than a full page
+    assert max(pages[-1].used_width, pages[-1].used_height) < 256
+
+
+def test_pack_rectangles_rejects_oversized_pieces():
+    with pytest.raises(ValueError):
+        atlas.pack_rectangles([(10, 10), (255, 20)], 256, 2)
+
+
+def test_pack_nothing():
+    assert atlas.pack_rectangles([], 256, 2) == ([], [])
+
+
+def document_with_grid(tmp_path, grid_points):
+    image_path = write_gradient(tmp_path / "image.png")
+    document_path = str(tmp_path / "image.puz.json")
+    rows, cols = grid_points.shape[:2]
+    write_document(document_path, make_document(image_path, cols - 1, rows - 1, grid_points))
+    return document_path
+
+
+def test_export_atlas(tmp_path):
+    document_path = document_with_grid(tmp_path, uniform_grid_points(120, 90, 4, 3))
+    output_dir = str(tmp_path / "atlases")
+    index_path, count, pages = atlas.export_atlas(document_path, output_dir, workers=1, atlas_size=256, padding=2)
+    assert (count, pages) == (12, 1)
+    with open(index_path) as index_file:
+        index = json.load(index_file)
+    assert index["fields"] == atlas.INDEX_FIELDS
+    assert index["atlases"] == [{"file": "image_atlas0.png", "width": index["atlases"][0]["width"],
+                                 "height": index["atlases"][0]["height"]}]
+    source = QImage(str(tmp_path / "image.png"))
+    image = QImage(os.path.join(output_dir, "image_atlas0.png"))
+    for piece in index["pieces"]:
+        row, col, page, x, y, width, height, source_x, source_y, quad = piece
+        assert (width, height, source_x, source_y) == (30, 30, col * 30, row * 30)
+        assert quad == [col * 30, row * 30, col * 30 + 30, row * 30, col * 30 + 30, row * 30 + 30,
+                        col * 30, row * 30 + 30]
+        # The piece's pixels sit in its atlas rectangle
+        for dx, dy in ((0, 0), (29, 29), (11, 23)):
+            assert image.pixel(x + dx, y + dy) == source.pixel(source_x + dx, source_y + dy)
+
+
+def test_export_atlas_of_a_grid_off_the_image(tmp_path):
+    grid_points = uniform_grid_points(100, 90, 2, 2) + (200, 0)
+    document_path = document_with_grid(tmp_path, grid_points)
+    output_dir = str(tmp_path / "atlases")
+    index_path, count, pages = atlas.export_atlas(document_path, output_dir, workers=1)
+    assert (count, pages) == (0, 0)
+    with open(index_path) as index_file:
+        index = json.load(index_file)
+    assert (index["atlases"], index["pieces"]) == ([], [])
+    assert os.listdir(output_dir) == ["image_atlas.json"]
@@ -0,0 +1,62 @@
+import numpy as np
+import pytest
+from PyQt5.QtGui import QImage
+
+import puzzle_autofit as autofit
+
+
+def lattice_image(width, height, xs, ys, seed=0):
+    """Grayscale image of cells with random brightness between the given seam positions, on a flat background"""
+    rng = np.random.default_rng(seed)
+    gray = np.full((height, width), 128, dtype=np.uint8)
+    xs, ys = np.rint(xs).astype(int), np.rint(ys).astype(int)
+    for row in range(len(ys) - 1):
+        for col in range(len(xs) - 1):
+            gray[ys[row]:ys[row + 1], xs[col]:xs[col + 1]] = rng.integers(20, 236)
+    return gray
+
+
+def test_fit_lattice_recovers_pitch_and_offset():
+    profile = np.zeros(500, dtype=np.float32)
+    offset, step, cells = 37.0, 23.5, 12
+    for line in offset + np.arange(cells + 1) * step:
+        profile[int(line)] += 1 - (line - int(line))
+        profile[int(line) + 1] += line - int(line)
+    profile += np.random.default_rng(2).uniform(0, 0.05, profile.shape).astype(np.float32)
+    fitted_offset, fitted_step = autofit.fit_lattice(profile, cells)
+    assert fitted_offset == pytest.approx(offset, abs=1)
+    assert fitted_step * cells == pytest.approx(step * cells, abs=1)
+
+
+@pytest.mark.parametrize("width, height, grid_x, grid_y", [(800, 600, 8, 6), (3000, 2200, 20, 15)])
+def test_fit_grid_recovers_a_synthetic_lattice(width, height, grid_x, grid_y):
+    pitch_x, pitch_y = width * 0.8 / grid_x + 0.37, height * 0.75 / grid_y - 0.21
+    xs = width * 0.07 + np.arange(grid_x + 1) * pitch_x
+    ys = height * 0.11 + np.arange(grid_y + 1) * pitch_y
+    gray = lattice_image(width, height, xs, ys)
+
+    grid_points = autofit.fit_grid(gray, grid_x, grid_y)
+    assert grid_points.shape == (grid_y + 1, grid_x + 1, 2)
+    # Straight, axis-aligned lines on the seams (drawn at whole pixels), within a pixel
+    np.testing.assert_allclose(grid_points[0, :, 0], np.rint(xs), atol=1)
+    np.testing.assert_allclose(grid_points[:, 0, 1], np.rint(ys), atol=1)
+    assert (grid_points[..., 0] == grid_points[0, :, 0]).all()
+    assert (grid_points[..., 1] == grid_points[:, :1, 1]).all()
+
+
+def test_fit_grid_to_a_qimage():
+    xs = 30 + np.arange(5) * 50.0
+    ys = 20 + np.arange(4) * 40.0
+    gray = lattice_image(300, 200, xs, ys, seed=1)
+    image = QImage(gray.tobytes(), 300, 200, 300, QImage.Format_Grayscale8).copy()
+    np.testing.assert_array_equal(autofit.grayscale_array(image), gray)
+    grid_points = autofit.fit_grid_to_image(image, 4, 3)
+    np.testing.assert_allclose(grid_points[0, :, 0], xs, atol=1)
+    np.testing.assert_allclose(grid_points[:, 0, 1], ys, atol=1)
+
+
+def test_reduce_image_averages_blocks():
+    gray = np.arange(6 * 7, dtype=np.uint8).reshape(6, 7)
+    reduced = autofit.reduce_image(gray, 3)
+    assert reduced.shape == (2, 2)
+    assert reduced[1, 1] == gray[3:6, 3:6].mean()
@@ -0,0 +1,183 @@
+import os
+
+import numpy as np
+import pytest
+from PyQt5.QtCore import Qt
+from PyQt5.QtGui import QImage
+
+import puzzle_autosave as autosave
+from puzzle_document import uniform_grid_points
+
+
+def edit(grid_points, row, col, delta):
+    grid_points = grid_points.copy()
+    grid_points[row, col] += delta
+    return grid_points
+
+
+@pytest.fixture
+def document_path(tmp_path):
+    return str(tmp_path / "image.puz.json")
+
+
+def journal(document_path, saved):
+    edit_journal = autosave.EditJournal(autosave.journal_path_for(document_path))
+    edit_journal.start(saved)
+    return edit_journal
+
+
+def test_paths(document_path, tmp_path):
+    assert autosave.journal_path_for(document_path) == str(tmp_path / "image.puzjournal")
+    assert autosave.recovery_path_for(document_path) == str(tmp_path / "image.puzrecovery")
+    # A never-saved image keeps its recovery data next to the image
+    assert autosave.journal_path_for("photos/img001.jpg") == "photos/img001.jpg.puzjournal"
+
+
+def test_recovery_replays_the_journal(document_path):
+    saved = uniform_grid_points(400, 300, 8, 6)
+    assert autosave.read_recovery(document_path, saved) == (None, 0)
+
+    edit_journal = journal(document_path, saved)
+    # Nothing is written until the first edit
+    assert edit_journal.record(saved) == 0
+    assert not os.path.exists(autosave.journal_path_for(document_path))
+    grid_points = edit(saved, 2, 3, (12.5, -4.0))
+    assert edit_journal.record(grid_points) == 1
+    grid_points = edit(grid_points, 0, 0, (3.0, 3.0))
+    grid_points = edit(grid_points, 6, 8, (-0.0, np.nan))
+    assert edit_journal.record(grid_points) == 2
+    edit_journal.close()
+
+    recovered, edits = autosave.read_recovery(document_path, saved)
+    assert edits == 2
+    np.testing.assert_array_equal(recovered.view(np.uint64), grid_points.view(np.uint64))
+
+
+def test_large_edits_are_left_to_a_snapshot(document_path):
+    saved = uniform_grid_points(400, 300, 8, 6)
+    edit_journal = journal(document_path, saved)
+    assert edit_journal.record(saved + 1) is None
+    assert edit_journal.record(uniform_grid_points(400, 300, 4, 4)) is None
+
+
+def test_snapshot_base(document_path):
+    saved = uniform_grid_points(400, 300, 8, 6)
+    snapshot = uniform_grid_points(400, 300, 4, 3) + 0.5
+    autosave.write_grid_file(autosave.recovery_path_for(document_path), snapshot)
+    edit_journal = autosave.EditJournal(autosave.journal_path_for(document_path))
+    edit_journal.start(snapshot, "snapshot", autosave.grid_checksum(saved), edits=3)
+    grid_points = edit(snapshot, 1, 1, (5.0, 0.0))
+    edit_journal.record(grid_points)
+    edit_journal.close()
+
+    recovered, edits = autosave.read_recovery(document_path, saved)
+    assert edits == 4
+    np.testing.assert_array_equal(recovered, grid_points)
+
+    # A snapshot that doesn't match the journal is not used
+    autosave.write_grid_file(autosave.recovery_path_for(document_path), snapshot + 1)
+    assert autosave.read_recovery(document_path, saved) == (None, 0)
+
+
+@pytest.mark.parametrize("damage", ["torn", "corrupt", "garbage"])
+def test_damaged_last_record_is_ignored(document_path, damage):
+    saved = uniform_grid_points(400, 300, 8, 6)
+    edit_journal = journal(document_path, saved)
+    first = edit(saved, 2, 3, (12.5, -4.0))
+    edit_journal.record(first)
+    edit_journal.record(edit(first, 4, 4, (7.0, 7.0)))
+    edit_journal.close()
+
+    journal_path = autosave.journal_path_for(document_path)
+    with open(journal_path, "rb") as journal_file:
+        content = journal_file.read()
+    if damage == "torn":
+        content = content[:-5]
+    elif damage == "corrupt":
+        content = content[:-1] + bytes([content[-1] ^ 0xFF])
+    else:
+        content += b"\x01\x00\x00\x00"
+    with open(journal_path, "wb") as journal_file:
+        journal_file.write(content)
+
+    recovered, edits = autosave.read_recovery(document_path, saved)
+    if damage == "garbage":
+        # The records before the garbage are complete
+        assert edits == 2
+    else:
+        assert edits == 1
+        np.testing.assert_array_equal(recovered, first)
+
+
+def test_journal_of_another_saved_grid_is_rejected(document_path):
+    saved = uniform_grid_points(400, 300, 8, 6)
+    edit_journal = journal(document_path, saved)
+    edit_journal.record(edit(saved, 2, 3, (12.5, -4.0)))
+    edit_journal.close()
+
+    # The document was saved again (by another copy of the viewer, say) after the journal was started
+    assert autosave.read_recovery(document_path, edit(saved, 0, 1, (1.0, 0.0))) == (None, 0)
+    assert autosave.read_recovery(document_path, uniform_grid_points(400, 300, 4, 3)) == (None, 0)
+
+    with open(autosave.journal_path_for(document_path), "wb") as journal_file:
+        journal_file.write(b"not a journal")
+    assert autosave.read_recovery(document_path, saved) == (None, 0)
+
+
+def test_autosave_attach_and_discard(qt_app, document_path):
+    saved = uniform_grid_points(400, 300, 8, 6)
+    current = {"grid": saved.copy()}
+    saver = autosave.Autosave(lambda: current["grid"])
+    saver.attach(document_path, saved)
+    current["grid"] = edit(saved, 2, 3, (12.5, -4.0))
+    saver.grid_edited(current["grid"])
+    # A crop drag moves most of the grid, and goes to a snapshot on the worker thread
+    current["grid"] = current["grid"] + 3
+    saver.grid_edited(current["grid"])
+    saver.wait()
+    assert os.path.exists(autosave.recovery_path_for(document_path))
+    recovered, edits = autosave.read_recovery(document_path, saved)
+    assert edits == 2
+    np.testing.assert_array_equal(recovered, current["grid"])
+
+    saver.discard()
+    assert not os.path.exists(autosave.journal_path_for(document_path))
+    assert not os.path.exists(autosave.recovery_path_for(document_path))
+
+
+def test_never_saved_image_is_recovered(qt_app, tmp_path):
+    import puzzle_pieces_maker as puzzle
+
+    image_path = str(tmp_path / "photo.png")
+    image = QImage(400, 300, QImage.Format_RGB32)
+    image.fill(Qt.white)
+    assert image.save(image_path)
+
+    viewer = puzzle.PuzzleGridViewer()
+    assert viewer.open_image_from_path(image_path, (8, 6))
+    viewer.image_loader.wait()
+    qt_app.processEvents()
+    widget = viewer.image_widget
+    widget.grid_points[2, 3] += (10.0, 5.0)
+    widget.grid_edited.emit()
+    viewer.autosave.wait()
+    edited = widget.grid_points.copy()
+    assert os.path.exists(str(tmp_path / "photo.png.puzjournal"))
+
+    # The viewer crashed: nothing was discarded, and opening the image again finds the edits
+    viewer.autosave.journal.close()
+    viewer.autosave.journal = None
+    viewer.close()
+    viewer = puzzle.PuzzleGridViewer()
+    assert viewer.open_image_from_path(image_path, recover=True)
+    viewer.image_loader.wait()
+    qt_app.processEvents()
+    assert (viewer.image_widget.grid_x_max, viewer.image_widget.grid_y_max) == (8, 6)
+    np.testing.assert_array_equal(viewer.image_widget.grid_points, edited)
+
+    # Saving moves the recovery data over to the document
+    document_path = str(tmp_path / "photo.puz.json")
+    viewer._save_document_to_file(document_path)
+    assert sorted(name for name in os.listdir(tmp_path) if "puzjournal" in name or "puzrecovery" in name) == []
+    viewer.autosave.discard()
+    viewer.close()
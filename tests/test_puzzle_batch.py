@@ -0,0 +1,130 @@
+import os
+import sys
+import json
+import argparse
+
+import numpy as np
+import pytest
+from PyQt5.QtCore import Qt
+from PyQt5.QtGui import QImage
+
+import puzzle_batch
+from puzzle_document import read_document, write_document, make_document, uniform_grid_points
+
+
+def write_png(path, width=200, height=150):
+    image = QImage(width, height, QImage.Format_RGB32)
+    image.fill(Qt.darkCyan)
+    assert image.save(str(path))
+    return str(path)
+
+
+def run_main(monkeypatch, *arguments):
+    monkeypatch.setattr(sys, "argv", ["puzzle_batch.py", *arguments, "--workers", "1"])
+    return puzzle_batch.main()
+
+
+@pytest.fixture
+def images(tmp_path):
+    return [write_png(tmp_path / "first.png"), write_png(tmp_path / "second.png", 300, 100)]
+
+
+def test_create_validate_and_stats(tmp_path, images, monkeypatch, capsys):
+    assert run_main(monkeypatch, "create", str(tmp_path), "--grid", "4x2") == 0
+    assert "2 created, 0 skipped" in capsys.readouterr().out
+    document = read_document(str(tmp_path / "first.puz.json"))
+    assert (document["grid_x"], document["grid_y"]) == (4, 2)
+    np.testing.assert_array_equal(document["grid_points"], uniform_grid_points(200, 150, 4, 2))
+
+    # Existing documents are left alone without --overwrite
+    assert run_main(monkeypatch, "create", str(tmp_path), "--grid", "4x2") == 0
+    assert "0 created, 2 skipped" in capsys.readouterr().out
+
+    assert run_main(monkeypatch, "validate", str(tmp_path)) == 0
+    capsys.readouterr()
+    assert run_main(monkeypatch, "stats", str(tmp_path), "--json") == 0
+    summary = json.loads(capsys.readouterr().out)
+    assert summary["documents"] == 2
+    assert summary["valid"] == 2
+    assert summary["grids"] == {"4x2": 2}
+    assert summary["pieces"] == 16
+    # 200x150 in 4x2 pieces is 50x75 per piece, 300x100 is 75x50
+    assert summary["piece_width"] == {"min": 50.0, "median": 62.5, "max": 75.0}
+    assert summary["piece_height"]["min"] == 50.0
+    assert summary["piece_height"]["max"] == 75.0
+    assert summary["edited"] == 0
+    assert summary["max_offset"] == 0.0
+
+
+def test_create_document_worker(tmp_path, images):
+    output_dir = str(tmp_path / "out")
+    os.makedirs(output_dir)
+    result = puzzle_batch.create_document((images[1], 3, 1, output_dir, False, "binary"))
+    assert result == {"path": os.path.join(output_dir, "second.puz.json"), "status": "created"}
+    document = read_document(result["path"])
+    assert document["grid_file"]["encoding"] == "raw"
+
+    missing = puzzle_batch.create_document((str(tmp_path / "missing.png"), 3, 1, output_dir, False, "json"))
+    assert missing["status"] == "failed"
+
+
+def test_check_document_reports_problems(tmp_path, images):
+    document_path = str(tmp_path / "first.puz.json")
+    grid_points = uniform_grid_points(200, 150, 2, 2)
+    grid_points[1, 1] = (80, 60)
+    write_document(document_path, make_document(images[0], 2, 2, grid_points))
+    result = puzzle_batch.check_document(document_path)
+    assert result["status"] == "valid"
+    assert result["max_offset"] == 20.0
+    assert result["image_size"] == (200, 150)
+
+    # A grid that doesn't match the dimensions, points off the image, and a document that isn't JSON
+    write_document(document_path, make_document(images[0], 3, 2, grid_points))
+    assert "expected (3, 4, 2)" in puzzle_batch.check_document(document_path)["problems"][0]
+    grid_points[0, 0] = (-10, 0)
+    write_document(document_path, make_document(images[0], 2, 2, grid_points))
+    assert "beyond the 200x150 image" in puzzle_batch.check_document(document_path)["problems"][0]
+    with open(document_path, "w") as document_file:
+        document_file.write('{"grid_x": 2, "grid_')
+    corrupt = puzzle_batch.check_document(document_path)
+    assert corrupt["status"] == "invalid"
+    assert corrupt["problems"]
+
+    summary = puzzle_batch.summarise([corrupt, puzzle_batch.check_document(str(tmp_path / "missing.puz.json"))])
+    assert (summary["documents"], summary["valid"], summary["invalid"]) == (2, 0, 2)
+    assert "piece_width" not in summary
+
+
+def test_validate_fails_on_a_corrupt_document(tmp_path, images, monkeypatch, capsys):
+    assert run_main(monkeypatch, "create", str(tmp_path), "--grid", "2x2") == 0
+    with open(tmp_path / "second.puz.json", "w") as document_file:
+        document_file.write("not a document")
+    capsys.readouterr()
+    assert run_main(monkeypatch, "validate", str(tmp_path)) == 1
+    output = capsys.readouterr().out
+    assert "second.puz.json:" in output
+    assert "invalid        1" in output
+
+
+@pytest.mark.parametrize("value, expected", [("10x8", (10, 8)), ("1X1", (1, 1)), ("1000x1000", (1000, 1000))])
+def test_parse_grid(value, expected):
+    assert puzzle_batch.parse_grid(value) == expected
+
+
+@pytest.mark.parametrize("value", ["0x5", "1001x1", "10", "10x8x2", "axb"])
+def test_parse_grid_rejects(value):
+    with pytest.raises(argparse.ArgumentTypeError):
+        puzzle_batch.parse_grid(value)
+
+
+def test_convert_round_trip_leaves_no_grid_file(tmp_path, images, monkeypatch, capsys):
+    assert run_main(monkeypatch, "create", images[0], "--grid", "3x3") == 0
+    document_path = str(tmp_path / "first.puz.json")
+    expected = read_document(document_path)["grid_points"]
+    for grid_format, status in (("binary", "converted"), ("binary", "skipped"), ("compressed", "converted"),
+                                ("json", "converted")):
+        result = puzzle_batch.convert_document((document_path, grid_format))
+        assert result["status"] == status
+        assert puzzle_batch.check_document(document_path)["status"] == "valid"
+    assert sorted(os.listdir(tmp_path)) == ["first.png", "first.puz.json", "second.png"]
+    assert read_document(document_path)["grid_points"] == expected
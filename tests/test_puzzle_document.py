@@ -0,0 +1,172 @@
+import os
+import json
+
+import numpy as np
+import pytest
+
+import puzzle_document as document
+
+
+def test_uniform_grid_points():
+    grid_points = document.uniform_grid_points(100, 50, 3, 2)
+    assert grid_points.shape == (3, 4, 2)
+    np.testing.assert_array_equal(grid_points[0, :, 0], [0, 33, 66, 100])
+    np.testing.assert_array_equal(grid_points[:, 0, 1], [0, 25, 50])
+    assert document.uniform_grid_points(100, 50, 0, 2).shape == (0, 0, 2)
+
+
+def test_document_path_for(tmp_path):
+    assert document.document_path_for("photos/img001.jpg", str(tmp_path)) == str(tmp_path / "img001.puz.json")
+    assert document.grid_file_path_for("photos/img001.puz.json") == "photos/img001.puzgrid"
+
+
+@pytest.mark.parametrize("squares", [3, 120])
+def test_write_read_round_trip(tmp_path, squares):
+    path = str(tmp_path / "image.puz.json")
+    grid_points = document.uniform_grid_points(640, 480, squares, squares) * 0.5 + 0.25
+    document.write_document(path, document.make_document("C:\\photos\\image.jpg", squares, squares, grid_points,
+                                                         zoom_value=0.5, geometry=(10, 20, 800, 600)))
+    assert not os.path.exists(path + ".tmp")
+    # Large grids are written on one line, small ones indented
+    with open(path) as document_file:
+        assert (len(document_file.read().splitlines()) == 1) == (squares > 100)
+
+    document_data = document.read_document(path)
+    assert document_data["image_path"] == "C:/photos/image.jpg"
+    assert (document_data["window_x"], document_data["window_width"]) == (10, 800)
+    assert document.document_grid_format(document_data) == "json"
+    np.testing.assert_array_equal(document.document_grid_points(document_data, path), grid_points)
+    assert document.validate_document(document_data, (640, 480), path) == []
+
+
+def test_read_document_rejects_invalid_structure(tmp_path):
+    path = str(tmp_path / "image.puz.json")
+    for content in ('["grid_x"]', '{"grid_x": 2, "grid_y": 2}'):
+        with open(path, "w") as document_file:
+            document_file.write(content)
+        with pytest.raises(ValueError):
+            document.read_document(path)
+    with open(path, "w") as document_file:
+        document_file.write('{"grid_x": 2,')
+    with pytest.raises(ValueError):
+        document.read_document(path)
+
+
+def test_write_document_rejects_unknown_format(tmp_path):
+    with pytest.raises(ValueError):
+        document.write_document(str(tmp_path / "image.puz.json"),
+                                document.make_document("image.jpg", 1, 1, np.zeros((2, 2, 2))), "xml")
+
+
+def test_validate_document():
+    grid_points = document.uniform_grid_points(100, 100, 2, 2)
+    document_data = document.make_document("image.jpg", 2, 2, grid_points.tolist())
+    assert document.validate_document(document_data, (100, 100)) == []
+    assert "beyond the 50x100 image" in document.validate_document(document_data, (50, 100))[0]
+
+    assert "grid_x must be an integer" in document.validate_document(dict(document_data, grid_x=True))[0]
+    assert "grid_y must be an integer" in document.validate_document(dict(document_data, grid_y=1001))[0]
+    assert "zoom_value" in document.validate_document(dict(document_data, zoom_value=0))[0]
+    assert "expected (3, 2, 2)" in document.validate_document(dict(document_data, grid_x=1))[0]
+    grid_points[1, 1, 0] = np.nan
+    assert "NaN" in document.validate_document(dict(document_data, grid_points=grid_points.tolist()))[0]
+    assert "grid_points:" in document.validate_document(dict(document_data, grid_points=[[1, 2], [3, 4]]))[0]
+    # No grid points at all is a document without a grid, which is fine
+    assert document.validate_document(dict(document_data, grid_points=[])) == []
+
+
+def test_piece_sizes():
+    grid_points = document.uniform_grid_points(90, 40, 3, 2)
+    grid_points[0, 1, 0] = 20
+    widths, heights = document.piece_sizes(grid_points)
+    np.testing.assert_array_equal(widths, [[20, 40, 30], [30, 30, 30]])
+    np.testing.assert_array_equal(heights, [[20, 20, 20], [20, 20, 20]])
+
+
+def test_document_json_is_plain(tmp_path):
+    path = str(tmp_path / "image.puz.json")
+    document.write_document(path, document.make_document("image.jpg", 1, 1, np.zeros((2, 2, 2))))
+    with open(path) as document_file:
+        assert json.load(document_file)["grid_points"] == [[[0.0, 0.0], [0.0, 0.0]], [[0.0, 0.0], [0.0, 0.0]]]
+
+
+def awkward_grid_points():
+    """A grid whose values only survive a bit-exact round trip: NaN, -0.0, infinities, tiny and huge values"""
+    grid_points = document.uniform_grid_points(1000, 800, 7, 5) + np.random.default_rng(1).normal(0, 3, (6, 8, 2))
+    grid_points[0, 0] = (-0.0, 0.0)
+    grid_points[1, 2] = (np.nan, -np.inf)
+    grid_points[2, 3] = (5e-324, 1.7976931348623157e308)
+    grid_points[3, 4, 0] = np.frombuffer(b"\x01\x00\x00\x00\x00\x00\xf8\x7f", dtype="<f8")[0]  # NaN with a payload
+    return grid_points
+
+
+@pytest.mark.parametrize("encoding", ["raw", "delta-zlib"])
+def test_grid_file_round_trip_is_bit_exact(tmp_path, encoding):
+    path = str(tmp_path / "image.puzgrid")
+    grid_points = awkward_grid_points()
+    document.write_grid_file(path, grid_points, encoding)
+    assert not os.path.exists(path + ".tmp")
+    loaded = document.read_grid_file(path)
+    assert loaded.shape == grid_points.shape
+    assert loaded.dtype == np.float64
+    np.testing.assert_array_equal(np.asarray(loaded).view(np.uint64), grid_points.view(np.uint64))
+    if encoding == "raw":
+        # Memory-mapped copy-on-write: editing the points leaves the file alone
+        assert isinstance(loaded, np.memmap)
+        loaded[0, 0] = (1.0, 2.0)
+        np.testing.assert_array_equal(document.read_grid_file(path)[0, 0].view(np.uint64),
+                                      grid_points[0, 0].view(np.uint64))
+        assert not isinstance(document.owned_grid_points(loaded[1:]), np.memmap)
+
+
+@pytest.mark.parametrize("encoding", ["raw", "delta-zlib"])
+def test_empty_grid_file(tmp_path, encoding):
+    path = str(tmp_path / "image.puzgrid")
+    document.write_grid_file(path, document.empty_grid_points(), encoding)
+    assert document.read_grid_file(path).shape == (0, 0, 2)
+
+
+@pytest.mark.parametrize("encoding", ["raw", "delta-zlib"])
+def test_damaged_grid_file_raises_value_error(tmp_path, encoding):
+    path = str(tmp_path / "image.puzgrid")
+    document.write_grid_file(path, awkward_grid_points(), encoding)
+    with open(path, "rb") as grid_file:
+        content = grid_file.read()
+    damaged = {
+        "magic": b"PUZGRIDX" + content[8:],
+        "short prefix": content[:6],
+        "header": content[:12] + b"#" + content[13:],
+        "truncated data": content[:-40],
+    }
+    if encoding == "delta-zlib":
+        damaged["compressed data"] = content[:-30] + bytes(30)
+    for name, content in damaged.items():
+        with open(path, "wb") as grid_file:
+            grid_file.write(content)
+        with pytest.raises(ValueError):
+            document.read_grid_file(path)
+
+
+def test_unknown_grid_file_encoding(tmp_path):
+    with pytest.raises(ValueError):
+        document.write_grid_file(str(tmp_path / "image.puzgrid"), np.zeros((2, 2, 2)), "lz4")
+
+
+def test_grid_format_conversions_leave_no_grid_file_behind(tmp_path):
+    path = str(tmp_path / "image.puz.json")
+    grid_file_path = document.grid_file_path_for(path)
+    grid_points = awkward_grid_points()
+    document_data = document.make_document("image.jpg", 7, 5, grid_points)
+
+    document.write_document(path, document_data, "json")
+    assert not os.path.exists(grid_file_path)
+    for grid_format in ("binary", "compressed", "json", "compressed", "binary", "json"):
+        loaded = document.read_document(path)
+        loaded["grid_points"] = document.owned_grid_points(document.document_grid_points(loaded, path))
+        document.write_document(path, loaded, grid_format)
+        assert os.path.exists(grid_file_path) == (grid_format != "json")
+        loaded = document.read_document(path)
+        assert document.document_grid_format(loaded) == grid_format
+        # JSON keeps NaN and -0.0 but not NaN payloads, so compare values there
+        np.testing.assert_array_equal(document.document_grid_points(loaded, path), grid_points)
+    assert sorted(os.listdir(tmp_path)) == ["image.puz.json"]
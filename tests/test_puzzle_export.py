@@ -0,0 +1,104 @@
+import os
+import json
+
+import numpy as np
+import pytest
+from PyQt5.QtCore import Qt
+from PyQt5.QtGui import QImage, QColor
+
+import puzzle_export as export
+from puzzle_document import write_document, make_document, uniform_grid_points
+
+
+def write_gradient(path, width=120, height=90):
+    """An image whose every pixel tells where it is: red is x, green is y"""
+    image = QImage(width, height, QImage.Format_RGB32)
+    for y in range(height):
+        for x in range(width):
+            image.setPixelColor(x, y, QColor(x * 2, y * 2, 100))
+    assert image.save(str(path))
+    return str(path)
+
+
+def test_quad_bounds_are_clipped_whole_pixels():
+    quad = [(10.5, 3.2), (30.1, 2.9), (31.0, 20.0), (9.9, 20.4)]
+    assert export.quad_bounds(quad, 100, 100) == (9, 2, 31, 21)
+    assert export.quad_bounds([(-5, -5), (200, 300)], 100, 80) == (0, 0, 100, 80)
+
+
+def test_band_tasks_cover_every_row_once():
+    grid_points = uniform_grid_points(100, 100, 3, 10)
+    bands = export.band_tasks(grid_points, 2)
+    assert [first_row for first_row, _ in bands] == [0, 1, 2, 3, 4, 5, 6, 7, 8, 9]
+    for first_row, band_points in bands:
+        # Each band includes the grid point row of its bottom edge
+        np.testing.assert_array_equal(band_points, grid_points[first_row:first_row + len(band_points)])
+    assert sum(len(band_points) - 1 for _, band_points in bands) == 10
+    # About BANDS_PER_WORKER bands per worker
+    assert len(export.band_tasks(grid_points, 1)) == 5
+
+
+def test_cut_band_of_a_uniform_grid(tmp_path):
+    image_path = write_gradient(tmp_path / "image.png")
+    grid_points = uniform_grid_points(120, 90, 3, 2)
+    pieces = list(export.cut_band(image_path, grid_points[1:], 1, (120, 90)))
+    assert [(row, col) for row, col, _, _ in pieces] == [(1, 0), (1, 1), (1, 2)]
+    for row, col, (left, top, right, bottom), piece in pieces:
+        assert (left, top, right, bottom) == (col * 40, 45, col * 40 + 40, 90)
+        assert (piece.width(), piece.height()) == (right - left, bottom - top)
+        # Axis-aligned cells cover their whole box, with the source pixels in place
+        for x, y in ((0, 0), (17, 30), (39, 44)):
+            color = piece.pixelColor(x, y)
+            assert (color.red(), color.green(), color.alpha()) == ((left + x) * 2, (top + y) * 2, 255)
+
+
+def test_cut_band_of_a_skewed_cell(tmp_path):
+    image_path = write_gradient(tmp_path / "image.png")
+    grid_points = np.array([[[20.0, 10.0], [80.0, 10.0]], [[40.0, 70.0], [100.0, 70.0]]])
+    (row, col, bounds, piece), = export.cut_band(image_path, grid_points, 0, (120, 90))
+    assert (row, col, bounds) == (0, 0, (20, 10, 100, 70))
+    # Outside the parallelogram is transparent, inside is the image
+    assert piece.pixelColor(2, 55).alpha() == 0
+    assert piece.pixelColor(77, 3).alpha() == 0
+    inside = piece.pixelColor(40, 30)
+    assert (inside.red(), inside.green(), inside.alpha()) == (120, 80, 255)
+
+
+def test_cut_band_skips_cells_outside_the_image(tmp_path):
+    image_path = write_gradient(tmp_path / "image.png")
+    grid_points = np.array([[[130.0, 0.0], [150.0, 0.0]], [[130.0, 20.0], [150.0, 20.0]]])
+    assert list(export.cut_band(image_path, grid_points, 0, (120, 90))) == []
+
+
+def test_export_pieces_index(tmp_path):
+    image_path = write_gradient(tmp_path / "image.png")
+    grid_points = uniform_grid_points(120, 90, 3, 2)
+    grid_points[1, 1] = (45.5, 50.25)
+    document_path = str(tmp_path / "image.puz.json")
+    write_document(document_path, make_document(image_path, 3, 2, grid_points))
+
+    piece_dir, count = export.export_pieces(document_path, str(tmp_path / "out"), workers=1)
+    assert piece_dir == str(tmp_path / "out" / "image")
+    assert count == 6
+    with open(os.path.join(piece_dir, "pieces.json")) as index_file:
+        index = json.load(index_file)
+    assert (index["image_width"], index["image_height"], index["grid_x"], index["grid_y"]) == (120, 90, 3, 2)
+    for piece in index["pieces"]:
+        row, col = piece["row"], piece["col"]
+        left, top, right, bottom = export.quad_bounds(export.cell_quad(grid_points, row, col), 120, 90)
+        assert (piece["x"], piece["y"], piece["width"], piece["height"]) == (left, top, right - left, bottom - top)
+        assert piece["file"] == f"r{row}_c{col}.png"
+        image = QImage(os.path.join(piece_dir, piece["file"]))
+        assert (image.width(), image.height()) == (piece["width"], piece["height"])
+    # The moved point widens the four cells around it
+    cells = {(piece["row"], piece["col"]): piece for piece in index["pieces"]}
+    assert (cells[0, 0]["width"], cells[0, 0]["height"]) == (46, 51)
+    assert cells[1, 1]["x"] == 40
+
+
+def test_export_needs_a_grid(tmp_path):
+    image_path = write_gradient(tmp_path / "image.png")
+    document_path = str(tmp_path / "image.puz.json")
+    write_document(document_path, make_document(image_path, 0, 0, np.zeros((0, 0, 2))))
+    with pytest.raises(ValueError):
+        export.export_pieces(document_path, str(tmp_path / "out"), workers=1)
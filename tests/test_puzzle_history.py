@@ -0,0 +1,128 @@
+import numpy as np
+
+from puzzle_history import GridHistory, COALESCE_DISTANCE
+
+
+def grid(rows=4, cols=5):
+    ys, xs = np.meshgrid(np.arange(rows) * 10.0, np.arange(cols) * 10.0, indexing="ij")
+    return np.stack([xs, ys], axis=-1)
+
+
+def move(history, grid_points, row, col, delta):
+    """Move one point in place and record it, as an endpoint drag does"""
+    index = row * grid_points.shape[1] + col
+    before = grid_points[row, col].copy()
+    grid_points[row, col] += delta
+    history.record([index], before, grid_points[row, col])
+
+
+def test_undo_redo_in_place():
+    history = GridHistory()
+    grid_points = grid()
+    original = grid_points.copy()
+    move(history, grid_points, 1, 1, (30, 0))
+    edited = grid_points.copy()
+    new = grid_points.copy()
+    new[:, 2] += 5
+    history.record_change(grid_points, new)
+    grid_points[...] = new
+    assert len(history.undo_stack) == 2
+    assert len(history.undo_stack[-1].indices) == 4  # Only the moved column is stored
+
+    view = grid_points
+    np.testing.assert_array_equal(history.undo(grid_points), [2, 7, 12, 17])
+    assert grid_points is view
+    np.testing.assert_array_equal(grid_points, edited)
+    history.undo(grid_points)
+    np.testing.assert_array_equal(grid_points, original)
+    assert history.undo(grid_points) is None
+    assert not history.can_undo() and history.can_redo()
+
+    history.redo(grid_points)
+    history.redo(grid_points)
+    np.testing.assert_array_equal(grid_points, new)
+    assert history.redo(grid_points) is None
+
+
+def test_edits_that_move_nothing_are_not_recorded():
+    history = GridHistory()
+    grid_points = grid()
+    history.record_change(grid_points, grid_points.copy())
+    move(history, grid_points, 0, 0, (0, 0))
+    assert not history.can_undo()
+
+
+def test_new_edit_clears_redo():
+    history = GridHistory()
+    grid_points = grid()
+    move(history, grid_points, 1, 1, (30, 0))
+    move(history, grid_points, 2, 2, (0, 30))
+    history.undo(grid_points)
+    assert history.can_redo()
+    bytes_with_redo = history.nbytes
+    move(history, grid_points, 1, 3, (-20, 0))
+    assert not history.can_redo()
+    assert history.nbytes == bytes_with_redo
+    assert len(history.undo_stack) == 2
+
+
+def test_oldest_steps_are_evicted_over_max_bytes():
+    grid_points = grid()
+    probe = GridHistory()
+    move(probe, grid_points, 1, 1, (30, 0))
+    step_bytes = probe.nbytes
+
+    history = GridHistory(max_bytes=3 * step_bytes)
+    grid_points = grid()
+    for col in range(5):
+        move(history, grid_points, 1, col, (30, 0))
+    assert len(history.undo_stack) == 3
+    assert history.nbytes == 3 * step_bytes
+    np.testing.assert_array_equal([edit.indices[0] for edit in history.undo_stack], [7, 8, 9])
+    # Undoing everything that is left stops short of the evicted steps
+    while history.undo(grid_points) is not None:
+        pass
+    np.testing.assert_array_equal(grid_points[1, :2, 0], [30, 40])
+
+    # A single step larger than max_bytes is still kept
+    small = GridHistory(max_bytes=1)
+    grid_points = grid()
+    small.record_change(grid_points, grid_points + 50)
+    assert len(small.undo_stack) == 1
+
+
+def test_nudges_coalesce_with_each_other():
+    history = GridHistory()
+    grid_points = grid()
+    original = grid_points.copy()
+    for _ in range(5):
+        move(history, grid_points, 2, 2, (COALESCE_DISTANCE, -1))
+    assert len(history.undo_stack) == 1
+    history.undo(grid_points)
+    np.testing.assert_array_equal(grid_points, original)
+
+
+def test_nudge_after_a_drag_is_its_own_step():
+    history = GridHistory()
+    grid_points = grid()
+    original = grid_points.copy()
+    move(history, grid_points, 2, 2, (300, 0))
+    dragged = grid_points.copy()
+    move(history, grid_points, 2, 2, (1, 1))
+    move(history, grid_points, 2, 2, (1, 0))
+    assert len(history.undo_stack) == 2
+
+    # Undo takes back just the nudges, then the drag
+    history.undo(grid_points)
+    np.testing.assert_array_equal(grid_points, dragged)
+    history.undo(grid_points)
+    np.testing.assert_array_equal(grid_points, original)
+
+
+def test_nudges_of_other_points_do_not_coalesce():
+    history = GridHistory()
+    grid_points = grid()
+    move(history, grid_points, 2, 2, (1, 0))
+    move(history, grid_points, 2, 3, (1, 0))
+    move(history, grid_points, 2, 3, (COALESCE_DISTANCE + 1, 0))
+    assert len(history.undo_stack) == 3
@@ -0,0 +1,286 @@
+import numpy as np
+import pytest
+from PyQt5.QtCore import Qt, QEvent, QPoint, QRect, QSize
+from PyQt5.QtGui import QImage, QPixmap, QColor, QPainter
+from PyQt5.QtTest import QTest
+from PyQt5.QtWidgets import QApplication, QScrollArea
+
+import puzzle_pieces_maker as puzzle
+from puzzle_document import uniform_grid_points
+from test_drag_overlay import mouse_event
+
+
+def pixmap(width, height=1):
+    result = QPixmap(width, height)
+    result.fill(Qt.white)
+    return result
+
+
+@pytest.fixture
+def widget(qt_app):
+    widget = puzzle.ImageGridWidget()
+    image = QImage(400, 300, QImage.Format_RGB32)
+    image.fill(Qt.white)
+    widget.set_image_and_grid(image, 8, 6)
+    widget.show()
+    qt_app.processEvents()
+    yield widget
+    widget.close()
+
+
+def test_scaled_pixmap_cache_evicts_least_recently_used(qt_app):
+    entry_bytes = puzzle.ScaledPixmapCache.pixmap_bytes(pixmap(100))
+    cache = puzzle.ScaledPixmapCache(max_bytes=3 * entry_bytes)
+    for zoom in (0.25, 0.5, 1.0):
+        cache.put(cache.make_key(zoom), pixmap(100))
+    # Using an entry makes it the most recent one
+    assert cache.get(cache.make_key(0.25)) is not None
+    cache.put(cache.make_key(2.0), pixmap(100))
+    assert len(cache) == 3
+    assert cache.total_bytes == 3 * entry_bytes
+    assert cache.get(cache.make_key(0.5)) is None
+    assert cache.get(cache.make_key(0.25)) is not None
+    assert (cache.hits, cache.misses) == (2, 1)
+
+    # Replacing an entry doesn't count it twice; one bigger than the whole budget isn't kept
+    cache.put(cache.make_key(2.0), pixmap(100))
+    assert cache.total_bytes == 3 * entry_bytes
+    cache.put(cache.make_key(4.0), pixmap(400))
+    assert cache.get(cache.make_key(4.0)) is None
+    assert len(cache) == 3
+
+    # Float noise in the zoom lands on the same entry
+    assert cache.make_key(0.1 + 0.2) == cache.make_key(0.3)
+    cache.clear("other image")
+    assert (len(cache), cache.total_bytes, cache.source_key) == (0, 0, "other image")
+
+
+def test_find_nearest_prefers_larger_scales(qt_app):
+    cache = puzzle.ScaledPixmapCache()
+    small, large, fast = pixmap(10), pixmap(40), pixmap(20)
+    cache.put(cache.make_key(0.5), small)
+    cache.put(cache.make_key(2.0), large)
+    cache.put(cache.make_key(1.0, Qt.FastTransformation), fast)
+    assert cache.find_nearest(0.6) is large
+    assert cache.find_nearest(3.0) is large
+    assert cache.find_nearest(0.1) is small
+    assert cache.find_nearest(1.0, Qt.FastTransformation) is fast
+    # Looking for a fallback is not a lookup
+    assert (cache.hits, cache.misses) == (0, 0)
+
+
+def test_zoom_levels_are_scaled_once(widget):
+    widget.set_zoom(0.5)
+    half = widget.scaled_pixmap
+    assert (half.width(), half.height()) == (200, 150)
+    widget.set_zoom(1.5)
+    widget.set_zoom(0.5)
+    assert widget.scaled_pixmap is half
+    # 100% from opening the image, 50% and 150%
+    assert len(widget.scaled_cache) == 3
+
+    # The grid is painted over the cached image, so changing it doesn't re-render anything
+    generation = widget.render_generation
+    widget.set_grid(20, 10)
+    widget.set_crop_mode(True)
+    assert widget.render_generation == generation
+    assert widget.scaled_pixmap is half
+
+
+def test_zoom_preview_coalesces_into_one_smooth_render(widget):
+    for zoom in (0.6, 0.7, 0.8):
+        widget.set_zoom(zoom, preview=True)
+        assert widget.preview_active
+        assert widget.smooth_render_timer.isActive()
+    assert widget.scaled_pixmap.width() == 320
+    # Only 100% has been scaled smoothly so far
+    assert len(widget.scaled_cache) == 1
+
+    QTest.qWait(widget.smooth_render_timer.interval() + 100)
+    assert not widget.preview_active
+    assert not widget.smooth_render_timer.isActive()
+    assert widget.scaled_cache.get(widget.scaled_cache.make_key(0.8)) is widget.scaled_pixmap
+    assert len(widget.scaled_cache) == 2
+
+    # Previewing a zoom that's already scaled shows the smooth scale straight away
+    widget.set_zoom(1.0, preview=True)
+    assert not widget.preview_active
+    generation = widget.render_generation
+    widget.finish_zoom_preview()
+    assert widget.render_generation == generation
+
+
+def test_tiled_rendering_rasterizes_only_the_exposed_tiles(widget):
+    image = QImage(400, 300, QImage.Format_RGB32)
+    image.fill(Qt.blue)
+    painter = QPainter(image)
+    painter.fillRect(140, 10, 20, 20, Qt.red)
+    painter.end()
+    widget.set_image_and_grid(image, 8, 6)
+    widget.render_mode = 'tiled'
+    widget.set_zoom(2.0)
+    assert widget.tiled_rendering and widget.scaled_pixmap is None
+    QApplication.processEvents()
+    widget.tile_cache.clear(None)
+
+    # The second tile of the first row, at 2x: display 256..511 is source 128..255
+    widget.repaint(QRect(widget.padding + 300, widget.padding + 30, 50, 50))
+    assert len(widget.tile_cache) == 1
+    tile = widget.get_image_tile(1, 0, Qt.SmoothTransformation)
+    assert (tile.width(), tile.height()) == (256, 256)
+    assert tile.toImage().pixelColor(2 * 150 - 256, 2 * 20) == QColor(Qt.red)
+    assert tile.toImage().pixelColor(100, 200) == QColor(Qt.blue)
+
+    # Edge tiles are cut to the image: 800x600 is 4x3 tiles, the last one 32 pixels wide and 88 high
+    widget.repaint(widget.rect())
+    assert len(widget.tile_cache) == 12
+    last = widget.get_image_tile(3, 2, Qt.SmoothTransformation)
+    assert (last.width(), last.height()) == (32, 88)
+
+
+def run_image_loader(qt_app, file_path, preview_size=None):
+    """Decode on the worker thread; returns the signals it sent, in order"""
+    worker = puzzle.ImageLoadWorker(file_path, preview_size)
+    events = []
+    worker.preview_ready.connect(lambda image: events.append(("preview", image.width(), image.height())))
+    worker.image_ready.connect(lambda image: events.append(("image", image.width(), image.height())))
+    worker.load_failed.connect(lambda message: events.append(("failed",)))
+    worker.start()
+    assert worker.wait(10000)
+    qt_app.processEvents()
+    return events
+
+
+def test_image_loader_sends_the_preview_first(qt_app, tmp_path):
+    image = QImage(600, 400, QImage.Format_RGB32)
+    image.fill(Qt.darkGreen)
+    file_path = str(tmp_path / "image.png")
+    assert image.save(file_path)
+
+    events = run_image_loader(qt_app, file_path, QSize(150, 150))
+    assert events == [("preview", 150, 100), ("image", 600, 400)]
+    # No preview of an image that fits already
+    assert run_image_loader(qt_app, file_path, QSize(800, 800)) == [("image", 600, 400)]
+    assert run_image_loader(qt_app, str(tmp_path / "missing.png"), QSize(150, 150)) == [("failed",)]
+
+
+def test_preview_is_shown_at_full_size(widget):
+    preview = QImage(100, 75, QImage.Format_RGB32)
+    preview.fill(Qt.gray)
+    widget.set_image_source(preview, image_size=QSize(400, 300))
+    widget.update_display()
+    assert not widget.has_full_image()
+    # The zoom and grid still refer to the full resolution
+    assert (widget.scaled_pixmap.width(), widget.scaled_pixmap.height()) == (400, 300)
+    assert widget.grid_points[-1, -1].tolist() == [400, 300]
+
+
+def nearest_handle(handles, x, y, step_x=1, step_y=1):
+    """Brute-force DragHandles.find: squared distance to the nearest drawable handle under (x, y), or None"""
+    half = handles.HANDLE_SIZE // 2
+    dx = x - handles.positions[:, 0]
+    dy = y - handles.positions[:, 1]
+    hits = (dx >= -half) & (dx < half) & (dy >= -half) & (dy < half)
+    hits &= handles.drawable(np.arange(len(handles)), step_x, step_y)
+    return int((dx * dx + dy * dy)[hits].min()) if hits.any() else None
+
+
+def found_distance(handles, index, x, y):
+    if index is None:
+        return None
+    hx, hy = handles.positions[index]
+    return int((x - hx) ** 2 + (y - hy) ** 2)
+
+
+@pytest.mark.parametrize("zoom, steps", [(1.0, (1, 1)), (0.05, (1, 1)), (0.05, (4, 2))])
+def test_drag_handles_find_matches_brute_force(zoom, steps):
+    rng = np.random.default_rng(3)
+    grid_x, grid_y = 60, 40
+    grid_points = uniform_grid_points(1200, 800, grid_x, grid_y) + rng.normal(0, 3, (grid_y + 1, grid_x + 1, 2))
+    rows, cols = np.mgrid[0:grid_y + 1, 0:grid_x + 1]
+    handles = puzzle.DragHandles(rows.ravel(), cols.ravel(), grid_x, grid_y)
+    handles.update_positions(grid_points, zoom, 10)
+
+    # Points all over the grid, and some right around handles where several overlap when zoomed out
+    probes = rng.uniform(0, 1220 * zoom, (300, 2)).astype(int)
+    probes = np.concatenate([probes, handles.positions[::37] + rng.integers(-5, 6, (len(handles.positions[::37]), 2))])
+    for x, y in probes.tolist():
+        index = handles.find(QPoint(x, y), *steps)
+        assert found_distance(handles, index, x, y) == nearest_handle(handles, x, y, *steps)
+
+    # In-place moves are found at their new position, before and after the index is rebuilt
+    for _ in range(handles.MAX_DISPLACED + 2):
+        index = int(rng.integers(len(handles)))
+        handles.move_handle(index, rng.uniform(0, 1200, 2), zoom, 10)
+        x, y = handles.positions[index].tolist()
+        assert found_distance(handles, handles.find(QPoint(x, y)), x, y) == 0
+    assert len(handles.displaced) <= handles.MAX_DISPLACED
+
+    rect = QRect(int(100 * zoom), int(50 * zoom), int(500 * zoom), int(300 * zoom))
+    x, y = handles.positions[:, 0], handles.positions[:, 1]
+    inside = ((x >= rect.left()) & (x <= rect.right()) & (y >= rect.top()) & (y <= rect.bottom())
+              & handles.drawable(np.arange(len(handles)), *steps))
+    assert sorted(handles.in_rect(rect, *steps).tolist()) == np.flatnonzero(inside).tolist()
+
+
+def test_drag_endpoint_moves_one_point_in_place(widget):
+    widget.set_drag_endpoints_mode(True)
+    grid_points = widget.grid_points
+    committed = grid_points.copy()
+    position = QPoint(widget.padding + 200, widget.padding + 150)
+    widget.mousePressEvent(mouse_event(QEvent.MouseButtonPress, position))
+    assert widget.is_dragging
+    for offset in (QPoint(3, 1), QPoint(7, -5)):
+        widget.mouseMoveEvent(mouse_event(QEvent.MouseMove, position + offset))
+    widget.mouseReleaseEvent(mouse_event(QEvent.MouseButtonRelease, position + QPoint(7, -5), Qt.NoButton))
+
+    assert widget.grid_points is grid_points
+    assert grid_points[3, 4].tolist() == [207, 145]
+    moved = np.zeros(grid_points.shape[:2], dtype=bool)
+    moved[3, 4] = True
+    np.testing.assert_array_equal(grid_points[~moved], committed[~moved])
+    # The handle follows the point
+    handles = widget.get_drag_handles()
+    index = handles.find(position + QPoint(8, -4))
+    assert handles.positions[index].tolist() == [position.x() + 7, position.y() - 5]
+    assert handles.find(position) is None
+
+    assert widget.undo()
+    np.testing.assert_array_equal(widget.grid_points, committed)
+    assert handles.find(position) is not None
+    assert widget.redo()
+    assert grid_points[3, 4].tolist() == [207, 145]
+
+
+def test_drag_endpoints_leaves_the_perimeter_alone(widget):
+    widget.set_drag_endpoints_mode(True)
+    widget.mousePressEvent(mouse_event(QEvent.MouseButtonPress, QPoint(widget.padding, widget.padding + 150)))
+    assert not widget.is_dragging
+
+
+def test_resizing_does_not_re_render(qt_app, widget):
+    scroll_area = QScrollArea()
+    scroll_area.setWidget(widget)
+    scroll_area.resize(300, 200)
+    scroll_area.show()
+    qt_app.processEvents()
+    generation = widget.render_generation
+
+    for size in ((900, 700), (150, 120), (640, 480)):
+        scroll_area.resize(*size)
+        qt_app.processEvents()
+    # Resizing the widget itself just puts its size back
+    widget.resize(50, 50)
+    qt_app.processEvents()
+    assert (widget.width(), widget.height()) == (400 + 2 * widget.padding, 300 + 2 * widget.padding)
+    assert widget.render_generation == generation
+
+    # A preview zoom resizes the widget too, and still renders only once, as a preview
+    widget.set_zoom(1.3, preview=True)
+    qt_app.processEvents()
+    assert widget.render_generation == generation + 1
+    assert widget.preview_active
+    widget.finish_zoom_preview()
+    assert widget.render_generation == generation + 2
+    # Hand the widget back for the fixture to close
+    scroll_area.takeWidget()
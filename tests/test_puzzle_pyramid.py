@@ -0,0 +1,107 @@
+import os
+
+import pytest
+from PyQt5.QtCore import Qt
+from PyQt5.QtGui import QImage, QColor
+
+import puzzle_pyramid as pyramid
+
+
+def write_image(path, width=600, height=300):
+    image = QImage(width, height, QImage.Format_RGB32)
+    image.fill(Qt.white)
+    for x in range(0, width, 7):
+        for y in range(height):
+            image.setPixelColor(x, y, QColor(x % 256, y % 256, 40))
+    assert image.save(str(path))
+    return image.convertToFormat(QImage.Format_RGB888)
+
+
+def test_build_and_read_tiles(tmp_path):
+    image_path = str(tmp_path / "huge.png")
+    image = write_image(image_path)
+    document_path = str(tmp_path / "huge.puz.json")
+    pyramid_path = pyramid.pyramid_path_for(document_path, image_path)
+    assert pyramid_path == str(tmp_path / "huge.pyramid")
+
+    assert pyramid.build_pyramid(image, image_path, pyramid_path, tile_size=128) == pyramid_path
+    tiles = pyramid.TilePyramid.open_for(document_path, image_path)
+    try:
+        assert (tiles.width, tiles.height) == (600, 300)
+        assert [(level["cols"], level["rows"]) for level in tiles.levels] == [(5, 3), (3, 2), (2, 1), (1, 1)]
+        assert tiles.level_for_zoom(1.0) == 0
+        assert tiles.level_for_zoom(0.3) == 1
+        assert tiles.level_for_zoom(0.01) == 3
+        tile = tiles.tile_image(0, 1, 2)
+        assert tile.pixelColor(5, 3) == image.pixelColor(128 + 5, 256 + 3)
+    finally:
+        tiles.close()
+
+    # A changed source image makes the pyramid stale
+    os.utime(image_path, (1, 1))
+    assert pyramid.TilePyramid.open_for(document_path, image_path) is None
+
+
+def test_cancelled_build_leaves_nothing(tmp_path):
+    image_path = str(tmp_path / "huge.png")
+    image = write_image(image_path)
+    pyramid_path = str(tmp_path / "huge.pyramid")
+    calls = []
+
+    def is_cancelled():
+        calls.append(None)
+        return len(calls) > 2
+
+    assert pyramid.build_pyramid(image, image_path, pyramid_path, tile_size=128, is_cancelled=is_cancelled) is None
+    assert os.listdir(tmp_path) == ["huge.png"]
+
+
+def test_viewer_builds_the_pyramid_in_the_background(qt_app, tmp_path, monkeypatch):
+    import puzzle_pieces_maker as puzzle
+
+    monkeypatch.setattr(puzzle, "PYRAMID_MIN_PIXELS", 100 * 100)
+    image_path = str(tmp_path / "huge.png")
+    write_image(image_path)
+    viewer = puzzle.PuzzleGridViewer()
+    assert viewer.open_image_from_path(image_path, (4, 2))
+    viewer.wait_for_image_load()
+
+    document_path = str(tmp_path / "huge.puz.json")
+    assert viewer._save_document_to_file(document_path, notify=False)
+    # The save returns before the pyramid is written; the decoded image is shown meanwhile
+    assert viewer.pyramid_builder is not None
+    viewer.wait_for_pyramid_build()
+    widget = viewer.image_widget
+    assert widget.image_pyramid is not None
+    assert widget.image_pyramid.path == str(tmp_path / "huge.pyramid")
+    assert widget.has_full_image()
+
+    # Saving again finds the pyramid up to date
+    assert viewer._save_document_to_file(document_path, notify=False)
+    assert viewer.pyramid_builder is None
+    viewer.autosave.discard()
+    viewer.close()
+
+
+def test_viewer_ignores_a_pyramid_of_another_image(qt_app, tmp_path, monkeypatch):
+    import puzzle_pieces_maker as puzzle
+
+    monkeypatch.setattr(puzzle, "PYRAMID_MIN_PIXELS", 100 * 100)
+    first, second = str(tmp_path / "first.png"), str(tmp_path / "second.png")
+    write_image(first)
+    write_image(second, 300, 300)
+    viewer = puzzle.PuzzleGridViewer()
+    viewer.open_image_from_path(first, (4, 2))
+    viewer.wait_for_image_load()
+    assert viewer._save_document_to_file(str(tmp_path / "first.puz.json"), notify=False)
+    worker = viewer.pyramid_builder
+
+    # Opening another image before the pyramid is ready: the build is not swapped in
+    viewer.open_image_from_path(second, (2, 2))
+    viewer.wait_for_image_load()
+    worker.wait()
+    qt_app.processEvents()
+    assert viewer.image_widget.image_pyramid is None
+    viewer.cancel_pyramid_build(wait=True)
+    viewer.autosave.discard()
+    viewer.close()
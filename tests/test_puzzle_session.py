@@ -0,0 +1,107 @@
+import json
+
+import numpy as np
+import pytest
+from PyQt5.QtCore import Qt, QEvent, QPoint
+from PyQt5.QtGui import QImage, QKeyEvent
+
+import puzzle_pieces_maker as puzzle
+import puzzle_session as session_module
+from test_drag_overlay import mouse_event
+
+
+def make_widget(qt_app):
+    widget = puzzle.ImageGridWidget()
+    image = QImage(400, 300, QImage.Format_RGB32)
+    image.fill(Qt.white)
+    widget.set_image_and_grid(image, 8, 6)
+    widget.show()
+    qt_app.processEvents()
+    return widget
+
+
+def drag(widget, start, *positions):
+    widget.mousePressEvent(mouse_event(QEvent.MouseButtonPress, start))
+    for position in positions:
+        widget.mouseMoveEvent(mouse_event(QEvent.MouseMove, position))
+    widget.mouseReleaseEvent(mouse_event(QEvent.MouseButtonRelease, positions[-1], Qt.NoButton))
+
+
+@pytest.fixture
+def recorded(qt_app, tmp_path):
+    """A session of crop and endpoint drags, zooms, a cancelled drag and undo/redo, saved to a file"""
+    widget = make_widget(qt_app)
+    recorder = session_module.SessionRecorder(widget, str(tmp_path / "missing.png"), str(tmp_path / "edit.session"))
+    widget.session_recorder = recorder
+
+    widget.set_zoom(1.5, preview=True)
+    widget.finish_zoom_preview()
+    padding = widget.padding
+    widget.set_crop_mode(True)
+    drag(widget, QPoint(padding + 600, padding + 450), QPoint(padding + 590, padding + 437),
+         QPoint(padding + 571, padding + 433))
+    widget.mousePressEvent(mouse_event(QEvent.MouseButtonPress, QPoint(padding, padding)))
+    widget.mouseMoveEvent(mouse_event(QEvent.MouseMove, QPoint(padding + 13, padding + 4)))
+    widget.keyPressEvent(QKeyEvent(QEvent.KeyPress, Qt.Key_Escape, Qt.NoModifier))
+    widget.set_crop_mode(False)
+    widget.set_drag_endpoints_mode(True)
+    point = widget.grid_points[2, 3] * widget.zoom_factor + padding
+    start = QPoint(int(point[0]), int(point[1]))
+    drag(widget, start, start + QPoint(9, 4), start + QPoint(17, -3))
+    widget.undo()
+    widget.redo()
+    widget.set_zoom(0.75)
+
+    recorder.save()
+    widget.session_recorder = None
+    yield widget, recorder.file_path
+    widget.close()
+
+
+def test_replay_reproduces_the_recorded_grid(qt_app, recorded):
+    widget, file_path = recorded
+    session = session_module.load_session(file_path)
+    assert session["final_grid_digest"] == session_module.grid_digest(widget.grid_points)
+    assert {key: session["events"][0][key] for key in ("type", "zoom", "preview")} == {
+        "type": "zoom", "zoom": 1.5, "preview": True}
+    assert {"press", "move", "release", "key", "undo", "redo"} <= {event["type"] for event in session["events"]}
+    # The edits did change the grid
+    assert session["grid_points"] != widget.grid_points.tolist()
+
+    # Replayed over a blank stand-in, as the image file isn't there
+    replay_widget = make_widget(qt_app)
+    try:
+        result = session_module.replay_session(replay_widget, session, app=qt_app)
+        assert result.matches
+        np.testing.assert_array_equal(replay_widget.grid_points, widget.grid_points)
+        assert result.perf.summary()["release"]["count"] == 2
+    finally:
+        replay_widget.close()
+
+
+def test_replay_detects_a_different_grid(qt_app, recorded):
+    _, file_path = recorded
+    session = session_module.load_session(file_path)
+    # The last move of the crop drag, a pixel to the right
+    [event for event in session["events"] if event["type"] == "move"][1]["x"] += 1
+    replay_widget = make_widget(qt_app)
+    try:
+        assert not session_module.replay_session(replay_widget, session).matches
+    finally:
+        replay_widget.close()
+
+
+def test_grid_digest_is_bit_exact():
+    grid_points = np.arange(24, dtype=np.float64).reshape(3, 4, 2)
+    digest = session_module.grid_digest(grid_points)
+    assert session_module.grid_digest(grid_points.astype(np.float32)) == digest
+    assert session_module.grid_digest(grid_points.reshape(4, 3, 2)) != digest
+    grid_points[1, 1, 0] = np.nextafter(grid_points[1, 1, 0], np.inf)
+    assert session_module.grid_digest(grid_points) != digest
+
+
+def test_load_session_checks_the_version(tmp_path):
+    file_path = tmp_path / "old.session"
+    file_path.write_text(json.dumps({"version": session_module.SESSION_VERSION + 1, "events": []}))
+    with pytest.raises(ValueError):
+        session_module.load_session(str(file_path))
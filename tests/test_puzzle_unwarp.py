@@ -0,0 +1,99 @@
+import argparse
+
+import numpy as np
+import pytest
+
+import puzzle_unwarp as unwarp
+from puzzle_document import uniform_grid_points
+
+
+UNIT_SQUARE = np.array([(0.0, 0.0), (1.0, 0.0), (1.0, 1.0), (0.0, 1.0)])
+
+
+def apply(matrix, point):
+    x, y, w = matrix @ (point[0], point[1], 1.0)
+    return x / w, y / w
+
+
+def random_pixels(height, width, seed=0):
+    return np.random.default_rng(seed).integers(0, 256, (height, width, 4), dtype=np.uint8)
+
+
+@pytest.mark.parametrize("corners", [
+    [(10, 20), (110, 20), (110, 70), (10, 70)],          # axis-aligned
+    [(10, 20), (110, 30), (120, 80), (20, 70)],          # parallelogram
+    [(0, 0), (100, 10), (90, 120), (-5, 80)],            # perspective
+])
+def test_square_to_quad_hits_the_corners(corners):
+    corners = np.array(corners, dtype=float)
+    matrix = unwarp.square_to_quad(corners)
+    assert matrix.shape == (3, 3)
+    for square_corner, corner in zip(UNIT_SQUARE, corners):
+        np.testing.assert_allclose(apply(matrix, square_corner), corner, atol=1e-9)
+
+
+def test_collapsed_quad_maps_affinely():
+    # All four corners on one line: the map takes three of them, and stays finite
+    corners = np.array([(0, 0), (10, 0), (30, 0), (20, 0)], dtype=float)
+    matrix = unwarp.square_to_quad(corners)
+    assert np.isfinite(matrix).all()
+    assert matrix[2].tolist() == [0, 0, 1]
+    for index in (0, 1, 3):
+        np.testing.assert_allclose(apply(matrix, UNIT_SQUARE[index]), corners[index])
+
+
+def test_square_to_quad_is_vectorised():
+    grid_points = uniform_grid_points(300, 200, 3, 2) + np.random.default_rng(1).normal(0, 4, (3, 4, 2))
+    corners = unwarp.cell_corners(grid_points)
+    assert corners.shape == (2, 3, 4, 2)
+    np.testing.assert_array_equal(corners[1, 2], [grid_points[1, 2], grid_points[1, 3], grid_points[2, 3],
+                                                  grid_points[2, 2]])
+    matrices = unwarp.square_to_quad(corners)
+    assert matrices.shape == (2, 3, 3, 3)
+    np.testing.assert_allclose(matrices[1, 2], unwarp.square_to_quad(corners[1, 2]))
+    # A parallelogram's map is affine
+    assert unwarp.square_to_quad(np.array([(0, 0), (4, 1), (6, 5), (2, 4)], dtype=float))[2, :2].tolist() == [0, 0]
+
+
+@pytest.mark.parametrize("method", unwarp.METHODS)
+def test_unwarping_axis_aligned_cells_is_the_identity(method):
+    pixels = random_pixels(60, 80)
+    grid_points = uniform_grid_points(80, 60, 4, 3)
+    rectified = unwarp.rectify_image(pixels, grid_points, 20, 20, method)
+    np.testing.assert_array_equal(rectified, pixels)
+
+    first_row, cells = next(unwarp.unwarp_rows(pixels, grid_points, 20, 20, method))
+    assert first_row == 0
+    np.testing.assert_array_equal(cells[1, 2], pixels[20:40, 40:60])
+
+
+def test_unwarp_rows_in_batches(monkeypatch):
+    pixels = random_pixels(60, 80)
+    grid_points = uniform_grid_points(80, 60, 4, 3)
+    monkeypatch.setattr(unwarp, "BATCH_PIXELS", 4 * 20 * 20)
+    batches = list(unwarp.unwarp_rows(pixels, grid_points, 20, 20))
+    assert [first_row for first_row, _ in batches] == [0, 1, 2]
+    np.testing.assert_array_equal(unwarp.rectify_image(pixels, grid_points, 20, 20), pixels)
+
+
+def test_unwarp_halves_a_doubled_cell():
+    # Each output pixel of a 2x downscale samples the corner shared by four source pixels
+    pixels = np.zeros((4, 4, 4), dtype=np.uint8)
+    pixels[:2, :2] = 200
+    grid_points = uniform_grid_points(4, 4, 1, 1)
+    rectified = unwarp.rectify_image(pixels, grid_points, 2, 2)
+    np.testing.assert_array_equal(rectified[..., 0], [[200, 0], [0, 0]])
+
+
+def test_unknown_method():
+    with pytest.raises(ValueError):
+        next(unwarp.unwarp_rows(random_pixels(4, 4), uniform_grid_points(4, 4, 1, 1), 2, 2, "affine"))
+
+
+def test_default_cell_size_and_parse():
+    grid_points = uniform_grid_points(300, 200, 4, 5)
+    assert unwarp.default_cell_size(grid_points) == (75, 40)
+    assert unwarp.parse_cell_size("64X48") == (64, 48)
+    for value in ("64", "0x5", "ax5"):
+        with pytest.raises(argparse.ArgumentTypeError):
+            unwarp.parse_cell_size(value)